@@ -0,0 +1,104 @@
+"""
+HTTP-клиент ботов к Flask API: одна долгоживущая aiohttp-сессия на процесс и склейка постов в пачки.
+
+Раньше каждый вызов API открывал свой ClientSession, то есть новое TCP-соединение на каждый пост.
+Здесь соединения переиспользуются (keep-alive, ограничение числа соединений, таймауты), а посты,
+пришедшие почти одновременно (альбом, пачка репостов), уходят одним POST /api/posts/batch.
+"""
+import asyncio
+
+import aiohttp
+
+
+class ApiClient:
+    """
+    base_url — адрес API (…/api); connections — максимум одновременных соединений к нему;
+    timeout / connect_timeout — таймаут запроса целиком и установки соединения, сек;
+    batch_window — сколько секунд ждать попутчиков для пачки постов; batch_max — максимум постов в пачке.
+    """
+
+    def __init__(self, base_url, connections=10, timeout=30.0, connect_timeout=5.0,
+                 keepalive_timeout=60.0, batch_window=0.2, batch_max=50):
+        self.base_url = base_url.rstrip('/')
+        self.connections = connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self.batch_window = batch_window
+        self.batch_max = max(1, batch_max)
+        self._session = None
+        self._pending = []
+        self._flush_task = None
+        self._stats = {'posts': 0, 'batches': 0, 'failed_batches': 0}
+
+    def session(self):
+        """Общая сессия (создаётся при первом запросе, внутри работающего event loop)."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def send_post(self, post):
+        """
+        Отправить пост (словарь полей POST /api/posts). Посты, пришедшие в течение batch_window,
+        уходят одним запросом. Возвращает True, если API принял пост (новый или уже существующий).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((post, future))
+        if len(self._pending) >= self.batch_max:
+            self._flush_now()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        self._flush_now()
+
+    def _flush_now(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._send_batch(batch))
+
+    async def post_batch(self, posts):
+        """POST /api/posts/batch сразу, без склейки. Возвращает HTTP-статус или None, если API недоступен."""
+        self._stats['batches'] += 1
+        self._stats['posts'] += len(posts)
+        try:
+            async with self.session().post(self.url('posts/batch'), json={'posts': posts}) as resp:
+                if resp.status != 200:
+                    self._stats['failed_batches'] += 1
+                    print(f"Ошибка API posts/batch: HTTP {resp.status}")
+                return resp.status
+        except Exception as e:
+            self._stats['failed_batches'] += 1
+            print(f"Ошибка связи с API: {e}")
+            return None
+
+    async def _send_batch(self, batch):
+        ok = await self.post_batch([post for post, _ in batch]) == 200
+        for _, future in batch:
+            if not future.done():
+                future.set_result(ok)
+
+    def stats(self):
+        data = dict(self._stats)
+        data['pending'] = len(self._pending)
+        return data
+
+    async def close(self):
+        """Отправить накопленные посты и закрыть сессию (при остановке бота)."""
+        if self._pending:
+            batch, self._pending = self._pending, []
+            if self._flush_task is not None:
+                self._flush_task.cancel()
+                self._flush_task = None
+            await self._send_batch(batch)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -1,22 +1,52 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, session, redirect, url_for
+from flask import (
+    Flask, Response, g, has_request_context, render_template, jsonify, request, send_from_directory, session, redirect,
+    url_for,
+)
+from werkzeug.http import http_date
+from werkzeug.security import safe_join
 from flask_cors import CORS
+import click
 from dotenv import load_dotenv
 import os
 import hashlib
 import hmac
 import secrets
+import shutil
+import base64
+import functools
 from datetime import datetime, timedelta
 import json
+import mimetypes
+import queue
+import threading
+import time
 import traceback
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError, URLError
+import zlib
+from contextlib import contextmanager
 
 # PostgreSQL
 import psycopg2
 import psycopg2.extras
-
-# Если при старте PostgreSQL недоступен (таймаут и т.п.), сервер всё равно запустится для проверки вёрстки
-_db_available = True
+import psycopg2.sql
+
+from db_pool import ConnectionPool, PoolTimeout
+from db_breaker import CLOSED as BREAKER_CLOSED, CircuitBreaker, DatabaseUnavailable
+from db_trace import TracedConnection, add_observer as add_sql_observer, statement_kind
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, SIZE_BUCKETS, Registry
+from reaction_buffer import ReactionBuffer
+from json_codec import CodecJSONProvider, JSONCodec
+from compression import available_encodings, compress, negotiate as negotiate_encoding
+from slow_queries import SlowQueryLog
+from request_profiler import MODES as PROFILE_MODES, ProfileStore, RequestProfile
+from live_events import EVENTS_CHANNEL, NOTIFY_PAYLOAD_LIMIT, EventHub
+from feed_cache import FeedCache
+from avatar_fetcher import AvatarFetcher, fetch_user_photo
+from login_tokens import is_signed_token, make_token, sweep as sweep_expired_login_tokens, verify_token
+from media_files import (
+    hash_file, hashed_name, is_hashed_name, multipart_byteranges, normalize_ranges, parse_byte_ranges, post_media_fields,
+    stream_file_range,
+)
+import migrate
 
 load_dotenv()
 
@@ -36,6 +66,89 @@ TELEGRAM_BOT_USERNAME = os.environ.get('TELEGRAM_BOT_USERNAME', '').strip().lstr
 LOGIN_TOKEN_SECRET = os.environ.get('LOGIN_TOKEN_SECRET', '')
 SITE_BASE_URL = (os.environ.get('SITE_BASE_URL') or '').rstrip('/')
 LOGIN_TOKEN_TTL_SECONDS = 600  # 10 минут
+# table — случайный токен в таблице login_tokens; signed — подписанный HMAC токен без записи в базу
+LOGIN_TOKEN_MODE = os.environ.get('LOGIN_TOKEN_MODE', 'table').strip().lower()
+LOGIN_TOKEN_SWEEP_SECONDS = int(os.environ.get('LOGIN_TOKEN_SWEEP_SECONDS', 300))  # как часто чистить просроченные
+# Аватарки пользователей качаются в фоне: адрес Bot API (можно локальную замену), таймаут запроса,
+# сколько секунд считать скачанную аватарку свежей и сколько потоков качают
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+AVATAR_FETCH_TIMEOUT = float(os.environ.get('AVATAR_FETCH_TIMEOUT', 5))
+AVATAR_TTL = int(os.environ.get('AVATAR_TTL', 7 * 24 * 3600))
+AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 2))
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 30))  # постов на страницу ленты по умолчанию
+POSTS_BATCH_MAX = int(os.environ.get('POSTS_BATCH_MAX', 500))  # постов в одном POST /api/posts/batch
+FEED_PAGE_SIZE_MAX = 100
+# Колонки posts с данными о медиа — в порядке аргументов post_media_fields()
+POST_MEDIA_COLUMNS = ('media_variants', 'media_width', 'media_height', 'media_duration', 'media_placeholder', 'media_poster')
+
+# Отложенная запись счётчиков реакций: клик пишет только user_reactions, счётчики постов
+# сбрасываются пачками раз в REACTIONS_FLUSH_MS или каждые REACTIONS_FLUSH_EVENTS кликов
+REACTIONS_WRITE_BEHIND = os.environ.get('REACTIONS_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+REACTIONS_FLUSH_MS = int(os.environ.get('REACTIONS_FLUSH_MS', 200))
+REACTIONS_FLUSH_EVENTS = int(os.environ.get('REACTIONS_FLUSH_EVENTS', 500))
+
+# Живые обновления (/api/stream): сколько SSE-клиентов держит один процесс и как часто слать пинг
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 100))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+# Отдача /uploads: '' — сам Flask (с Range), 'x-accel' — nginx по X-Accel-Redirect (internal location
+# MEDIA_ACCEL_PREFIX с alias на папку uploads), 'x-sendfile' — Apache mod_xsendfile / lighttpd
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '').strip().lower()
+MEDIA_ACCEL_PREFIX = '/' + os.environ.get('MEDIA_ACCEL_PREFIX', '/_uploads/').strip('/') + '/'
+
+# Кеш страниц ленты в памяти процесса (0 страниц — выключен)
+FEED_CACHE_PAGES = int(os.environ.get('FEED_CACHE_PAGES', 64))
+FEED_CACHE_TTL = float(os.environ.get('FEED_CACHE_TTL', 30))
+
+# Кодировщик JSON ответов: auto — orjson, если установлен, иначе стандартный json (см. json_codec.py)
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto').strip().lower()
+
+# Сжатие ответов по Accept-Encoding: gzip и brotli (если установлен пакет brotli). COMPRESS_LEVEL —
+# уровень gzip (0 — не сжимать), COMPRESS_BROTLI_QUALITY — качество brotli; ответы меньше
+# COMPRESS_MIN_SIZE байт отдаются как есть. Лента сжимается всегда и из кеша (feed_cache.py)
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/javascript', 'text/javascript', 'text/html', 'text/css', 'text/plain',
+    'image/svg+xml',
+}
+
+# Пул соединений с PostgreSQL (размеры подбираются по /api/admin/db-pool)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # ожидание свободного соединения, сек
+DB_POOL_MAX_USES = int(os.environ.get('DB_POOL_MAX_USES', 1000))  # пересоздать после N выдач
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', 1800))  # пересоздать старше N секунд
+DB_POOL_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', 10))  # SELECT 1, если простаивало дольше
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 3))  # connect_timeout libpq, сек
+
+# Автомат отключения БД: после DB_BREAKER_FAILURES неудачных подключений подряд API сразу отвечает 503,
+# а фоновая проба проверяет базу с паузой от DB_BREAKER_BASE_DELAY до DB_BREAKER_MAX_DELAY секунд
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 3))
+DB_BREAKER_BASE_DELAY = float(os.environ.get('DB_BREAKER_BASE_DELAY', 1))
+DB_BREAKER_MAX_DELAY = float(os.environ.get('DB_BREAKER_MAX_DELAY', 30))
+
+# GET /metrics (формат Prometheus): если задан METRICS_TOKEN — только с заголовком Authorization: Bearer <токен>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Журнал медленных SQL (JSON lines, см. slow_queries.py): запросы дольше SLOW_QUERY_MS мс (0 — выкл.),
+# для доли SLOW_QUERY_EXPLAIN_RATE из них — EXPLAIN (ANALYZE, BUFFERS); N+1 — если один и тот же запрос
+# выполнен за HTTP-запрос больше N_PLUS_ONE_THRESHOLD раз (0 — не проверять). SLOW_QUERY_LOG пуст — stdout
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '')
+
+# Профилирование запроса по требованию (request_profiler.py): администратор добавляет к URL ?_profile=1
+# (или =cprofile), скрипт — заголовок X-Profile с токеном из POST /api/admin/profiles/token.
+# Последние PROFILE_KEEP профилей хранятся в PROFILE_DIR (0 — профилирование выключено)
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(BASE_DIR, 'profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 1))  # шаг семплирования
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))  # дольше семплер не пишет (SSE)
+PROFILE_TOKEN_TTL = int(os.environ.get('PROFILE_TOKEN_TTL', 3600))
+PROFILE_TOKEN_SECRET = 'profile:' + app.secret_key  # свой ключ: токен входа не годится как токен профилирования
 
 # ID администраторов из .env (ADMIN_TELEGRAM_IDS=id1,id2,...)
 ADMIN_TELEGRAM_IDS = set()
@@ -54,18 +167,174 @@ if SITE_BASE_URL.lower().startswith('https'):
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+json_codec = JSONCodec(JSON_ENCODER)
+app.json = CodecJSONProvider(app, json_codec)
+
+# Кодировки ответов в порядке предпочтения; личной ленте выгоднее gzip — у него досжимается только хвост
+COMPRESS_ENCODINGS = available_encodings()
+FEED_USER_ENCODINGS = ('gzip',) + tuple(e for e in COMPRESS_ENCODINGS if e != 'gzip')
+
+
+def response_encoding(encodings=COMPRESS_ENCODINGS):
+    """Кодировка сжатия для текущего запроса по Accept-Encoding или None (не сжимать)."""
+    if not COMPRESS_LEVEL:
+        return None
+    return negotiate_encoding(request.headers.get('Accept-Encoding'), encodings)
+
+
+# Метрики процесса для GET /metrics. Под gunicorn у каждого воркера свои значения
+metrics = Registry()
+HTTP_REQUESTS = metrics.counter('postshet_http_requests_total', 'HTTP-запросы', ('method', 'route', 'status'))
+HTTP_DURATION = metrics.histogram(
+    'postshet_http_request_duration_seconds', 'Время обработки запроса (без передачи потокового тела)',
+    ('method', 'route'),
+)
+HTTP_IN_FLIGHT = metrics.gauge('postshet_http_requests_in_flight', 'Запросы, обрабатываемые прямо сейчас')
+HTTP_RESPONSE_SIZE = metrics.histogram(
+    'postshet_http_response_size_bytes', 'Размер тела ответа (если известен заранее)', ('route',), SIZE_BUCKETS,
+)
+DB_POOL_ACQUIRE = metrics.histogram('postshet_db_pool_acquire_seconds', 'Ожидание соединения из пула')
+SQL_DURATION = metrics.histogram(
+    'postshet_sql_query_duration_seconds', 'Время SQL-запроса', ('route', 'statement'),
+)
+SQL_PER_REQUEST = metrics.histogram(
+    'postshet_sql_queries_per_request', 'SQL-запросов на один HTTP-запрос', ('route',), (0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+
+
+def _request_route():
+    """Метка маршрута: шаблон правила (/api/posts/<int:post_id>), а не URL — число значений ограничено."""
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _observe_sql(cursor, sql, params, seconds):
+    if has_request_context():
+        route = _request_route()
+        g.sql_queries = g.get('sql_queries', 0) + 1
+    else:
+        route = 'background'  # сброс буфера реакций, загрузка аватарок, CLI
+    SQL_DURATION.observe(seconds, route, statement_kind(sql))
+
+
+add_sql_observer(_observe_sql)
+
+slow_queries = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, N_PLUS_ONE_THRESHOLD, SLOW_QUERY_LOG)
+if SLOW_QUERY_MS or N_PLUS_ONE_THRESHOLD:
+    add_sql_observer(slow_queries.observe)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Пул соединений процесса (создаётся лениво; после fork пул сам переинициализируется)."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    DATABASE_URL,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_uses=DB_POOL_MAX_USES,
+                    max_age=DB_POOL_MAX_AGE,
+                    check_idle=DB_POOL_CHECK_IDLE,
+                    connect_kwargs={'connect_timeout': DB_CONNECT_TIMEOUT, 'connection_factory': TracedConnection},
+                )
+    return _db_pool
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _ensure_schema(conn):
+    """Лениво, при первом обращении к БД: применить новые миграции (если схема актуальна — один SELECT)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        applied = migrate.upgrade(conn)
+        if applied:
+            print(f"Схема БД обновлена до версии {applied[-1]}")
+        _schema_ready = True
+
+
+_prefilled_pid = None
+
+
+def _prefill_pool(pool):
+    """Один раз на процесс, после первого удачного подключения: открыть заранее DB_POOL_MIN соединений."""
+    global _prefilled_pid
+    if _prefilled_pid == os.getpid():
+        return
+    _prefilled_pid = os.getpid()
+    try:
+        pool.prefill()
+    except psycopg2.Error as e:
+        print(f"Warning: не удалось открыть DB_POOL_MIN соединений заранее: {e}")
+
+
+def _probe_db():
+    """Фоновая проба автомата отключения: новое соединение из пула + SELECT 1 + проверка схемы."""
+    with get_db_pool().connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT 1')
+        conn.rollback()
+        _ensure_schema(conn)
+
+
+db_breaker = CircuitBreaker(
+    _probe_db,
+    failure_threshold=DB_BREAKER_FAILURES,
+    base_delay=DB_BREAKER_BASE_DELAY,
+    max_delay=DB_BREAKER_MAX_DELAY,
+)
+
 
+@contextmanager
 def get_db():
     """
-    Открыть соединение с PostgreSQL.
-    Использует DATABASE_URL из окружения.
+    Взять соединение с PostgreSQL из пула: with get_db() as conn: ...
+    При выходе из блока незакоммиченная транзакция откатывается, соединение возвращается в пул.
+    Если база недоступна, бросает DatabaseUnavailable (API отвечает 503 + Retry-After).
     """
-    global _db_available
-    if not _db_available:
-        raise RuntimeError("База данных недоступна (при старте было подключение по таймауту). Разбудите БД на Render или проверьте сеть.")
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL не задан в окружении")
-    return psycopg2.connect(DATABASE_URL)
+    db_breaker.before_call()
+    pool = get_db_pool()
+    pc = None
+    try:
+        started = time.perf_counter()
+        pc = pool.acquire()
+        DB_POOL_ACQUIRE.observe(time.perf_counter() - started)
+        _ensure_schema(pc.conn)
+    except psycopg2.OperationalError as e:
+        if pc is not None:
+            pool.release(pc, discard=True)
+        raise db_breaker.record_failure(e) from e
+    except BaseException:
+        if pc is not None:
+            pool.release(pc)
+        raise
+    db_breaker.record_success()
+    _prefill_pool(pool)
+    discard = False
+    try:
+        yield pc.conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        discard = True
+        if pc.conn.closed:
+            # Соединение оборвалось посреди запроса — вероятно, база ушла
+            db_breaker.record_failure(e)
+        raise
+    finally:
+        pool.release(pc, discard)
 
 
 def verify_telegram_login_hash(data, bot_token):
@@ -88,132 +357,419 @@ def get_current_user_id():
 
 
 def fetch_telegram_user_photo(telegram_id):
-    """Скачать фото профиля пользователя из Telegram Bot API, сохранить в uploads, вернуть URL или None."""
+    """Скачать фото профиля пользователя из Telegram Bot API в uploads. URL, '' — фото нет, None — ошибка."""
     if not TELEGRAM_BOT_TOKEN:
         return None
+    return fetch_user_photo(telegram_id, TELEGRAM_BOT_TOKEN, UPLOAD_FOLDER, TELEGRAM_API_BASE, AVATAR_FETCH_TIMEOUT)
+
+
+def _store_avatar(telegram_id, photo_url):
+    """Результат фоновой загрузки аватарки -> users. При ошибке ничего не пишем: попробуем при следующем входе."""
+    if photo_url is None:
+        return
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(
+            'UPDATE users SET photo_url = %s, photo_fetched_at = CURRENT_TIMESTAMP WHERE telegram_id = %s',
+            (photo_url, telegram_id),
+        )
+        conn.commit()
+
+
+avatar_fetcher = AvatarFetcher(fetch_telegram_user_photo, _store_avatar, workers=AVATAR_WORKERS)
+
+
+# Свежесть считает PostgreSQL: photo_fetched_at записан его CURRENT_TIMESTAMP
+AVATAR_FRESH_SQL = "photo_fetched_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'"
+
+_login_sweep_lock = threading.Lock()
+_login_sweep_at = 0.0
+
+
+def sweep_login_tokens_periodically():
+    """Раз в LOGIN_TOKEN_SWEEP_SECONDS (на процесс) удалить просроченные токены входа и использованные nonce."""
+    global _login_sweep_at
+    now = time.monotonic()
+    if now - _login_sweep_at < LOGIN_TOKEN_SWEEP_SECONDS or not _login_sweep_lock.acquire(blocking=False):
+        return
     try:
-        api_base = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}'
-        with urlopen(Request(f'{api_base}/getUserProfilePhotos?user_id={telegram_id}&limit=1')) as r:
-            data = json.loads(r.read().decode())
-        if not data.get('ok') or not data.get('result', {}).get('photos'):
-            return None
-        photos = data['result']['photos'][0]
-        file_id = photos[-1]['file_id']
-        with urlopen(Request(f'{api_base}/getFile?file_id={file_id}')) as r:
-            file_data = json.loads(r.read().decode())
-        if not file_data.get('ok'):
-            return None
-        file_path = file_data['result']['file_path']
-        download_url = f'https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}'
-        ext = os.path.splitext(file_path)[1] or '.jpg'
-        filename = f'user_avatar_{telegram_id}{ext}'
-        full_path = os.path.join(UPLOAD_FOLDER, filename)
-        with urlopen(Request(download_url)) as r:
-            with open(full_path, 'wb') as f:
-                f.write(r.read())
-        return f'/uploads/{filename}'
-    except (HTTPError, URLError, OSError, KeyError, IndexError, TypeError, ValueError):
-        return None
+        _login_sweep_at = now
+        with get_db() as conn:
+            sweep_expired_login_tokens(conn.cursor(), LOGIN_TOKEN_TTL_SECONDS)
+            conn.commit()
+    except Exception as e:
+        print(f"Warning: не удалось почистить токены входа: {e}")
+    finally:
+        _login_sweep_lock.release()
 
 
-# Инициализация БД (PostgreSQL)
-def init_db():
-    conn = get_db()
+def reconcile_reaction_counts(c, dry_run=False):
+    """
+    Пересчитать posts.reaction_counts из user_reactions одним UPDATE (set-based, без цикла по постам).
+    Возвращает расхождения: [(post_id, было, стало), ...]. При dry_run ничего не меняет.
+    """
+    fresh = """
+        SELECT p.id, COALESCE(agg.counts, '{}'::jsonb) AS counts
+        FROM posts p
+        LEFT JOIN (
+            SELECT post_id, jsonb_object_agg(reaction_type, n) AS counts
+            FROM (
+                SELECT post_id, reaction_type, count(*) AS n
+                FROM user_reactions
+                GROUP BY post_id, reaction_type
+            ) t
+            GROUP BY post_id
+        ) agg ON agg.post_id = p.id
+    """
+    if dry_run:
+        c.execute(
+            f"""
+            SELECT p.id, p.reaction_counts, fresh.counts
+            FROM posts p JOIN ({fresh}) fresh ON fresh.id = p.id
+            WHERE p.reaction_counts IS DISTINCT FROM fresh.counts
+            ORDER BY p.id
+            """
+        )
+    else:
+        # old — снимок строки до обновления, чтобы вернуть «было» в RETURNING
+        c.execute(
+            f"""
+            UPDATE posts p
+            SET reaction_counts = fresh.counts
+            FROM posts old, ({fresh}) fresh
+            WHERE old.id = p.id AND fresh.id = p.id
+              AND old.reaction_counts IS DISTINCT FROM fresh.counts
+            RETURNING p.id, old.reaction_counts, p.reaction_counts
+            """
+        )
+    return sorted((row[0], row[1], row[2]) for row in c.fetchall())
+
+
+def bump_version(conn, sequence='feed_version_seq'):
+    """
+    Сдвинуть версию (feed_version_seq / channel_version_seq). Вызывать ПОСЛЕ commit изменения:
+    тогда читатель, увидевший новую версию, гарантированно увидит и новые данные.
+    """
     c = conn.cursor()
+    c.execute(f"SELECT nextval('{sequence}')")
+    version = c.fetchone()[0]
+    conn.commit()
+    return version
 
-    # Таблица постов
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS posts (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT UNIQUE,
-            media_type TEXT,
-            media_path TEXT,
-            caption TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
 
-    # Таблица реакций (агрегат счётчиков по типу на пост)
+def bump_version_for_post(conn, post_id):
+    """
+    Сдвинуть версию ленты после изменения счётчиков поста и прочитать счётчики уже ПОСЛЕ сдвига
+    (второй запрос — новый снимок). Тогда патч кеша до версии N содержит все изменения с версиями <= N,
+    даже если параллельные клики сдвигали версию не в порядке commit. Возвращает (version, counts | None).
+    """
+    c = conn.cursor()
     c.execute(
         """
-        CREATE TABLE IF NOT EXISTS reactions (
-            id SERIAL PRIMARY KEY,
-            post_id INTEGER,
-            reaction_type TEXT,
-            count INTEGER DEFAULT 1,
-            FOREIGN KEY (post_id) REFERENCES posts(id)
-        )
-        """
+        SELECT nextval('feed_version_seq');
+        SELECT currval('feed_version_seq'), (SELECT reaction_counts FROM posts WHERE id = %s)
+        """,
+        (post_id,),
     )
+    version, counts = c.fetchone()
+    conn.commit()
+    return version, counts
 
-    # Реакции пользователей: одна запись на (пост, пользователь)
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_reactions (
-            post_id INTEGER NOT NULL,
-            user_id TEXT NOT NULL,
-            reaction_type TEXT NOT NULL,
-            PRIMARY KEY (post_id, user_id),
-            FOREIGN KEY (post_id) REFERENCES posts(id)
-        )
-        """
-    )
 
-    # Таблица информации о канале
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS channel_info (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            avatar_url TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
+def current_version(c, sequence='feed_version_seq'):
+    """Текущая версия — читать ДО основного запроса."""
+    c.execute(f'SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM {sequence}')
+    row = c.fetchone()
+    return row['version'] if isinstance(row, dict) else row[0]
+
+
+def make_etag(version, *parts):
+    """Сильный ETag: версия данных + всё, от чего зависит ответ (параметры, пользователь для my_reaction)."""
+    raw = '|'.join(str(p) for p in (version, *parts) if p is not None)
+    digest = hmac.new(app.secret_key.encode(), raw.encode(), hashlib.sha256).hexdigest()[:16]
+    return f'{version}-{digest}'
+
+
+def not_modified(etag):
+    """Ответ 304, если клиент прислал тот же If-None-Match, иначе None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    resp = app.response_class(status=304)
+    return with_validator(resp, etag)
+
+
+def with_validator(resp, etag):
+    """Проставить ETag; кешировать можно, но каждый раз с проверкой (ответ зависит от сессии)."""
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.add('Cookie')
+    return resp
+
+
+def notify_event(c, event_type, **data):
+    """Событие для /api/stream: уйдёт подписчикам после commit текущей транзакции."""
+    data['type'] = event_type
+    c.execute('SELECT pg_notify(%s, %s)', (EVENTS_CHANNEL, json.dumps(data, ensure_ascii=False, default=str)))
+
+
+def notify_events(c, events):
+    """Несколько событий [(тип, {данные})] одним запросом — для пачек, где notify_event был бы N+1."""
+    if not events:
+        return
+    psycopg2.extras.execute_values(
+        c,
+        psycopg2.sql.SQL('SELECT pg_notify({channel}, v.payload) FROM (VALUES %s) v(payload)').format(
+            channel=psycopg2.sql.Literal(EVENTS_CHANNEL),
+        ),
+        [(json.dumps({**data, 'type': event_type}, ensure_ascii=False, default=str),) for event_type, data in events],
+        page_size=len(events),
     )
 
-    # Таблица пользователей (привязка Telegram)
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT UNIQUE NOT NULL,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            photo_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+
+def post_created_event(post):
+    """
+    Пост для события post_created, укороченный под лимит pg_notify (иначе откатится вся вставка):
+    сначала без заглушки-data URI, затем только id — тогда клиент перечитает первую страницу ленты.
+    """
+    for candidate in (post, {**post, 'placeholder': None}):
+        payload = json.dumps({'type': 'post_created', 'post': candidate}, ensure_ascii=False, default=str)
+        if len(payload.encode()) < NOTIFY_PAYLOAD_LIMIT:
+            return candidate
+    return {'id': post['id']}
+
+
+def _flush_reaction_deltas(batch):
+    """Записать накопленные дельты {post_id: {type: delta}} одним UPDATE на все посты."""
+    with get_db() as conn:
+        c = conn.cursor()
+        # Заодно шлём reactions_changed с новыми счётчиками каждого затронутого поста
+        psycopg2.extras.execute_values(
+            c,
+            psycopg2.sql.SQL("""
+            WITH d(post_id, deltas) AS (VALUES %s),
+            upd AS (
+                UPDATE posts p
+                SET reaction_counts = reaction_counts_merge(p.reaction_counts, d.deltas::jsonb)
+                FROM d
+                WHERE p.id = d.post_id
+                RETURNING p.id, p.reaction_counts
+            )
+            SELECT pg_notify({channel}, json_build_object(
+                'type', 'reactions_changed', 'post_id', upd.id, 'reactions', upd.reaction_counts
+            )::text)
+            FROM upd
+            """).format(channel=psycopg2.sql.Literal(EVENTS_CHANNEL)),
+            [(post_id, json.dumps(deltas)) for post_id, deltas in sorted(batch.items())],
+            page_size=1000,
         )
-        """
-    )
+        conn.commit()
+        # Дельты уже записаны: исключение отсюда вернуло бы их в буфер, и следующий сброс прибавил бы их
+        # второй раз. Без новой версии кеш ленты просто доживёт до FEED_CACHE_TTL
+        try:
+            bump_version(conn)
+        except Exception as e:
+            print(f"Warning: версия ленты после сброса реакций не сдвинута: {e}")
 
-    # Одноразовые токены для входа через бота (мобильный flow)
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS login_tokens (
-            token TEXT PRIMARY KEY,
-            telegram_id BIGINT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+
+feed_cache = FeedCache(
+    json_codec.dumps, maxsize=FEED_CACHE_PAGES, ttl=FEED_CACHE_TTL,
+    compress_level=COMPRESS_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY,
+)
+
+reaction_buffer = ReactionBuffer(
+    _flush_reaction_deltas,
+    interval_ms=REACTIONS_FLUSH_MS,
+    max_events=REACTIONS_FLUSH_EVENTS,
+)
+
+
+@app.cli.command('upgrade')
+def upgrade_command():
+    """Применить новые миграции схемы из migrations/."""
+    with get_db_pool().connection() as conn:
+        applied = migrate.upgrade(conn)
+    print(f"Применено миграций: {len(applied)}" if applied else 'Схема актуальна')
+
+
+@app.cli.command('schema-status')
+def schema_status_command():
+    """Показать применённые и ожидающие миграции."""
+    with get_db_pool().connection() as conn:
+        migrate.print_status(conn)
+
+
+@app.cli.command('hash-uploads')
+@click.option('--dry-run', is_flag=True, help='Только показать, что будет переименовано.')
+def hash_uploads_command(dry_run):
+    """Переименовать старые файлы постов в uploads/ в имена по содержимому (для Cache-Control: immutable)."""
+    renamed = 0
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, media_path FROM posts WHERE media_path NOT LIKE 'http%' ORDER BY id")
+        rows = c.fetchall()
+        old_files = {}
+        for post_id, media_path in rows:
+            if not media_path or is_hashed_name(media_path):
+                continue
+            full_path = safe_join(UPLOAD_FOLDER, media_path)
+            if full_path is None or not os.path.isfile(full_path):
+                print(f"  пост {post_id}: файл {media_path} не найден, пропущен")
+                continue
+            digest = hash_file(full_path)
+            name = hashed_name(digest, os.path.splitext(media_path)[1])
+            print(f"  пост {post_id}: {media_path} -> {name}")
+            if dry_run:
+                continue
+            target = os.path.join(UPLOAD_FOLDER, name)
+            if not os.path.exists(target):
+                shutil.copy2(full_path, target)
+            # Копии строились от старого имени — их пересоздаст flask media-variants
+            c.execute('UPDATE posts SET media_path = %s, media_variants = NULL WHERE id = %s', (name, post_id))
+            register_media(c, name, sha256=digest, size=os.path.getsize(target))
+            old_files[media_path] = full_path
+            renamed += 1
+        # Старые имена больше никто не использует (refcount обнулил триггер)
+        c.execute('DELETE FROM media_objects WHERE media_path = ANY(%s) AND refcount <= 0', (list(old_files),))
+        conn.commit()
+        if renamed:
+            bump_version(conn)
+            feed_cache.invalidate()
+    # Старые имена удаляем только после commit: до этого момента лента ещё ссылается на них
+    for full_path in old_files.values():
+        try:
+            os.remove(full_path)
+        except OSError:
+            pass
+    print(f"Переименовано файлов: {renamed}" if not dry_run else 'Ничего не изменено (--dry-run)')
+
+
+def _backfill_media(rows, task, column_values, workers=None):
+    """
+    Обработать файлы постов в пуле процессов и записать результат в posts.
+    rows — [(post_id, media_path, media_type)], task(media_path, media_type) выполняется в отдельном процессе,
+    column_values(result) -> {колонка: значение}. Возвращает число обновлённых постов.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(task, media_path, media_type): post_id for post_id, media_path, media_type in rows}
+        for future in as_completed(futures):
+            post_id = futures[future]
+            try:
+                values = column_values(future.result())
+            except Exception as e:
+                print(f"  пост {post_id}: не удалось ({e})")
+                continue
+            if values:
+                with get_db() as conn:
+                    conn.cursor().execute(
+                        f"UPDATE posts SET {', '.join(f'{col} = %s' for col in values)} WHERE id = %s",
+                        (*values.values(), post_id),
+                    )
+                    conn.commit()
+                done += 1
+            if done and done % 100 == 0:
+                print(f"  готово {done}/{len(rows)}")
+    if done:
+        with get_db() as conn:
+            bump_version(conn)
+        feed_cache.invalidate()
+    return done
+
+
+def _local_media_rows(where):
+    """Посты с файлом в uploads/ (не Cloudinary), подходящие под условие where."""
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(
+            f"""
+            SELECT id, media_path, media_type FROM posts
+            WHERE media_path NOT LIKE 'http%' AND {where}
+            ORDER BY id
+            """
         )
-        """
-    )
+        return [row for row in c.fetchall() if row[1] and os.path.isfile(os.path.join(UPLOAD_FOLDER, row[1]))]
 
-    conn.commit()
-    conn.close()
 
+def _make_variants_task(media_path, media_type, force=False):
+    from media_variants import make_variants
+    return make_variants(media_path, UPLOAD_FOLDER, force=force)
 
-def _try_init_db():
-    global _db_available
-    try:
-        init_db()
-    except psycopg2.OperationalError:
-        _db_available = False
-        print("Warning: PostgreSQL недоступен (таймаут/сеть). Сервер запущен для проверки вёрстки; API постов не будет работать.")
-        print("  Разбудите БД в панели Render или проверьте DATABASE_URL.")
+
+def _describe_media_task(media_path, media_type):
+    from media_meta import describe_media
+    return describe_media(media_path, UPLOAD_FOLDER, media_type)
+
+
+@app.cli.command('media-variants')
+@click.option('--force', is_flag=True, help='Пересоздать копии и для постов, у которых они уже есть.')
+@click.option('--workers', type=int, default=None, help='Сколько процессов кодируют картинки (по умолчанию — по числу CPU).')
+def media_variants_command(force, workers):
+    """Создать уменьшенные WebP/JPEG-копии для фото старых постов (srcset в ленте)."""
+    rows = _local_media_rows("media_type = 'photo'" + ('' if force else ' AND media_variants IS NULL'))
+    print(f"Фото без копий: {len(rows)}")
+    done = _backfill_media(
+        rows,
+        functools.partial(_make_variants_task, force=force),
+        lambda variants: {'media_variants': psycopg2.extras.Json(variants)},
+        workers,
+    )
+    print(f"Копии созданы для {done} фото")
+
+
+@app.cli.command('media-meta')
+@click.option('--force', is_flag=True, help='Пересчитать и для постов, у которых метаданные уже есть.')
+@click.option('--workers', type=int, default=None, help='Сколько процессов обрабатывают файлы (по умолчанию — по числу CPU).')
+def media_meta_command(force, workers):
+    """Заполнить размеры, заглушки и постеры видео для старых постов (постеры — если установлен ffmpeg)."""
+    rows = _local_media_rows('TRUE' if force else 'media_placeholder IS NULL')
+    print(f"Постов без метаданных: {len(rows)}")
+    done = _backfill_media(rows, _describe_media_task, lambda meta: meta, workers)
+    print(f"Метаданные заполнены для {done} постов")
+
+
+@app.cli.command('import-export')
+@click.argument('export_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=8, help='Сколько потоков копируют файлы.')
+@click.option('--batch-size', type=int, default=2000, help='Сколько постов загружать за одну транзакцию.')
+def import_export_command(export_dir, workers, batch_size):
+    """Загрузить историю канала из экспорта Telegram Desktop (папка с result.json). Можно перезапускать."""
+    from channel_import import import_export
+
+    with get_db() as conn:
+        result = import_export(conn, export_dir, UPLOAD_FOLDER, workers=workers, batch_size=batch_size)
+        if result['posts']:
+            bump_version(conn)
+            feed_cache.invalidate()
+    rate = result['posts'] / result['seconds'] if result['seconds'] else 0
+    print(f"Импортировано постов: {result['posts']} за {result['seconds']} с ({rate:.0f} постов/с), "
+          f"файлов {result['files_mb']} МБ; пропущено (уже были): {result['skipped']}")
+    if result['posts']:
+        print("Копии и заглушки: flask --app app media-variants && flask --app app media-meta")
+
+
+@app.cli.command('sweep-login-tokens')
+def sweep_login_tokens_command():
+    """Удалить просроченные токены входа и использованные nonce подписанных токенов (можно запускать из cron)."""
+    with get_db() as conn:
+        tokens, nonces = sweep_expired_login_tokens(conn.cursor(), LOGIN_TOKEN_TTL_SECONDS)
+        conn.commit()
+    print(f"Удалено просроченных токенов: {tokens}, использованных nonce: {nonces}")
 
 
-_try_init_db()
+@app.cli.command('reconcile-reactions')
+@click.option('--dry-run', is_flag=True, help='Только показать расхождения, ничего не меняя.')
+def reconcile_reactions_command(dry_run):
+    """Пересобрать счётчики реакций постов из user_reactions и показать расхождения."""
+    with get_db() as conn:
+        drift = reconcile_reaction_counts(conn.cursor(), dry_run=dry_run)
+        conn.commit()
+    for post_id, before, after in drift:
+        print(f"  пост {post_id}: {json.dumps(before, ensure_ascii=False)} -> {json.dumps(after, ensure_ascii=False)}")
+    verb = 'найдено' if dry_run else 'исправлено'
+    print(f"Расхождений {verb}: {len(drift)}")
+
 
 @app.route('/')
 def index():
@@ -251,22 +807,21 @@ def auth_telegram_callback():
     photo_url = data_copy.get('photo_url') or ''
     user = {'telegram_id': int(telegram_id), 'username': username, 'first_name': first_name, 'last_name': last_name, 'photo_url': photo_url}
     user['is_admin'] = user['telegram_id'] in ADMIN_TELEGRAM_IDS
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(
-        """
-        INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (telegram_id) DO UPDATE SET
-            username = EXCLUDED.username,
-            first_name = EXCLUDED.first_name,
-            last_name = EXCLUDED.last_name,
-            photo_url = EXCLUDED.photo_url
-        """,
-        (telegram_id, username, first_name, last_name, photo_url),
-    )
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                photo_url = EXCLUDED.photo_url
+            """,
+            (telegram_id, username, first_name, last_name, photo_url),
+        )
+        conn.commit()
     session['user'] = user
     session.permanent = True
     # Если открыто в popup — закрыть и обновить главную; иначе редирект на главную
@@ -281,50 +836,60 @@ def auth_telegram_verify():
     token = request.args.get('token')
     if not token:
         return redirect(url_for('index'))
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT telegram_id, created_at FROM login_tokens WHERE token = %s', (token,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return redirect(url_for('index'))
-    telegram_id, created_at = row
-    try:
-        created = datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at
-    except (TypeError, ValueError):
-        created = datetime.utcnow() - timedelta(days=1)  # неверный формат — считаем просроченным
-    if (datetime.utcnow() - created).total_seconds() > LOGIN_TOKEN_TTL_SECONDS:
-        c.execute('DELETE FROM login_tokens WHERE token = %s', (token,))
+    user_columns = f'u.id IS NOT NULL, u.username, u.first_name, u.last_name, u.photo_url, COALESCE({AVATAR_FRESH_SQL}, FALSE)'
+    with get_db() as conn:
+        c = conn.cursor()
+        if is_signed_token(token):
+            claims = verify_token(LOGIN_TOKEN_SECRET, token) if LOGIN_TOKEN_SECRET else None
+            if not claims:
+                return redirect(url_for('index'))
+            telegram_id, expires, nonce = claims
+            # Один запрос: пометить nonce использованным (повтор ссылки не пройдёт) и прочитать пользователя
+            c.execute(
+                f"""
+                WITH used AS (
+                    INSERT INTO login_token_nonces (nonce, expires_at) VALUES (%s, to_timestamp(%s))
+                    ON CONFLICT (nonce) DO NOTHING
+                    RETURNING nonce
+                )
+                SELECT EXISTS (SELECT 1 FROM used), {user_columns}
+                FROM (SELECT 1) one LEFT JOIN users u ON u.telegram_id = %s
+                """,
+                (nonce, expires, AVATAR_TTL, telegram_id),
+            )
+            valid, *user_row = c.fetchone()
+        else:
+            # Токен из таблицы удаляется тем же запросом, что и проверяется (просроченный — тоже)
+            c.execute(
+                f"""
+                WITH t AS (DELETE FROM login_tokens WHERE token = %s RETURNING telegram_id, created_at)
+                SELECT t.telegram_id, t.created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second', {user_columns}
+                FROM t LEFT JOIN users u ON u.telegram_id = t.telegram_id
+                """,
+                (token, LOGIN_TOKEN_TTL_SECONDS, AVATAR_TTL),
+            )
+            row = c.fetchone()
+            if not row:
+                return redirect(url_for('index'))
+            telegram_id, valid, *user_row = row
+        if not valid:
+            conn.commit()
+            return redirect(url_for('index'))
+        user_exists, username, first_name, last_name, photo_url, avatar_fresh = user_row
+        if not user_exists:
+            # Пользователя ещё нет. В PostgreSQL аналог INSERT OR IGNORE — ON CONFLICT DO NOTHING
+            c.execute(
+                """
+                INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (telegram_id) DO NOTHING
+                """,
+                (telegram_id, '', '', '', ''),
+            )
         conn.commit()
-        conn.close()
-        return redirect(url_for('index'))
-    c.execute('DELETE FROM login_tokens WHERE token = %s', (token,))
-    c.execute('SELECT username, first_name, last_name, photo_url FROM users WHERE telegram_id = %s', (telegram_id,))
-    user_row = c.fetchone()
-    if user_row:
-        username, first_name, last_name, photo_url = user_row
-    else:
-        username, first_name, last_name, photo_url = '', '', '', ''
-        # В PostgreSQL аналог INSERT OR IGNORE — ON CONFLICT DO NOTHING
-        c.execute(
-            """
-            INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (telegram_id) DO NOTHING
-            """,
-            (telegram_id, '', '', '', ''),
-        )
-    conn.commit()
-    conn.close()
-    photo_url = photo_url or ''
-    if not photo_url:
-        photo_url = fetch_telegram_user_photo(telegram_id) or ''
-        if photo_url:
-            conn2 = get_db()
-            c2 = conn2.cursor()
-            c2.execute('UPDATE users SET photo_url = %s WHERE telegram_id = %s', (photo_url, telegram_id))
-            conn2.commit()
-            conn2.close()
+    # Аватарка качается в фоне; до этого фронтенд показывает заглушку и переспрашивает /api/me
+    if TELEGRAM_BOT_TOKEN and not avatar_fresh:
+        avatar_fetcher.submit(int(telegram_id))
     user = {'telegram_id': int(telegram_id), 'username': username or '', 'first_name': first_name or '', 'last_name': last_name or '', 'photo_url': photo_url or ''}
     user['is_admin'] = user['telegram_id'] in ADMIN_TELEGRAM_IDS
     session['user'] = user
@@ -334,87 +899,343 @@ def auth_telegram_verify():
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    Медиафайлы. MEDIA_SENDFILE=x-accel — передачу делает nginx (X-Accel-Redirect), x-sendfile — Apache/lighttpd;
+    иначе отдаёт Python с поддержкой Range (перемотка видео без скачивания с начала).
+    Файлы с именем по содержимому кешируются навсегда, остальные (аватары и старые посты) — с ревалидацией.
+    """
+    full_path = safe_join(UPLOAD_FOLDER, filename)
+    if full_path is None or not os.path.isfile(full_path):
+        return jsonify({'error': 'not_found'}), 404
+
+    if MEDIA_SENDFILE in ('x-accel', 'x-sendfile'):
+        # Тело и Range обрабатывает прокси; воркер освобождается сразу
+        resp = Response(status=200, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if MEDIA_SENDFILE == 'x-accel':
+            resp.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + filename.replace(os.sep, '/')
+        else:
+            resp.headers['X-Sendfile'] = os.path.abspath(full_path)
+    else:
+        ranges = parse_byte_ranges(request.headers.get('Range'))
+        resp = _send_multiple_ranges(full_path, filename, ranges) if ranges and len(ranges) > 1 else None
+        if resp is None:
+            if ranges is None or len(ranges) > 1:
+                # Некорректный или непринятый Range игнорируется: werkzeug ответил бы на него 416
+                request.environ.pop('HTTP_RANGE', None)
+            # Один диапазон и 304 по ETag/Last-Modified обрабатывает werkzeug; тело отдаётся через
+            # wsgi.file_wrapper (в gunicorn — sendfile), а не чтением файла в Python
+            resp = send_from_directory(UPLOAD_FOLDER, filename, conditional=True)
+    if is_hashed_name(os.path.basename(filename)):
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+def _send_multiple_ranges(full_path, filename, ranges):
+    """Range с несколькими диапазонами (werkzeug отвечает на них 416): 206 multipart/byteranges или None."""
+    stat = os.stat(full_path)
+    size = stat.st_size
+    # Та же формула, что у werkzeug send_file: If-Range от прошлого ответа 200/206 должен совпасть
+    etag = f'"{stat.st_mtime}-{size}-{zlib.adler32(full_path.encode()) & 0xFFFFFFFF}"'
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range.strip() != etag:
+        return None  # файл мог измениться — отдаём целиком
+    ranges = normalize_ranges(ranges, size)
+    if ranges is None:
+        return None
+    if not ranges:
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = f'bytes */{size}'
+        return resp
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if len(ranges) == 1:
+        # Несколько диапазонов слились в один
+        start, stop = ranges[0]
+        resp = Response(stream_file_range(full_path, start, stop), status=206, mimetype=content_type,
+                        direct_passthrough=True)
+        resp.content_length = stop - start
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    else:
+        boundary = secrets.token_hex(12)
+        length, body = multipart_byteranges(full_path, ranges, size, content_type, boundary)
+        resp = Response(body, status=206, mimetype=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
+        resp.content_length = length
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['ETag'] = etag
+    return resp
+
+
+def encode_feed_cursor(created_at, post_id):
+    """Непрозрачный курсор ленты: base64url("<created_at ISO>,<id>")."""
+    raw = f'{created_at.isoformat()},{post_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_feed_cursor(cursor):
+    """Разобрать курсор из ?before=. Возвращает (created_at, id) или бросает ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, post_id = raw.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('invalid cursor') from e
+
 
 @app.route('/api/posts')
 def get_posts():
-    conn = get_db()
-    c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    """
+    Страница ленты: ?limit=N&before=<курсор>. Сортировка по (created_at, id) по убыванию,
+    keyset-пагинация по индексу posts_created_at_id_idx.
+    Ответ: {"posts": [...], "next_cursor": "..." | null, "my_reactions": {post_id: reaction_type}}.
+    """
+    try:
+        limit = int(request.args.get('limit', FEED_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'invalid_limit'}), 400
+    limit = max(1, min(limit, FEED_PAGE_SIZE_MAX))
+    before = request.args.get('before')
+    if before:
+        try:
+            before = decode_feed_cursor(before)
+        except ValueError:
+            return jsonify({'error': 'invalid_cursor'}), 400
 
-    c.execute(
-        """
-        SELECT p.*,
-               string_agg(r.reaction_type || ':' || r.count::text, ',') AS reactions
-        FROM posts p
-        LEFT JOIN reactions r ON p.id = r.post_id
-        GROUP BY p.id
-        ORDER BY p.created_at DESC
-        """
-    )
+    user_id = get_current_user_id()
+    with get_db() as conn:
+        c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # Ничего не менялось с прошлого опроса — 304 без тяжёлого запроса
+        version = current_version(c)
+        # Сжатый и несжатый варианты — разные представления, у каждого свой ETag
+        encoding = response_encoding(FEED_USER_ENCODINGS if user_id else COMPRESS_ENCODINGS)
+        etag = make_etag(version, limit, request.args.get('before'), user_id, encoding)
+        cached = not_modified(etag)
+        if cached is not None:
+            if COMPRESS_LEVEL:
+                cached.vary.add('Accept-Encoding')
+            return cached
+
+        # Общая часть страницы одинакова для всех — берём готовые байты из кеша
+        cache_key = (limit, request.args.get('before'))
+        page = feed_cache.get(cache_key, version)
+        if page is None:
+            where = 'WHERE (p.created_at, p.id) < (%s, %s)' if before else ''
+            c.execute(
+                f"""
+                SELECT p.*
+                FROM posts p
+                {where}
+                ORDER BY p.created_at DESC, p.id DESC
+                LIMIT %s
+                """,
+                (*(before or ()), limit + 1),
+            )
+            rows = c.fetchall()
+
+            posts = []
+            for row in rows[:limit]:
+                post = dict(row)
+                post['reactions'] = post.pop('reaction_counts') or {}
+                post.update(post_media_fields(*(post.pop(col) for col in POST_MEDIA_COLUMNS)))
+                posts.append(post)
+            next_cursor = None
+            if len(rows) > limit:
+                next_cursor = encode_feed_cursor(posts[-1]['created_at'], posts[-1]['id'])
+            page = feed_cache.put(cache_key, version, posts, next_cursor)
+
+        my_reactions = None
+        if user_id and page.post_ids:
+            # Личная часть: реакции текущего пользователя — только для постов этой страницы
+            c.execute(
+                """
+                SELECT post_id, reaction_type
+                FROM user_reactions
+                WHERE user_id = %s AND post_id = ANY(%s)
+                """,
+                (user_id, page.post_ids),
+            )
+            my_reactions = {row['post_id']: row['reaction_type'] for row in c.fetchall()}
 
-    posts = []
-    for row in c.fetchall():
-        post = dict(row)
-        reactions = {}
-        if post.get('reactions'):
-            for reaction in post['reactions'].split(','):
-                r_type, count = reaction.split(':')
-                reactions[r_type] = int(count)
-        post['reactions'] = reactions
-        posts.append(post)
+    resp = app.response_class(page.render(my_reactions, encoding), mimetype='application/json')
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    if COMPRESS_LEVEL:
+        resp.vary.add('Accept-Encoding')
+    return with_validator(resp, etag)
 
-    user_id = get_current_user_id()
-    if user_id and posts:
-        post_ids = [p['id'] for p in posts]
-        c.execute(
+
+def register_media(c, media_path, file_unique_id=None, sha256=None, size=None):
+    """
+    Записать в хранилище медиа хеш/размер файла и его Telegram file_unique_id.
+    Строку media_objects (и refcount) к этому моменту уже создал триггер на INSERT в posts.
+    """
+    register_media_many(c, [(media_path, file_unique_id, sha256, size)])
+
+
+def register_media_many(c, items):
+    """register_media для пачки [(media_path, file_unique_id, sha256, size)]: не больше двух запросов."""
+    items = [item for item in items if item[0] and not item[0].startswith('http')]
+    hashes = [(path, sha256, size) for path, _, sha256, size in items if sha256 or size]
+    if hashes:
+        psycopg2.extras.execute_values(
+            c,
             """
-            SELECT post_id, reaction_type
-            FROM user_reactions
-            WHERE user_id = %s AND post_id = ANY(%s)
+            UPDATE media_objects mo
+            SET sha256 = COALESCE(mo.sha256, v.sha256), size = COALESCE(mo.size, v.size)
+            FROM (VALUES %s) v(media_path, sha256, size)
+            WHERE mo.media_path = v.media_path
             """,
-            (user_id, post_ids),
+            hashes,
+            template='(%s, %s::text, %s::bigint)',
+            page_size=len(hashes),
+        )
+    # Один file_unique_id дважды в пачке — ON CONFLICT DO UPDATE не обновляет строку дважды; побеждает последний
+    telegram = {file_unique_id: path for path, file_unique_id, _, _ in items if file_unique_id}
+    if telegram:
+        psycopg2.extras.execute_values(
+            c,
+            """
+            INSERT INTO telegram_media (file_unique_id, media_path) VALUES %s
+            ON CONFLICT (file_unique_id) DO UPDATE SET media_path = EXCLUDED.media_path
+            """,
+            list(telegram.items()),
+            page_size=len(telegram),
         )
-        my_by_post = {row['post_id']: row['reaction_type'] for row in c.fetchall()}
-        for post in posts:
-            post['my_reaction'] = my_by_post.get(post['id'])
-    else:
-        for post in posts:
-            post['my_reaction'] = None
 
-    conn.close()
-    return jsonify(posts)
 
-@app.route('/api/posts', methods=['POST'])
-def create_post():
-    data = request.json
-    conn = get_db()
-    c = conn.cursor()
+@app.route('/api/media/telegram/<file_unique_id>')
+def lookup_telegram_media(file_unique_id):
+    """
+    Уже сохранённый файл по Telegram file_unique_id — бот не скачивает и не обрабатывает его повторно.
+    Ответ: {"media_path": ..., "media": {колонки POST_MEDIA_COLUMNS последнего поста с этим файлом}}.
+    """
+    with get_db() as conn:
+        c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        c.execute(
+            f"""
+            SELECT tm.media_path, {', '.join('p.' + col for col in POST_MEDIA_COLUMNS)}
+            FROM telegram_media tm
+            JOIN media_objects mo ON mo.media_path = tm.media_path
+            LEFT JOIN LATERAL (
+                SELECT * FROM posts WHERE media_path = tm.media_path ORDER BY id DESC LIMIT 1
+            ) p ON TRUE
+            WHERE tm.file_unique_id = %s
+            """,
+            (file_unique_id,),
+        )
+        row = c.fetchone()
+    if not row or not os.path.isfile(os.path.join(UPLOAD_FOLDER, row['media_path'])):
+        return jsonify({'error': 'not_found'}), 404
+    media_path = row.pop('media_path')
+    return jsonify({'media_path': media_path, 'media': {k: v for k, v in row.items() if v is not None}})
 
-    c.execute(
+
+def insert_posts(c, posts):
+    """
+    Вставить посты одним INSERT ... ON CONFLICT (telegram_id) DO NOTHING и разослать post_created
+    (хранилище медиа и pg_notify — тоже по одному запросу на пачку, а не на пост).
+    Возвращает [(id, создан ли)] в порядке posts; для уже существующих telegram_id — id старого поста.
+    """
+    rows = []
+    for data in posts:
+        media = [data.get(col) for col in POST_MEDIA_COLUMNS]
+        media_variants = media[0]
+        rows.append((data['telegram_id'], data['media_type'], data['media_path'], data.get('caption', ''),
+                     psycopg2.extras.Json(media_variants) if media_variants else None, *media[1:]))
+    inserted = psycopg2.extras.execute_values(
+        c,
         """
-        INSERT INTO posts (telegram_id, media_type, media_path, caption)
-        VALUES (%s, %s, %s, %s)
+        INSERT INTO posts (telegram_id, media_type, media_path, caption, media_variants,
+                           media_width, media_height, media_duration, media_placeholder, media_poster)
+        VALUES %s
         ON CONFLICT (telegram_id) DO NOTHING
-        RETURNING id
+        RETURNING id, telegram_id, created_at
         """,
-        (data['telegram_id'], data['media_type'], data['media_path'], data.get('caption', '')),
+        rows,
+        page_size=len(rows),
+        fetch=True,
     )
+    created = {telegram_id: (post_id, created_at) for post_id, telegram_id, created_at in inserted}
+    missing = [data['telegram_id'] for data in posts if data['telegram_id'] not in created]
+    existing = {}
+    if missing:
+        c.execute('SELECT telegram_id, id FROM posts WHERE telegram_id = ANY(%s)', (missing,))
+        existing = dict(c.fetchall())
+
+    result = []
+    media = []
+    events = []
+    notified = set()
+    for data in posts:
+        telegram_id = data['telegram_id']
+        if telegram_id not in created:
+            result.append((existing[telegram_id], False))
+            continue
+        post_id, created_at = created[telegram_id]
+        result.append((post_id, telegram_id not in notified))
+        if telegram_id in notified:
+            continue  # тот же telegram_id дважды в одной пачке
+        notified.add(telegram_id)
+        media.append((data['media_path'], data.get('file_unique_id'), data.get('media_sha256'), data.get('media_size')))
+        events.append(('post_created', {'post': post_created_event({
+            'id': post_id,
+            'telegram_id': telegram_id,
+            'media_type': data['media_type'],
+            'media_path': data['media_path'],
+            'caption': data.get('caption', ''),
+            **post_media_fields(*(data.get(col) for col in POST_MEDIA_COLUMNS)),
+            'created_at': http_date(created_at),
+            'reactions': {},
+            'my_reaction': None,
+        })}))
+    # Хранилище медиа и события — по запросу на всю пачку, а не на каждый пост
+    register_media_many(c, media)
+    notify_events(c, events)
+    return result
 
-    row = c.fetchone()
-    if row:
-        post_id = row[0]
-    else:
-        c.execute('SELECT id FROM posts WHERE telegram_id = %s', (data['telegram_id'],))
-        post_id = c.fetchone()[0]
 
-    conn.commit()
-    conn.close()
+@app.route('/api/posts', methods=['POST'])
+def create_post():
+    data = request.json
+    with get_db() as conn:
+        c = conn.cursor()
+        [(post_id, created)] = insert_posts(c, [data])
+        conn.commit()
+        if created:
+            bump_version(conn)
+            feed_cache.invalidate()
     return jsonify({'id': post_id, 'status': 'success'})
 
-def _reactions_dict_for_post(c, post_id):
-    """Собрать словарь {reaction_type: count} для поста из таблицы reactions."""
-    c.execute('SELECT reaction_type, count FROM reactions WHERE post_id = %s', (post_id,))
-    return {row[0]: row[1] for row in c.fetchall()}
+
+@app.route('/api/posts/batch', methods=['POST'])
+def create_posts_batch():
+    """
+    Несколько постов одним запросом (бот склеивает посты, пришедшие почти одновременно).
+    Тело: {"posts": [<поля как у POST /api/posts>, ...]}.
+    Ответ: {"posts": [{"telegram_id", "id", "created"}, ...]} в том же порядке.
+    """
+    data = request.get_json(silent=True) or {}
+    posts = data.get('posts')
+    if not isinstance(posts, list) or not posts:
+        return jsonify({'error': 'posts required'}), 400
+    if len(posts) > POSTS_BATCH_MAX:
+        return jsonify({'error': 'too_many_posts', 'max': POSTS_BATCH_MAX}), 400
+    for post in posts:
+        if not isinstance(post, dict) or any(post.get(key) is None for key in ('telegram_id', 'media_type', 'media_path')):
+            return jsonify({'error': 'telegram_id, media_type and media_path required'}), 400
+    with get_db() as conn:
+        c = conn.cursor()
+        result = insert_posts(c, posts)
+        conn.commit()
+        if any(created for _, created in result):
+            bump_version(conn)
+            feed_cache.invalidate()
+    return jsonify({
+        'status': 'success',
+        'posts': [
+            {'telegram_id': post['telegram_id'], 'id': post_id, 'created': created}
+            for post, (post_id, created) in zip(posts, result)
+        ],
+    })
 
 
 @app.route('/api/posts/<int:post_id>/reactions', methods=['POST'])
@@ -428,82 +1249,53 @@ def add_reaction(post_id):
     if not user_id:
         return jsonify({'error': 'auth_required'}), 401
 
-    conn = None
     try:
-        conn = get_db()
-        c = conn.cursor()
+        with get_db() as conn:
+            c = conn.cursor()
 
-        c.execute('SELECT reaction_type FROM user_reactions WHERE post_id = %s AND user_id = %s', (post_id, user_id))
-        row = c.fetchone()
-        current = row[0] if row else None
-
-        if current == reaction_type:
-            # Снять реакцию: та же эмоция — удаляем
-            c.execute('DELETE FROM user_reactions WHERE post_id = %s AND user_id = %s', (post_id, user_id))
-            c.execute('SELECT id, count FROM reactions WHERE post_id = %s AND reaction_type = %s', (post_id, reaction_type))
-            r = c.fetchone()
-            if r:
-                rid, count = r
-                if count <= 1:
-                    c.execute('DELETE FROM reactions WHERE id = %s', (rid,))
-                else:
-                    c.execute('UPDATE reactions SET count = count - 1 WHERE id = %s', (rid,))
-            my_reaction = None
-            is_new = False
-        elif current is not None:
-            # Сменить реакцию: другая эмоция — у старой -1, у новой +1
-            c.execute(
-                'UPDATE user_reactions SET reaction_type = %s WHERE post_id = %s AND user_id = %s',
-                (reaction_type, post_id, user_id),
-            )
-            # Уменьшить старую
-            c.execute('SELECT id, count FROM reactions WHERE post_id = %s AND reaction_type = %s', (post_id, current))
-            r = c.fetchone()
-            if r:
-                rid, count = r
-                if count <= 1:
-                    c.execute('DELETE FROM reactions WHERE id = %s', (rid,))
-                else:
-                    c.execute('UPDATE reactions SET count = count - 1 WHERE id = %s', (rid,))
-            # Увеличить новую
-            c.execute('SELECT id, count FROM reactions WHERE post_id = %s AND reaction_type = %s', (post_id, reaction_type))
-            r = c.fetchone()
-            if r:
-                c.execute('UPDATE reactions SET count = count + 1 WHERE id = %s', (r[0],))
-            else:
+            if REACTIONS_WRITE_BEHIND:
+                # Пишем только факт реакции; счётчики поста обновит фоновый сброс буфера
                 c.execute(
-                    'INSERT INTO reactions (post_id, reaction_type, count) VALUES (%s, %s, 1)',
-                    (post_id, reaction_type),
+                    'SELECT removed, added, counts FROM record_reaction(%s, %s, %s)',
+                    (post_id, user_id, reaction_type),
                 )
-            my_reaction = reaction_type
-            is_new = True
-        else:
-            # Новая реакция
+                row = c.fetchone()
+                if not row:
+                    return jsonify({'error': 'not_found'}), 404
+                removed, added, stored = row
+                conn.commit()
+                # my_reaction уже другой, но общая часть ленты в БД не менялась — кеш остаётся в силе;
+                # счётчики обновит сброс буфера
+                feed_cache.apply_reactions(bump_version(conn))
+                reaction_buffer.add(post_id, removed, added)
+                reactions = reaction_buffer.merged(post_id, stored)
+                return jsonify({'reactions': reactions, 'my_reaction': added, 'is_new': added is not None})
+
+            # Снять / сменить / поставить реакцию, получить новые счётчики и разослать их в /api/stream —
+            # один запрос к БД
             c.execute(
-                'INSERT INTO user_reactions (post_id, user_id, reaction_type) VALUES (%s, %s, %s)',
-                (post_id, user_id, reaction_type),
+                """
+                SELECT t.counts, t.my_reaction, t.is_new,
+                       pg_notify(%s, json_build_object(
+                           'type', 'reactions_changed', 'post_id', %s::int, 'reactions', t.counts
+                       )::text)
+                FROM toggle_reaction(%s, %s, %s) t
+                """,
+                (EVENTS_CHANNEL, post_id, post_id, user_id, reaction_type),
             )
-            c.execute('SELECT id, count FROM reactions WHERE post_id = %s AND reaction_type = %s', (post_id, reaction_type))
-            r = c.fetchone()
-            if r:
-                c.execute('UPDATE reactions SET count = count + 1 WHERE id = %s', (r[0],))
-            else:
-                c.execute(
-                    'INSERT INTO reactions (post_id, reaction_type, count) VALUES (%s, %s, 1)',
-                    (post_id, reaction_type),
-                )
-            my_reaction = reaction_type
-            is_new = True
-
-        reactions = _reactions_dict_for_post(c, post_id)
-        conn.commit()
-        return jsonify({'reactions': reactions, 'my_reaction': my_reaction, 'is_new': is_new})
+            row = c.fetchone()
+            if not row:
+                return jsonify({'error': 'not_found'}), 404
+            reactions, my_reaction, is_new, _ = row
+            conn.commit()
+            version, counts = bump_version_for_post(conn, post_id)
+            feed_cache.apply_reactions(version, post_id, counts)
+            return jsonify({'reactions': reactions, 'my_reaction': my_reaction, 'is_new': is_new})
+    except (PoolTimeout, DatabaseUnavailable):
+        raise  # 503 от своих обработчиков ошибок, а не 500
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': 'server_error', 'message': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @app.route('/api/posts/<int:post_id>', methods=['DELETE'])
@@ -512,62 +1304,128 @@ def delete_post(post_id):
     user = session.get('user')
     if not user or user.get('telegram_id') not in ADMIN_TELEGRAM_IDS:
         return jsonify({'error': 'forbidden'}), 403
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT id, media_path FROM posts WHERE id = %s', (post_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return jsonify({'error': 'not_found'}), 404
-    _, media_path = row
-    c.execute('DELETE FROM user_reactions WHERE post_id = %s', (post_id,))
-    c.execute('DELETE FROM reactions WHERE post_id = %s', (post_id,))
-    c.execute('DELETE FROM posts WHERE id = %s', (post_id,))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, media_path, media_variants, media_poster FROM posts WHERE id = %s', (post_id,))
+        row = c.fetchone()
+        if not row:
+            return jsonify({'error': 'not_found'}), 404
+        _, media_path, media_variants, media_poster = row
+        c.execute('DELETE FROM user_reactions WHERE post_id = %s', (post_id,))
+        c.execute('DELETE FROM reactions WHERE post_id = %s', (post_id,))
+        c.execute('DELETE FROM posts WHERE id = %s', (post_id,))
+        if media_path:
+            # Файл общий для всех постов с тем же содержимым: удаляем, только когда ушла последняя ссылка
+            # (refcount уменьшил триггер на posts); вместе с файлом уходят и записи telegram_media
+            c.execute(
+                'DELETE FROM media_objects WHERE media_path = %s AND refcount <= 0 RETURNING media_path',
+                (media_path,),
+            )
+            if not c.fetchone():
+                media_path = None
+        notify_event(c, 'post_deleted', post_id=post_id)
+        conn.commit()
+        bump_version(conn)
+        feed_cache.invalidate()
     if media_path:
-        full_path = os.path.join(UPLOAD_FOLDER, media_path)
-        if os.path.isfile(full_path):
-            try:
-                os.remove(full_path)
-            except OSError:
-                pass
+        files = {media_path, media_poster} - {None}
+        for variant in media_variants or ():
+            files.update((variant['webp'], variant['jpeg']))
+        for name in files:
+            full_path = os.path.join(UPLOAD_FOLDER, name)
+            if os.path.isfile(full_path):
+                try:
+                    os.remove(full_path)
+                except OSError:
+                    pass
     return jsonify({'ok': True})
 
 
+event_hub = EventHub(DATABASE_URL, max_clients=SSE_MAX_CLIENTS, connect_kwargs={'connect_timeout': DB_CONNECT_TIMEOUT})
+
+_channel_info_cache = None  # (версия, JSON-байты) для /api/channel-info
+
+
+@app.route('/api/stream')
+def event_stream():
+    """
+    Server-Sent Events: post_created, post_deleted, reactions_changed (счётчики одного поста)
+    и resync (события могли потеряться — перечитать ленту). Источник — LISTEN/NOTIFY в PostgreSQL.
+    """
+    if not DATABASE_URL:
+        return jsonify({'error': 'unavailable'}), 503
+    db_breaker.before_call()
+    q = event_hub.subscribe()
+    if q is None:
+        # Мест нет — клиент перейдёт на опрос раз в 30 секунд
+        return jsonify({'error': 'too_many_clients'}), 503
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            event_hub.unsubscribe(q)
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+    return resp
+
+
 @app.route('/api/channel-info')
 def get_channel_info():
-    conn = get_db()
-    c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    global _channel_info_cache
+    with get_db() as conn:
+        c = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        version = current_version(c, 'channel_version_seq')
+        etag = make_etag(version, 'channel')
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        # Тело ответа кешируется целиком, пока не сдвинулась версия
+        entry = _channel_info_cache
+        if entry is None or entry[0] != version:
+            c.execute('SELECT * FROM channel_info WHERE id = 1')
+            info = c.fetchone()
+            body = json_codec.dumps(dict(info) if info else {'name': 'Telegram Channel', 'avatar_url': ''})
+            entry = _channel_info_cache = (version, body)
 
-    c.execute('SELECT * FROM channel_info WHERE id = 1')
-    info = c.fetchone()
-    conn.close()
+    return with_validator(app.response_class(entry[1], mimetype='application/json'), etag)
 
-    if info:
-        return jsonify(dict(info))
-    return jsonify({'name': 'Telegram Channel', 'avatar_url': ''})
 
 @app.route('/api/channel-info', methods=['POST'])
 def update_channel_info():
+    global _channel_info_cache
     data = request.json
-    conn = get_db()
-    c = conn.cursor()
+    with get_db() as conn:
+        c = conn.cursor()
 
-    c.execute(
-        """
-        INSERT INTO channel_info (id, name, avatar_url, updated_at)
-        VALUES (1, %s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (id) DO UPDATE SET
-            name = EXCLUDED.name,
-            avatar_url = EXCLUDED.avatar_url,
-            updated_at = EXCLUDED.updated_at
-        """,
-        (data['name'], data.get('avatar_url', '')),
-    )
+        c.execute(
+            """
+            INSERT INTO channel_info (id, name, avatar_url, updated_at)
+            VALUES (1, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET
+                name = EXCLUDED.name,
+                avatar_url = EXCLUDED.avatar_url,
+                updated_at = EXCLUDED.updated_at
+            """,
+            (data['name'], data.get('avatar_url', '')),
+        )
 
-    conn.commit()
-    conn.close()
+        conn.commit()
+        bump_version(conn, 'channel_version_seq')
+    _channel_info_cache = None
     return jsonify({'status': 'success'})
 
 
@@ -579,6 +1437,19 @@ def get_me():
         return jsonify({})
     user = dict(user)
     user['is_admin'] = user.get('telegram_id') in ADMIN_TELEGRAM_IDS
+    if not user.get('photo_url') and user.get('telegram_id'):
+        # Аватарка могла докачаться в фоне уже после входа
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute('SELECT photo_url, photo_fetched_at FROM users WHERE telegram_id = %s', (user['telegram_id'],))
+            row = c.fetchone()
+        if row and row[0]:
+            user['photo_url'] = row[0]
+            session['user'] = {**session['user'], 'photo_url': row[0]}
+        user['photo_pending'] = bool(
+            TELEGRAM_BOT_TOKEN and row and not row[0]
+            and (row[1] is None or avatar_fetcher.is_pending(user['telegram_id']))
+        )
     return jsonify(user)
 
 
@@ -597,29 +1468,33 @@ def api_create_login_token():
     first_name = (data.get('first_name') or '').strip()
     last_name = (data.get('last_name') or '').strip()
     username = (data.get('username') or '').strip().lstrip('@')
-    token = secrets.token_urlsafe(32)
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('INSERT INTO login_tokens (token, telegram_id) VALUES (%s, %s)', (token, telegram_id))
-    c.execute(
-        """
-        INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
-        VALUES (
-            %s,
-            %s,
-            %s,
-            %s,
-            COALESCE((SELECT photo_url FROM users WHERE telegram_id = %s), '')
+    if LOGIN_TOKEN_MODE == 'signed':
+        token = make_token(LOGIN_TOKEN_SECRET, telegram_id, LOGIN_TOKEN_TTL_SECONDS)
+    else:
+        token = secrets.token_urlsafe(32)
+    with get_db() as conn:
+        c = conn.cursor()
+        if LOGIN_TOKEN_MODE != 'signed':
+            c.execute('INSERT INTO login_tokens (token, telegram_id) VALUES (%s, %s)', (token, telegram_id))
+        c.execute(
+            """
+            INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
+            VALUES (
+                %s,
+                %s,
+                %s,
+                %s,
+                COALESCE((SELECT photo_url FROM users WHERE telegram_id = %s), '')
+            )
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name
+            """,
+            (telegram_id, username, first_name, last_name, telegram_id),
         )
-        ON CONFLICT (telegram_id) DO UPDATE SET
-            username = EXCLUDED.username,
-            first_name = EXCLUDED.first_name,
-            last_name = EXCLUDED.last_name
-        """,
-        (telegram_id, username, first_name, last_name, telegram_id),
-    )
-    conn.commit()
-    conn.close()
+        conn.commit()
+    sweep_login_tokens_periodically()
     base = SITE_BASE_URL or request.host_url.rstrip('/')
     login_url = f'{base}/auth/telegram/verify?token={token}'
     return jsonify({'ok': True, 'token': token, 'login_url': login_url})
@@ -648,22 +1523,21 @@ def auth_telegram():
         'photo_url': photo_url
     }
     user['is_admin'] = user['telegram_id'] in ADMIN_TELEGRAM_IDS
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(
-        """
-        INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (telegram_id) DO UPDATE SET
-            username = EXCLUDED.username,
-            first_name = EXCLUDED.first_name,
-            last_name = EXCLUDED.last_name,
-            photo_url = EXCLUDED.photo_url
-        """,
-        (telegram_id, username, first_name, last_name, photo_url),
-    )
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO users (telegram_id, username, first_name, last_name, photo_url)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                photo_url = EXCLUDED.photo_url
+            """,
+            (telegram_id, username, first_name, last_name, photo_url),
+        )
+        conn.commit()
     session['user'] = user
     session.permanent = True
     return jsonify({'ok': True, 'user': user})
@@ -675,6 +1549,212 @@ def logout():
     return jsonify({'ok': True})
 
 
+@app.before_request
+def _metrics_request_started():
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    slow_queries.request_started(_request_route())
+
+
+@app.after_request
+def _metrics_response(resp):
+    g.metrics_status = resp.status_code
+    g.metrics_size = resp.content_length  # None у потоковых ответов (SSE)
+    return resp
+
+
+@app.teardown_request
+def _metrics_request_finished(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    HTTP_IN_FLIGHT.dec()
+    slow_queries.request_finished()
+    route = _request_route()
+    status = g.get('metrics_status', 500)
+    HTTP_DURATION.observe(time.perf_counter() - started, request.method, route)
+    HTTP_REQUESTS.inc(request.method, route, str(status))
+    SQL_PER_REQUEST.observe(g.get('sql_queries', 0), route)
+    if g.get('metrics_size') is not None:
+        HTTP_RESPONSE_SIZE.observe(g.metrics_size, route)
+
+
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_KEEP)
+
+
+def _profile_admin_id():
+    """telegram_id администратора из подписанного токена в заголовке X-Profile или из сессии; иначе None."""
+    token = request.headers.get('X-Profile')
+    if token:
+        claims = verify_token(PROFILE_TOKEN_SECRET, token)
+        telegram_id = claims[0] if claims else None
+    else:
+        telegram_id = (session.get('user') or {}).get('telegram_id')
+    return telegram_id if telegram_id in ADMIN_TELEGRAM_IDS else None
+
+
+@app.before_request
+def _profile_request_started():
+    # Обычный запрос платит только за две проверки словарей
+    if not PROFILE_KEEP or ('_profile' not in request.args and 'X-Profile' not in request.headers):
+        return
+    if request.endpoint in ('list_profiles', 'get_profile'):
+        return  # токен в X-Profile здесь — авторизация, а не просьба профилировать
+    admin_id = _profile_admin_id()
+    if admin_id is None:
+        return  # флаг без прав просто игнорируется
+    mode = request.args.get('_profile') or request.headers.get('X-Profile-Mode')
+    g.profile = RequestProfile(
+        mode if mode in PROFILE_MODES else 'sample', PROFILE_INTERVAL_MS / 1000, PROFILE_MAX_SECONDS,
+    )
+    g.profile_name = profile_store.new_name()
+    g.profile_admin = admin_id
+    g.profile.start()
+
+
+@app.after_request
+def _profile_response(resp):
+    if 'profile' in g:
+        resp.headers['X-Profile-Id'] = g.profile_name
+    return resp
+
+
+@app.teardown_request
+def _profile_request_finished(exc):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    write, samples, seconds = profile.finish()
+    try:
+        profile_store.save(g.profile_name, profile.mode, write, {
+            'method': request.method,
+            'url': request.full_path.rstrip('?'),
+            'route': _request_route(),
+            'status': g.get('metrics_status', 500),
+            'ms': round(seconds * 1000, 3),
+            'samples': samples,
+            'admin': g.profile_admin,
+            'pid': os.getpid(),
+            'created_at': datetime.now().astimezone().isoformat(timespec='seconds'),
+        })
+    except OSError as e:
+        print(f"Warning: профиль {g.profile_name} не сохранён: {e}")
+
+
+@app.after_request
+def _compress_response(resp):
+    """
+    Сжать готовый ответ по Accept-Encoding. Не трогает файлы (send_file), потоковые ответы (SSE),
+    уже сжатые (лента) и ответы с ETag: сжатый вариант должен иметь свой ETag, это делает сам обработчик.
+    """
+    if (not COMPRESS_LEVEL or resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or 'Content-Encoding' in resp.headers or resp.mimetype not in COMPRESS_MIMETYPES
+            or 'ETag' in resp.headers):
+        return resp
+    if (resp.content_length or 0) < COMPRESS_MIN_SIZE:
+        return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = response_encoding()
+    if encoding:
+        resp.set_data(compress(resp.get_data(), encoding, COMPRESS_LEVEL, COMPRESS_BROTLI_QUALITY))
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+
+def _pool_stats(*keys):
+    # Пул создаётся при первом запросе к БД — до этого метрик пула нет
+    pool = _db_pool
+    return None if pool is None else {(key,): pool.stats()[key] for key in keys}
+
+
+metrics.callback('postshet_db_pool_connections', 'Соединения пула', lambda: _pool_stats('in_use', 'idle', 'size'),
+                 labels=('state',))
+metrics.callback('postshet_db_pool_events_total', 'События пула', kind='counter', labels=('event',),
+                 fn=lambda: _pool_stats('acquired', 'waits', 'timeouts', 'created', 'recycled', 'discarded'))
+metrics.callback('postshet_db_breaker_open', 'Автомат отключения БД открыт (1) или закрыт (0)',
+                 lambda: int(db_breaker.stats()['state'] != BREAKER_CLOSED))
+metrics.callback('postshet_feed_cache_lookups_total', 'Обращения к кешу ленты', kind='counter', labels=('result',),
+                 fn=lambda: {('hit',): feed_cache.stats()['hits'], ('miss',): feed_cache.stats()['misses']})
+metrics.callback('postshet_feed_cache_hit_ratio', 'Доля попаданий в кеш ленты', lambda: feed_cache.stats()['hit_ratio'])
+metrics.callback('postshet_feed_cache_pages', 'Страниц ленты в кеше', lambda: feed_cache.stats()['pages'])
+metrics.callback('postshet_reaction_buffer_pending_events', 'Несброшенные клики (REACTIONS_WRITE_BEHIND)',
+                 lambda: reaction_buffer.stats()['pending_events'])
+metrics.callback('postshet_sse_subscribers', 'Открытые потоки /api/stream', lambda: event_hub.stats()['subscribers'])
+metrics.callback('postshet_avatar_fetches_pending', 'Аватарки в очереди загрузки', lambda: avatar_fetcher.stats()['pending'])
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus."""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'error': 'forbidden'}), 403
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/admin/db-pool')
+def db_pool_stats():
+    """Статистика пула соединений и автомата отключения БД текущего процесса. Только для администраторов."""
+    user = session.get('user')
+    if not user or user.get('telegram_id') not in ADMIN_TELEGRAM_IDS:
+        return jsonify({'error': 'forbidden'}), 403
+    data = get_db_pool().stats()
+    data['breaker'] = db_breaker.stats()
+    return jsonify(data)
+
+
+@app.route('/api/admin/feed-cache')
+def feed_cache_stats():
+    """Попадания/промахи кеша ленты текущего процесса. Только для администраторов."""
+    user = session.get('user')
+    if not user or user.get('telegram_id') not in ADMIN_TELEGRAM_IDS:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(feed_cache.stats())
+
+
+@app.route('/api/admin/profiles/token', methods=['POST'])
+def profile_token():
+    """Токен для заголовка X-Profile (профилирование без сессии, например из curl). Только для администраторов."""
+    user = session.get('user')
+    if not user or user.get('telegram_id') not in ADMIN_TELEGRAM_IDS:
+        return jsonify({'error': 'forbidden'}), 403
+    token = make_token(PROFILE_TOKEN_SECRET, user['telegram_id'], PROFILE_TOKEN_TTL)
+    return jsonify({'token': token, 'header': 'X-Profile', 'expires_in': PROFILE_TOKEN_TTL})
+
+
+@app.route('/api/admin/profiles')
+def list_profiles():
+    """Последние профили запросов (общие для всех процессов), новые первыми. Только для администраторов."""
+    if _profile_admin_id() is None:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify({'keep': PROFILE_KEEP, 'profiles': profile_store.list()})
+
+
+@app.route('/api/admin/profiles/<filename>')
+def get_profile(filename):
+    """Файл профиля: свёрнутые стеки (.txt) или pstats (.prof). Только для администраторов."""
+    if _profile_admin_id() is None:
+        return jsonify({'error': 'forbidden'}), 403
+    if profile_store.path(filename) is None:
+        return jsonify({'error': 'not_found'}), 404
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=True)
+
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    """Все соединения заняты дольше DB_POOL_TIMEOUT — отвечаем 503, а не висим."""
+    print(f"Warning: {e}")
+    return jsonify({'error': 'db_busy'}), 503
+
+
+@app.errorhandler(DatabaseUnavailable)
+def handle_db_unavailable(e):
+    """База недоступна (автомат отключения открыт) — быстрый 503 с подсказкой, когда повторить."""
+    resp = jsonify({'error': 'db_unavailable'})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = e.retry_after_header
+    return resp
+
+
 if __name__ == '__main__':
     # Порт 80 нужен, чтобы origin был http://127.0.0.1 и совпадал с frame-ancestors виджета Telegram.
     # На Windows для порта 80 может потребоваться запуск от администратора. Или задайте PORT в .env.
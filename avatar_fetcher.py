@@ -0,0 +1,108 @@
+"""
+Фоновая загрузка аватарок пользователей из Telegram Bot API.
+
+Раньше вход по ссылке из бота ждал три последовательных запроса к Telegram (getUserProfilePhotos,
+getFile, сам файл) без таймаута, занимая воркер. Теперь вход сразу отвечает (на месте аватарки —
+заглушка с первой буквой имени), а фото скачивается в фоновом потоке: у каждого запроса таймаут,
+один и тот же пользователь не ставится в очередь дважды (ключ — telegram_id), результат записывает
+callback (users.photo_url + время проверки, чтобы повторные входы в пределах TTL ничего не качали).
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+
+def fetch_user_photo(telegram_id, bot_token, folder, api_base='https://api.telegram.org', timeout=5.0):
+    """
+    Скачать фото профиля в folder/user_avatar_<id>.<ext>. Возвращает URL (/uploads/...),
+    '' — фото у пользователя нет; None — ошибка (Telegram недоступен, таймаут).
+    """
+    api = f'{api_base}/bot{bot_token}'
+    try:
+        with urlopen(Request(f'{api}/getUserProfilePhotos?user_id={int(telegram_id)}&limit=1'), timeout=timeout) as r:
+            data = json.loads(r.read().decode())
+        if not data.get('ok'):
+            return None
+        if not data.get('result', {}).get('photos'):
+            return ''
+        file_id = data['result']['photos'][0][-1]['file_id']
+        with urlopen(Request(f'{api}/getFile?file_id={quote(file_id)}'), timeout=timeout) as r:
+            file_data = json.loads(r.read().decode())
+        if not file_data.get('ok'):
+            return None
+        file_path = file_data['result']['file_path']
+        ext = os.path.splitext(file_path)[1] or '.jpg'
+        filename = f'user_avatar_{int(telegram_id)}{ext}'
+        full_path = os.path.join(folder, filename)
+        tmp_path = full_path + '.part'
+        with urlopen(Request(f'{api_base}/file/bot{bot_token}/{file_path}'), timeout=timeout) as r:
+            with open(tmp_path, 'wb') as f:
+                f.write(r.read())
+        os.replace(tmp_path, full_path)  # старая аватарка подменяется целиком, без полузаписанного файла
+        return f'/uploads/{filename}'
+    except (HTTPError, URLError, OSError, KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+class AvatarFetcher:
+    """
+    fetch_fn(telegram_id) -> URL / '' / None (см. fetch_user_photo); on_fetched(telegram_id, result) вызывается
+    в фоновом потоке после каждой загрузки, в том числе неудачной (result is None).
+    """
+
+    def __init__(self, fetch_fn, on_fetched, workers=2):
+        self.fetch_fn = fetch_fn
+        self.on_fetched = on_fetched
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self._pid = None
+        self._stats = {'queued': 0, 'deduped': 0, 'fetched': 0, 'no_photo': 0, 'failed': 0}
+
+    def _get_executor(self):
+        # Пул создаётся лениво и заново в каждом процессе (после fork потоки не наследуются)
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='avatar')
+        return self._executor
+
+    def submit(self, telegram_id):
+        """Поставить загрузку в очередь. False — этот пользователь уже в очереди."""
+        with self._lock:
+            executor = self._get_executor()
+            if telegram_id in self._pending:
+                self._stats['deduped'] += 1
+                return False
+            self._pending.add(telegram_id)
+            self._stats['queued'] += 1
+        executor.submit(self._run, telegram_id)
+        return True
+
+    def is_pending(self, telegram_id):
+        with self._lock:
+            return self._pid == os.getpid() and telegram_id in self._pending
+
+    def _run(self, telegram_id):
+        result = None
+        try:
+            result = self.fetch_fn(telegram_id)
+            self.on_fetched(telegram_id, result)
+        except Exception as e:
+            print(f"Ошибка загрузки аватарки {telegram_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(telegram_id)
+                key = 'failed' if result is None else 'fetched' if result else 'no_photo'
+                self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['pending'] = len(self._pending) if self._pid == os.getpid() else 0
+        return data
@@ -0,0 +1,169 @@
+"""
+Импорт истории канала из экспорта Telegram Desktop (result.json + папки photos/, video_files/ ...).
+
+Файлы копируются в uploads/ под именами по содержимому (см. media_files.py) в несколько потоков,
+строки постов загружаются пачками: COPY во временную таблицу и один INSERT ... SELECT ... ON CONFLICT
+(telegram_id) DO NOTHING в posts. Сообщения, которые уже есть в posts, пропускаются ещё до копирования
+файлов, поэтому прерванный импорт можно просто запустить ещё раз — он продолжит с того же места.
+Уменьшенные копии и заглушки потом досоздают flask media-variants / flask media-meta.
+"""
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from media_files import HASH_CHUNK_SIZE, HashingWriter, hashed_name
+
+# Какие файлы экспорта становятся постами: media_type экспорта -> media_type поста
+EXPORT_FILE_TYPES = {'video_file': 'video', 'animation': 'video'}
+STAGING_COLUMNS = (
+    'telegram_id', 'media_type', 'media_path', 'caption', 'created_at',
+    'media_width', 'media_height', 'media_duration', 'media_sha256', 'media_size',
+)
+
+
+def message_text(text):
+    """Поле text экспорта: строка или список из строк и {"type": ..., "text": ...} (ссылки, жирный и т.п.)."""
+    if isinstance(text, str):
+        return text
+    return ''.join(part if isinstance(part, str) else part.get('text', '') for part in text or [])
+
+
+def export_posts(export_dir):
+    """
+    Сообщения экспорта с фото/видео/гифкой в виде словарей для posts (без media_path — файл ещё не скопирован).
+    Сообщения без медиа и файлы, не попавшие в экспорт, пропускаются.
+    """
+    with open(os.path.join(export_dir, 'result.json'), encoding='utf-8') as f:
+        export = json.load(f)
+    for message in export.get('messages', []):
+        if message.get('type') != 'message':
+            continue
+        if message.get('photo'):
+            source, media_type = message['photo'], 'photo'
+        elif message.get('file') and message.get('media_type') in EXPORT_FILE_TYPES:
+            source, media_type = message['file'], EXPORT_FILE_TYPES[message['media_type']]
+        else:
+            continue
+        source_path = os.path.join(export_dir, source)
+        if not os.path.isfile(source_path):  # «File not included», если медиа не выгружали
+            continue
+        yield {
+            'telegram_id': message['id'],
+            'media_type': media_type,
+            'source_path': source_path,
+            'caption': message_text(message.get('text')),
+            'created_at': (datetime.fromtimestamp(int(message['date_unixtime']), timezone.utc).isoformat()
+                           if message.get('date_unixtime') else None),
+            'media_width': message.get('width'),
+            'media_height': message.get('height'),
+            'media_duration': message.get('duration_seconds'),
+        }
+
+
+def copy_media(source_path, folder):
+    """
+    Скопировать файл в folder под именем по содержимому (хеш считается по ходу копирования).
+    Возвращает (имя, sha256, размер); если такой файл уже есть, копия выбрасывается.
+    """
+    ext = os.path.splitext(source_path)[1] or '.bin'
+    tmp_path = os.path.join(folder, f'.import_{os.getpid()}_{threading.get_ident()}.part')
+    with open(source_path, 'rb') as src, HashingWriter(tmp_path) as writer:
+        for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b''):
+            writer.write(chunk)
+    name = hashed_name(writer.hexdigest(), ext)
+    target = os.path.join(folder, name)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+    return name, writer.hexdigest(), writer.size
+
+
+def _copy_value(value):
+    """Значение для COPY ... (FORMAT text): \\N для NULL, экранирование спецсимволов."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def load_batch(conn, posts):
+    """
+    COPY пачки во временную таблицу и перенос в posts одним INSERT ... ON CONFLICT DO NOTHING.
+    Хеши и размеры файлов записываются в media_objects (строки создаёт триггер на posts).
+    Возвращает число новых постов. Транзакцию фиксирует вызывающий.
+    """
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS import_posts (
+            telegram_id BIGINT, media_type TEXT, media_path TEXT, caption TEXT, created_at TIMESTAMPTZ,
+            media_width INT, media_height INT, media_duration REAL, media_sha256 TEXT, media_size BIGINT
+        ) ON COMMIT DELETE ROWS
+        """
+    )
+    buf = io.StringIO()
+    for post in posts:
+        buf.write('\t'.join(_copy_value(post.get(col)) for col in STAGING_COLUMNS) + '\n')
+    buf.seek(0)
+    c.copy_expert(f"COPY import_posts ({', '.join(STAGING_COLUMNS)}) FROM STDIN", buf)
+    c.execute(
+        """
+        INSERT INTO posts (telegram_id, media_type, media_path, caption, created_at,
+                           media_width, media_height, media_duration)
+        SELECT DISTINCT ON (telegram_id)
+               telegram_id, media_type, media_path, caption, COALESCE(created_at, now())::timestamp,
+               media_width, media_height, media_duration
+        FROM import_posts
+        ORDER BY telegram_id
+        ON CONFLICT (telegram_id) DO NOTHING
+        """
+    )
+    inserted = c.rowcount
+    c.execute(
+        """
+        UPDATE media_objects mo
+        SET sha256 = COALESCE(mo.sha256, i.media_sha256), size = COALESCE(mo.size, i.media_size)
+        FROM (SELECT DISTINCT ON (media_path) media_path, media_sha256, media_size FROM import_posts) i
+        WHERE mo.media_path = i.media_path AND (mo.sha256 IS NULL OR mo.size IS NULL)
+        """
+    )
+    return inserted
+
+
+def import_export(conn, export_dir, folder, workers=8, batch_size=2000, log=print):
+    """
+    Импортировать экспорт канала. conn — соединение psycopg2 (пачки фиксируются по очереди).
+    Возвращает {"posts": новых постов, "skipped": уже были, "files_mb": скопировано МБ, "seconds": ...}.
+    """
+    started = time.perf_counter()
+    posts = list(export_posts(export_dir))
+    c = conn.cursor()
+    c.execute('SELECT telegram_id FROM posts WHERE telegram_id = ANY(%s)', ([p['telegram_id'] for p in posts],))
+    done = {row[0] for row in c.fetchall()}
+    conn.commit()
+    todo = [p for p in posts if p['telegram_id'] not in done]
+    log(f"В экспорте постов с медиа: {len(posts)}, уже импортировано: {len(posts) - len(todo)}, осталось: {len(todo)}")
+
+    inserted = 0
+    copied_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(todo), batch_size):
+            batch = todo[offset:offset + batch_size]
+            for post, (name, digest, size) in zip(batch, pool.map(lambda p: copy_media(p['source_path'], folder), batch)):
+                post.update(media_path=name, media_sha256=digest, media_size=size)
+                copied_bytes += size
+            inserted += load_batch(conn, batch)
+            conn.commit()
+            elapsed = time.perf_counter() - started
+            log(f"  {offset + len(batch)}/{len(todo)}: {inserted / elapsed:.0f} постов/с, "
+                f"{copied_bytes / 1024 / 1024 / elapsed:.1f} МБ/с")
+    return {
+        'posts': inserted,
+        'skipped': len(posts) - len(todo),
+        'files_mb': round(copied_bytes / 1024 / 1024, 1),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
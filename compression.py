@@ -0,0 +1,84 @@
+"""
+Сжатие ответов по Accept-Encoding: gzip (zlib) и brotli, если установлен пакет brotli.
+
+Для ленты есть GzipPrefix: общая часть тела сжимается один раз, а для каждого запроса досжимается
+только личный хвост (my_reactions). Это возможно, потому что deflate — последовательность блоков:
+после Z_SYNC_FLUSH сжатый префикс кончается на границе байта незавершённым блоком, и к нему можно
+дописать блоки второго компрессора; CRC32 всего тела досчитывается от CRC префикса. Получается один
+обычный gzip-поток (не несколько склеенных member), который понимает любой клиент.
+"""
+import struct
+import zlib
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость: без неё — только gzip
+    brotli = None
+
+# Заголовок gzip (RFC 1952): deflate, без имени файла и времени, ОС «неизвестна»
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding, encodings):
+    """
+    Лучшая кодировка из encodings (в порядке предпочтения сервера), которую принимает клиент, или None.
+    q=0 — явный отказ; '*' разрешает всё, что не названо отдельно.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def gzip_compress(data, level=6):
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = c.compress(data) + c.flush()
+    return GZIP_HEADER + body + struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+
+
+def brotli_compress(data, quality=5):
+    return brotli.compress(data, quality=quality, mode=brotli.MODE_TEXT)
+
+
+def compress(data, encoding, level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli_compress(data, brotli_quality)
+    return gzip_compress(data, level)
+
+
+class GzipPrefix:
+    """Сжатый один раз префикс тела; finish(tail) — полный gzip префикса и хвоста."""
+
+    __slots__ = ('deflated', 'crc', 'size', 'level')
+
+    def __init__(self, prefix, level=6):
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.deflated = c.compress(prefix) + c.flush(zlib.Z_SYNC_FLUSH)
+        self.crc = zlib.crc32(prefix)
+        self.size = len(prefix)
+        self.level = level
+
+    def finish(self, tail):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        rest = c.compress(tail) + c.flush()
+        trailer = struct.pack('<II', zlib.crc32(tail, self.crc), (self.size + len(tail)) & 0xffffffff)
+        return b''.join((GZIP_HEADER, self.deflated, rest, trailer))
@@ -0,0 +1,163 @@
+"""
+Автомат отключения (circuit breaker) для PostgreSQL.
+
+Пока база отвечает — состояние closed, запросы идут как обычно. После failure_threshold
+подряд неудачных подключений состояние становится open: запросы сразу получают
+DatabaseUnavailable (API отвечает 503 + Retry-After), не дожидаясь таймаута соединения.
+Фоновый поток пробует подключиться с экспоненциальной паузой (half_open — идёт проба);
+первая удачная проба возвращает closed.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DatabaseUnavailable(RuntimeError):
+    """База недоступна; retry_after — через сколько секунд имеет смысл повторить запрос."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class CircuitBreaker:
+    """
+    probe_fn() — проверка базы (бросает исключение, если недоступна);
+    failure_threshold — сколько неудач подряд переводят в open;
+    base_delay / max_delay — первая и максимальная пауза между пробами, сек (пауза удваивается).
+    """
+
+    def __init__(self, probe_fn, failure_threshold=3, base_delay=1.0, max_delay=30.0):
+        self.probe_fn = probe_fn
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._delay = base_delay
+        self._next_probe = 0.0
+        self._last_error = None
+        self._pid = os.getpid()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stats = {'opened': 0, 'probes': 0, 'failed_probes': 0, 'rejected': 0}
+
+    @property
+    def state(self):
+        return self._state
+
+    def _check_pid(self):
+        # После fork поток проб не наследуется: в дочернем процессе запускаем свой
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = None
+            self._wake = threading.Event()
+            if self._state != CLOSED:
+                self._start_prober()
+
+    def _start_prober(self):
+        self._thread = threading.Thread(target=self._run, name='db-breaker', daemon=True)
+        self._thread.start()
+
+    def before_call(self):
+        """Вызывается перед обращением к базе: в open/half_open сразу бросает DatabaseUnavailable."""
+        self._check_pid()
+        if self._state == CLOSED:
+            return
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            self._stats['rejected'] += 1
+            retry_after = max(self._next_probe - time.monotonic(), 0.0) + 1.0
+            error = self._last_error
+        raise DatabaseUnavailable(f'База данных недоступна: {error}', retry_after)
+
+    def record_success(self):
+        if self._state == CLOSED and not self._failures:
+            return
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._close()
+
+    def record_failure(self, error):
+        """Неудачное подключение. Возвращает DatabaseUnavailable, который стоит бросить вызывающему."""
+        self._check_pid()
+        with self._lock:
+            self._failures += 1
+            self._last_error = error
+            if self._state == CLOSED and self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._delay = self.base_delay
+                self._next_probe = time.monotonic() + self._delay
+                self._stats['opened'] += 1
+                print(f"Warning: PostgreSQL недоступен ({error}), запросы к БД отклоняются до восстановления")
+                if self._thread is None or not self._thread.is_alive():
+                    self._start_prober()
+            retry_after = max(self._next_probe - time.monotonic(), 0.0) + 1.0
+        return DatabaseUnavailable(f'База данных недоступна: {error}', retry_after)
+
+    def _close(self):
+        self._state = CLOSED
+        self._delay = self.base_delay
+        self._last_error = None
+        self._wake.set()
+        print("PostgreSQL снова доступен, запросы к БД возобновлены")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._state == CLOSED:
+                    self._thread = None
+                    return
+                wait = self._next_probe - time.monotonic()
+            if wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+            with self._lock:
+                if self._state == CLOSED:
+                    continue
+                self._state = HALF_OPEN
+                self._stats['probes'] += 1
+            try:
+                self.probe_fn()
+            except Exception as e:
+                with self._lock:
+                    self._stats['failed_probes'] += 1
+                    self._last_error = e
+                    self._state = OPEN
+                    self._delay = min(self._delay * 2, self.max_delay)
+                    # Небольшой разброс, чтобы воркеры не проверяли базу синхронно
+                    self._next_probe = time.monotonic() + self._delay * random.uniform(0.8, 1.2)
+                continue
+            with self._lock:
+                self._failures = 0
+                if self._state != CLOSED:
+                    self._close()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'state': self._state,
+                'failures': self._failures,
+                'retry_in': round(max(self._next_probe - time.monotonic(), 0.0), 3) if self._state != CLOSED else 0.0,
+                'last_error': str(self._last_error) if self._last_error else None,
+            })
+        return data
@@ -0,0 +1,266 @@
+"""
+Пул соединений PostgreSQL для Flask-приложения.
+
+Ограниченный пул (min/max), ожидание свободного соединения с таймаутом,
+проверка соединения при выдаче, пересоздание после N использований или по возрасту
+и переинициализация в дочернем процессе после fork (gunicorn --preload и т.п.).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(RuntimeError):
+    """Свободное соединение не появилось за отведённое время."""
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used', 'uses')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.uses = 0
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+
+    minconn — сколько соединений держать открытыми после prefill();
+    maxconn — жёсткий предел одновременно открытых соединений;
+    timeout — сколько секунд ждать свободное соединение, затем PoolTimeout;
+    max_uses / max_age — после стольких выдач или секунд жизни соединение пересоздаётся;
+    check_idle — если соединение простаивало дольше (сек), перед выдачей делаем SELECT 1.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, max_uses=1000, max_age=1800.0,
+                 check_idle=10.0, connect_kwargs=None):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError('Некорректные размеры пула: minconn=%s, maxconn=%s' % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.check_idle = check_idle
+        self.connect_kwargs = dict(connect_kwargs or {})
+        self._init_state()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _init_state(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []  # LIFO: горячие соединения выдаются первыми
+        self._size = 0  # открытые + открываемые прямо сейчас
+        self._in_use = 0
+        # Соединения, унаследованные от родителя после fork: не закрываем (это оборвало бы
+        # сессию родителя через общий сокет) и держим ссылки, чтобы их не финализировал GC.
+        self._orphans = getattr(self, '_orphans', [])
+        self._stats = {
+            'acquired': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'failed_checks': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _after_fork(self):
+        inherited = [pc.conn for pc in self._idle]
+        self._init_state()
+        self._orphans.extend(inherited)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._cond:
+            self._stats['created'] += 1
+        return _PooledConnection(conn)
+
+    def _expired(self, pc, now):
+        if self.max_uses and pc.uses >= self.max_uses:
+            return True
+        return bool(self.max_age) and now - pc.created_at >= self.max_age
+
+    def _healthy(self, pc, now):
+        """Проверка при выдаче: закрытое/просроченное соединение — в утиль, долго простаивавшее — пингуем."""
+        conn = pc.conn
+        if conn.closed:
+            return False
+        if self._expired(pc, now):
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if self.check_idle is not None and now - pc.last_used >= self.check_idle:
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT 1')
+                cur.close()
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._stats['failed_checks'] += 1
+                return False
+        return True
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self, timeout=None):
+        """Взять соединение (обёртку _PooledConnection). Вернуть его нужно через release()."""
+        self._check_pid()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    pc = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    pc = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('Нет свободных соединений с БД за %.1f с (max=%d)' % (timeout, self.maxconn))
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if pc is not None and not self._healthy(pc, time.monotonic()):
+                self._close_quietly(pc.conn)
+                pc = None
+            if pc is None:
+                pc = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        wait_time = time.monotonic() - started
+        with self._cond:
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total'] += wait_time
+            if wait_time > self._stats['wait_time_max']:
+                self._stats['wait_time_max'] = wait_time
+        return pc
+
+    def release(self, pc, discard=False):
+        """Вернуть соединение в пул. Незавершённая транзакция откатывается."""
+        if self._pid != os.getpid():
+            # Соединение взято до fork, а возвращается уже в дочернем процессе
+            self._orphans.append(pc.conn)
+            return
+        conn = pc.conn
+        if not discard:
+            if conn.closed:
+                discard = True
+            elif conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        now = time.monotonic()
+        pc.uses += 1
+        pc.last_used = now
+        if not discard and self._expired(pc, now):
+            discard = True
+            with self._cond:
+                self._stats['recycled'] += 1
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append(pc)
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """with pool.connection() as conn: ... — соединение гарантированно вернётся в пул."""
+        pc = self.acquire(timeout)
+        discard = False
+        try:
+            yield pc.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(pc, discard)
+
+    def prefill(self):
+        """Открыть соединения до minconn (например, сразу после старта процесса)."""
+        self._check_pid()
+        opened = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.minconn:
+                        break
+                    self._size += 1
+                try:
+                    opened.append(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                    raise
+        finally:
+            with self._cond:
+                self._idle.extend(opened)
+                self._cond.notify_all()
+
+    def closeall(self):
+        """Закрыть все свободные соединения (выданные закроются при возврате)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pc in idle:
+            self._close_quietly(pc.conn)
+
+    def stats(self):
+        """Снимок состояния пула для подбора размеров."""
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                'pid': self._pid,
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+            })
+        acquired = data['acquired']
+        data['wait_time_avg_ms'] = round(data.pop('wait_time_total') / acquired * 1000, 3) if acquired else 0.0
+        data['wait_time_max_ms'] = round(data.pop('wait_time_max') * 1000, 3)
+        return data
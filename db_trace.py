@@ -0,0 +1,76 @@
+"""
+Наблюдение за SQL-запросами psycopg2.
+
+TracedConnection передаётся пулу как connection_factory; курсоры такого соединения (любого
+cursor_factory, в том числе RealDictCursor) после каждого execute/executemany вызывают наблюдателей
+add_observer(fn): fn(cursor, sql, params, seconds). Наблюдатель вызывается в потоке запроса, поэтому
+должен быть быстрым; его исключения только печатаются. COPY (copy_expert) не отслеживается.
+"""
+import time
+
+import psycopg2.extensions
+
+_observers = []
+_cursor_classes = {}
+
+
+def add_observer(fn):
+    """Подписать fn(cursor, sql, params, seconds) на все запросы через TracedConnection."""
+    _observers.append(fn)
+
+
+def remove_observer(fn):
+    """Отписать наблюдателя, добавленного add_observer (если он есть)."""
+    if fn in _observers:
+        _observers.remove(fn)
+
+
+def _notify(cursor, sql, params, seconds):
+    for fn in _observers:
+        try:
+            fn(cursor, sql, params, seconds)
+        except Exception as e:
+            print(f"Warning: наблюдатель SQL {fn.__name__}: {e}")
+
+
+def statement_kind(sql):
+    """Первое слово запроса в верхнем регистре: SELECT, INSERT, WITH, ..."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        return 'OTHER'  # psycopg2.sql.Composed — текст без соединения не получить
+    head = sql.lstrip().split(None, 1)
+    return head[0].upper() if head else 'OTHER'
+
+
+def traced_cursor_class(base):
+    """Подкласс курсора base, замеряющий execute/executemany (класс создаётся один раз на base)."""
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        class TracedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _notify(self, query, vars, time.perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _notify(self, query, None, time.perf_counter() - started)
+
+        TracedCursor.__name__ = f'Traced{base.__name__}'
+        cls = _cursor_classes[base] = TracedCursor
+    return cls
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    """Соединение, все курсоры которого сообщают наблюдателям о запросах."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = traced_cursor_class(base)
+        return super().cursor(*args, **kwargs)
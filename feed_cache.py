@@ -0,0 +1,136 @@
+"""
+Кеш ленты в памяти процесса.
+
+Общая для всех часть страницы (посты + счётчики реакций) хранится уже сериализованной
+в JSON-байты; личная часть (my_reactions текущего пользователя) считается отдельно
+и дописывается в конец тела без повторной сериализации постов.
+Запись привязана к версии ленты (feed_version_seq), поэтому изменения из других
+процессов тоже инвалидируют её; TTL — страховка на случай сбоя версий.
+
+Сжатые варианты тела тоже живут в записи: анонимное тело (одинаковое для всех) сжимается один раз,
+а для личного gzip досжимается только хвост с my_reactions (compression.GzipPrefix).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from compression import GzipPrefix, compress
+
+
+class FeedPage:
+    """Одна закешированная страница ленты."""
+
+    __slots__ = ('version', 'posts', 'next_cursor', 'post_ids', 'created', '_body', '_dumps', '_levels')
+
+    def __init__(self, version, posts, next_cursor, dumps, levels=(6, 5)):
+        self.version = version
+        self.posts = posts
+        self.next_cursor = next_cursor
+        self.post_ids = [p['id'] for p in posts]
+        self.created = time.monotonic()
+        self._dumps = dumps
+        self._levels = levels  # (уровень gzip, качество brotli)
+        self._serialize()
+
+    def _serialize(self):
+        # '{"next_cursor":...,"posts":[...]}' без закрывающей скобки + ключ для личной части.
+        # Байты и их сжатые варианты — один кортеж: apply_reactions меняет его целиком, и render
+        # из другого потока не смешает новое тело со сжатым старым
+        body = self._dumps({'posts': self.posts, 'next_cursor': self.next_cursor})
+        self._body = (body[:-1] + b',"my_reactions":', {})
+
+    @property
+    def head(self):
+        return self._body[0]
+
+    def render(self, my_reactions=None, encoding=None):
+        """
+        Тело ответа: общие байты + {post_id: reaction_type} текущего пользователя.
+        encoding ('gzip' / 'br') — сразу сжатое: общее тело сжимается один раз, личное gzip — только хвост.
+        """
+        head, encoded = self._body
+        tail = (self._dumps(my_reactions) if my_reactions else b'{}') + b'}'
+        if encoding is None:
+            return head + tail
+        level, brotli_quality = self._levels
+        if not my_reactions:
+            body = encoded.get(encoding)
+            if body is None:
+                body = encoded[encoding] = compress(head + tail, encoding, level, brotli_quality)
+            return body
+        if encoding == 'gzip':
+            prefix = encoded.get('gzip-prefix')
+            if prefix is None:
+                prefix = encoded['gzip-prefix'] = GzipPrefix(head, level)
+            return prefix.finish(tail)
+        return compress(head + tail, encoding, level, brotli_quality)
+
+
+class FeedCache:
+    """LRU страниц ленты с TTL и счётчиками попаданий."""
+
+    def __init__(self, dumps, maxsize=64, ttl=30.0, compress_level=6, brotli_quality=5):
+        """dumps(obj) -> bytes; compress_level / brotli_quality — для сжатых вариантов страниц."""
+        self.dumps = dumps
+        self.levels = (compress_level, brotli_quality)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'patched': 0, 'invalidations': 0}
+
+    def get(self, key, version):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page.version != version or time.monotonic() - page.created > self.ttl:
+                if page is not None:
+                    del self._pages[key]
+                self._stats['misses'] += 1
+                return None
+            self._pages.move_to_end(key)
+            self._stats['hits'] += 1
+            return page
+
+    def put(self, key, version, posts, next_cursor):
+        page = FeedPage(version, posts, next_cursor, self.dumps, self.levels)
+        if self.maxsize <= 0:
+            return page
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+        return page
+
+    def apply_reactions(self, new_version, post_id=None, reactions=None):
+        """
+        Версия ленты выросла ровно на 1 из-за реакции: страницы предыдущей версии обновляются
+        на месте (счётчики поста post_id, если он на странице), остальные выбрасываются.
+        post_id=None — общая часть не менялась (изменилась только личная), страницы просто продлеваются.
+        """
+        with self._lock:
+            for key, page in list(self._pages.items()):
+                if page.version != new_version - 1 or (post_id is not None and reactions is None):
+                    del self._pages[key]
+                    continue
+                if post_id in page.post_ids:
+                    posts = list(page.posts)
+                    idx = page.post_ids.index(post_id)
+                    posts[idx] = dict(posts[idx], reactions=reactions)
+                    page.posts = posts
+                    page._serialize()
+                    self._stats['patched'] += 1
+                page.version = new_version
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['pages'] = len(self._pages)
+        lookups = data['hits'] + data['misses']
+        data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
@@ -0,0 +1,88 @@
+"""
+Сериализация JSON для ответов API: orjson, если установлен, иначе стандартный json.
+
+Формат совпадает с тем, что отдавал Flask: ключи отсортированы, даты — в формате HTTP
+("Tue, 02 Jan 2024 03:04:05 GMT"), Decimal и UUID — строками. Отличия только в байтах, не в данных:
+без пробелов и с UTF-8 вместо \\uXXXX. dumps() возвращает bytes — тело ответа, без лишнего encode().
+
+    codec = JSONCodec('auto')   # 'orjson' | 'stdlib' | 'auto'
+    codec.dumps({'id': 1})      # b'{"id":1}'
+    app.json = CodecJSONProvider(app, codec)  # jsonify() тем же кодировщиком
+"""
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime, timezone
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+BACKENDS = ('auto', 'orjson', 'stdlib')
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_date(dt):
+    """То же, что werkzeug http_date для datetime, но без email.utils — created_at есть у каждого поста."""
+    if dt.tzinfo is not None and dt.utcoffset():
+        dt = dt.astimezone(timezone.utc)
+    return (f'{_DAYS[dt.weekday()]}, {dt.day:02d} {_MONTHS[dt.month - 1]} {dt.year:04d} '
+            f'{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} GMT')
+
+
+def _default(obj):
+    """Типы, которые сам кодировщик не знает (те же правила, что у flask.json.provider)."""
+    if isinstance(obj, datetime):
+        return _http_date(obj)
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JSONCodec:
+    """dumps(obj) -> bytes выбранным кодировщиком; name — какой используется на самом деле."""
+
+    def __init__(self, backend='auto'):
+        if backend not in BACKENDS:
+            raise ValueError(f'JSON_ENCODER: {backend!r}, ожидается одно из {", ".join(BACKENDS)}')
+        if backend == 'orjson' and orjson is None:
+            print("Warning: JSON_ENCODER=orjson, но пакет orjson не установлен — используется json")
+        self.name = 'orjson' if backend != 'stdlib' and orjson is not None else 'stdlib'
+        if self.name == 'orjson':
+            # Даты — через _default, чтобы формат не отличался от stdlib; int-ключи (my_reactions) — строками
+            options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            self.dumps = lambda obj: orjson.dumps(obj, default=_default, option=options)
+        else:
+            encoder = json.JSONEncoder(
+                default=_default, ensure_ascii=False, sort_keys=True, separators=(',', ':'),
+            )
+            self.dumps = lambda obj: encoder.encode(obj).encode()
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask (jsonify, app.json.dumps) поверх JSONCodec; разбор запросов — как у Flask."""
+
+    def __init__(self, app, codec):
+        super().__init__(app)
+        self.codec = codec
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.codec.dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.codec.dumps(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,141 @@
+"""
+Живые обновления ленты: PostgreSQL LISTEN/NOTIFY -> Server-Sent Events.
+
+Обработчики пишут событие через pg_notify('postshet_events', '<json>') в той же транзакции,
+что и само изменение (NOTIFY доставляется только после commit). В каждом процессе одно
+выделенное соединение слушает канал и раздаёт уже отформатированные SSE-сообщения
+очередям всех подписчиков /api/stream.
+"""
+import json
+import os
+import queue
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+EVENTS_CHANNEL = 'postshet_events'
+NOTIFY_PAYLOAD_LIMIT = 8000  # pg_notify: полезная нагрузка должна быть короче 8000 байт
+
+
+def format_sse(event, data):
+    """Одно SSE-сообщение: event + data (JSON в одну строку)."""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(",", ":"))}\n\n'
+
+
+class EventHub:
+    """
+    Слушатель LISTEN в фоновом потоке + раздача подписчикам.
+
+    max_clients — сколько подписчиков держим одновременно (каждый занимает поток воркера);
+    queue_size — сколько сообщений может ждать медленный клиент, после чего он отключается
+    и при переподключении перечитывает ленту.
+    """
+
+    def __init__(self, dsn, channel=EVENTS_CHANNEL, max_clients=100, queue_size=100, connect_kwargs=None):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self.connect_kwargs = dict(connect_kwargs or {})
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {'events': 0, 'dropped_clients': 0, 'reconnects': 0}
+
+    def _ensure_started(self):
+        # Поток слушателя — свой в каждом процессе (после fork потоки не наследуются)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._subscribers = set()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+            self._thread.start()
+
+    def subscribe(self):
+        """Новая очередь подписчика или None, если мест нет."""
+        self._ensure_started()
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, message):
+        """Раздать готовое SSE-сообщение всем подписчикам процесса."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._stats['events'] += 1
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Клиент не успевает читать: отключаем (None), браузер переподключится сам
+                self.unsubscribe(q)
+                with self._lock:
+                    self._stats['dropped_clients'] += 1
+                try:
+                    q.get_nowait()
+                    q.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _handle(self, payload):
+        try:
+            data = json.loads(payload)
+            event = data.pop('type')
+        except (ValueError, KeyError, AttributeError):
+            print(f"Некорректное событие в {self.channel}: {payload[:200]}")
+            return
+        self.publish(format_sse(event, data))
+
+    def _run(self):
+        backoff = 1.0
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f'LISTEN {self.channel}')
+                if not first:
+                    # Пока соединения не было, события могли потеряться — клиентам стоит перечитать ленту
+                    self.publish(format_sse('resync', {}))
+                first = False
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError) as e:
+                with self._lock:
+                    self._stats['reconnects'] += 1
+                print(f"Слушатель событий БД отключился ({e}), переподключение через {backoff:.0f} с")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['subscribers'] = len(self._subscribers)
+        return data
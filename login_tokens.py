@@ -0,0 +1,73 @@
+"""
+Подписанные токены входа по ссылке из бота (LOGIN_TOKEN_MODE=signed).
+
+Токен сам содержит telegram_id, срок действия и случайный nonce и подписан HMAC-SHA256 ключом,
+выведенным из LOGIN_TOKEN_SECRET, поэтому его выдача не пишет в базу. Одноразовость обеспечивает
+кеш использованных nonce (login_token_nonces): запись живёт только до истечения токена и удаляется
+чисткой (sweep), так что таблица остаётся крошечной. Формат: <base64url(telegram_id:expires:nonce)>.<подпись>.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+
+NONCE_BYTES = 12
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signing_key(secret):
+    # Отдельный ключ: сам LOGIN_TOKEN_SECRET бот передаёт в API как пароль
+    return hmac.new(secret.encode(), b'postshet-login-token', hashlib.sha256).digest()
+
+
+def is_signed_token(token):
+    """Подписанный токен (в отличие от случайного токена из таблицы login_tokens) содержит точку."""
+    return '.' in (token or '')
+
+
+def make_token(secret, telegram_id, ttl, now=None):
+    """Выдать токен для telegram_id, действительный ttl секунд."""
+    expires = int((now if now is not None else time.time()) + ttl)
+    payload = _b64encode(f'{int(telegram_id)}:{expires}:{secrets.token_hex(NONCE_BYTES)}'.encode())
+    signature = _b64encode(hmac.new(_signing_key(secret), payload.encode(), hashlib.sha256).digest())
+    return f'{payload}.{signature}'
+
+
+def verify_token(secret, token, now=None):
+    """
+    Проверить подпись и срок. Возвращает (telegram_id, expires, nonce) или None.
+    Одноразовость здесь не проверяется — это делает вызывающий по nonce.
+    """
+    payload, _, signature = (token or '').partition('.')
+    if not payload or not signature:
+        return None
+    expected = _b64encode(hmac.new(_signing_key(secret), payload.encode(), hashlib.sha256).digest())
+    if not hmac.compare_digest(expected, signature):
+        return None
+    try:
+        telegram_id, expires, nonce = _b64decode(payload).decode().split(':')
+        telegram_id, expires = int(telegram_id), int(expires)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if expires < (now if now is not None else time.time()):
+        return None
+    return telegram_id, expires, nonce
+
+
+def sweep(c, ttl):
+    """
+    Удалить просроченные токены таблицы (индекс по created_at) и использованные nonce с истёкшим сроком.
+    Возвращает (удалено токенов, удалено nonce).
+    """
+    c.execute("DELETE FROM login_tokens WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'", (ttl,))
+    tokens = c.rowcount
+    c.execute('DELETE FROM login_token_nonces WHERE expires_at < now()')
+    return tokens, c.rowcount
@@ -0,0 +1,211 @@
+"""
+Медиафайлы в uploads/: имена по содержимому, srcset уменьшенных копий и отдача диапазонов байт.
+
+Бот сохраняет файл под именем <sha256[:32]>.<ext>: одинаковое содержимое — одно имя, а файл
+под таким именем никогда не меняется, поэтому его можно кешировать навсегда (immutable).
+Модуль без зависимостей от Flask — его импортируют и сайт, и боты.
+"""
+import hashlib
+import os
+import re
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASHED_NAME_LEN = 32
+
+# Имена, выданные content_hashed_name(), и производные от них (<hash>_w640.webp, <hash>_poster.jpg):
+# только их можно отдавать с Cache-Control: immutable
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{%d}(_w\d+|_poster)?\.[0-9A-Za-z]{1,8}$' % HASHED_NAME_LEN)
+
+
+def is_hashed_name(filename):
+    return bool(HASHED_NAME_RE.match(filename or ''))
+
+
+def hash_file(path):
+    """SHA-256 файла (hex), читается кусками — большие видео не попадают в память целиком."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashingWriter:
+    """
+    Файл для записи, который по ходу записи считает SHA-256 и размер: скачивание идёт кусками
+    прямо на диск, и хеш готов к концу загрузки без повторного чтения файла.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def hashed_name(digest, ext):
+    ext = (ext or 'bin').lstrip('.').lower()
+    return f'{digest[:HASHED_NAME_LEN]}.{ext}'
+
+
+def content_hashed_name(path, ext):
+    return hashed_name(hash_file(path), ext)
+
+
+def store_content_hashed(path, folder, ext, digest=None):
+    """
+    Переименовать скачанный файл path в <hash>.<ext> внутри folder. Возвращает новое имя.
+    digest — SHA-256, уже посчитанный при скачивании (HashingWriter); иначе файл читается ещё раз.
+    Если такой файл уже есть (тот же мем переслали ещё раз), временный файл просто удаляется.
+    """
+    name = hashed_name(digest or hash_file(path), ext)
+    target = os.path.join(folder, name)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return name
+
+
+def post_media_fields(variants, width, height, duration, placeholder, poster, prefix='/uploads/'):
+    """Поля медиа поста для API (лента и события): srcset, размеры, длительность, заглушка, URL постера."""
+    return {
+        'srcset': variant_srcset(variants, prefix),
+        'width': width,
+        'height': height,
+        'duration': duration,
+        'placeholder': placeholder,
+        'poster': prefix + poster if poster else None,
+    }
+
+
+def variant_srcset(variants, prefix='/uploads/'):
+    """posts.media_variants -> {"webp": "<url> 320w, ...", "jpeg": "..."} для <picture>; None, если копий нет."""
+    if not variants:
+        return None
+    return {
+        fmt: ', '.join(f'{prefix}{v[fmt]} {v["w"]}w' for v in variants)
+        for fmt in ('webp', 'jpeg')
+    }
+
+
+def parse_byte_ranges(header):
+    """
+    Range: bytes=0-99,200-,-50 -> [(0, 100), (200, None), (-50, None)] (stop не включительно).
+    None — заголовка нет или он некорректен (по RFC 9110 такой Range игнорируется).
+    """
+    if not header:
+        return None
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix <= 0:
+                    return None
+                ranges.append((-suffix, None))
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else None
+                if start < 0 or (stop is not None and stop <= start):
+                    return None
+                ranges.append((start, stop))
+        except ValueError:
+            return None
+    return ranges
+
+
+def normalize_ranges(ranges, size, max_ranges=16):
+    """
+    [(start, stop), ...] из Range-заголовка (stop не включительно, None — до конца) -> отсортированные
+    слитые диапазоны внутри файла. Пустой список — ни один диапазон не попал в файл (416).
+    None — диапазонов слишком много, проще отдать файл целиком.
+    """
+    result = []
+    for start, stop in ranges:
+        if start < 0:  # bytes=-N: последние N байт
+            start, stop = max(size + start, 0), size
+        stop = size if stop is None else min(stop, size)
+        if start < stop:
+            result.append([start, stop])
+    result.sort()
+    merged = []
+    for start, stop in result:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    if len(merged) > max_ranges:
+        return None
+    return [tuple(r) for r in merged]
+
+
+def iter_file_range(f, start, stop, chunk_size=64 * 1024):
+    """Куски открытого файла f из диапазона [start, stop)."""
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+
+def stream_file_range(path, start, stop):
+    """Генератор байт [start, stop) файла path; файл закрывается, когда генератор исчерпан или закрыт."""
+    with open(path, 'rb') as f:
+        yield from iter_file_range(f, start, stop)
+
+
+def multipart_byteranges(path, ranges, size, content_type, boundary, chunk_size=64 * 1024):
+    """
+    Тело ответа multipart/byteranges для нескольких диапазонов.
+    Возвращает (Content-Length, генератор байт) — длина считается заранее, без чтения файла.
+    """
+    heads = [
+        (
+            f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+        ).encode()
+        for start, stop in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(h) for h in heads) + sum(stop - start for start, stop in ranges)
+    length += 2 * (len(ranges) - 1) + len(closing)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for i, (head, (start, stop)) in enumerate(zip(heads, ranges)):
+                if i:
+                    yield b'\r\n'
+                yield head
+                yield from iter_file_range(f, start, stop, chunk_size)
+        yield closing
+
+    return length, generate()
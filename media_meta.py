@@ -0,0 +1,128 @@
+"""
+Метаданные медиа при загрузке: размеры, длительность, крошечная заглушка (LQIP) и постер видео.
+
+Размеры нужны ленте, чтобы Masonry разложил карточки один раз, заранее зарезервировав место
+под картинки; заглушка (WebP ~16 px в data: URI) показывается, пока грузится само медиа;
+постер позволяет не качать mp4 ради первого кадра (preload="none").
+Кадр и параметры видео берутся через ffmpeg/ffprobe, если они установлены.
+Функции рассчитаны на запуск в ProcessPoolExecutor (как make_variants).
+"""
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+
+from PIL import Image, ImageOps
+
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 50
+POSTER_QUALITY = 3  # -q:v ffmpeg для JPEG: 2 — лучше, 31 — хуже
+FFMPEG_TIMEOUT = 60
+
+
+def has_ffmpeg():
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def placeholder_data_uri(image):
+    """Заглушка: картинка, уменьшенная до PLACEHOLDER_SIZE px по длинной стороне, в data:image/webp."""
+    thumb = image.copy()
+    if thumb.mode not in ('RGB', 'L'):
+        thumb = thumb.convert('RGB')
+    thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buf = io.BytesIO()
+    thumb.save(buf, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+
+def image_meta(media_path, folder):
+    """{"media_width", "media_height", "media_placeholder"} для картинки folder/media_path."""
+    with Image.open(os.path.join(folder, media_path)) as source:
+        image = ImageOps.exif_transpose(source)
+        width, height = image.size
+        return {
+            'media_width': width,
+            'media_height': height,
+            'media_placeholder': placeholder_data_uri(image),
+        }
+
+
+def probe_video(full_path):
+    """Ширина, высота и длительность видео через ffprobe; {} — если ffprobe нет или он не справился."""
+    if not shutil.which('ffprobe'):
+        return {}
+    try:
+        out = subprocess.run(
+            [
+                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height:format=duration', '-of', 'json', full_path,
+            ],
+            capture_output=True, check=True, timeout=FFMPEG_TIMEOUT,
+        ).stdout
+        data = json.loads(out)
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return {}
+    stream = (data.get('streams') or [{}])[0]
+    meta = {}
+    if stream.get('width') and stream.get('height'):
+        meta['media_width'] = int(stream['width'])
+        meta['media_height'] = int(stream['height'])
+    try:
+        meta['media_duration'] = round(float(data['format']['duration']), 3)
+    except (KeyError, TypeError, ValueError):
+        pass
+    return meta
+
+
+def extract_poster(media_path, folder, duration=None):
+    """Кадр видео в <имя>_poster.jpg рядом с файлом (ffmpeg). Возвращает имя постера или None."""
+    if not shutil.which('ffmpeg'):
+        return None
+    poster = os.path.splitext(media_path)[0] + '_poster.jpg'
+    target = os.path.join(folder, poster)
+    if os.path.exists(target):
+        return poster
+    # Не самый первый кадр: у мемов он часто чёрный
+    at = min(1.0, duration / 2) if duration else 0.0
+    tmp_path = target + '.part.jpg'
+    try:
+        subprocess.run(
+            [
+                'ffmpeg', '-v', 'error', '-y', '-ss', f'{at:.3f}', '-i', os.path.join(folder, media_path),
+                '-frames:v', '1', '-q:v', str(POSTER_QUALITY), tmp_path,
+            ],
+            capture_output=True, check=True, timeout=FFMPEG_TIMEOUT,
+        )
+        os.replace(tmp_path, target)
+    except (OSError, subprocess.SubprocessError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return poster
+
+
+def video_meta(media_path, folder, poster=None):
+    """
+    Метаданные видео/анимации. poster — уже сохранённый постер (например, превью от Telegram);
+    если его нет, кадр извлекается ffmpeg. Заглушка строится по постеру.
+    """
+    meta = probe_video(os.path.join(folder, media_path))
+    if poster is None:
+        poster = extract_poster(media_path, folder, meta.get('media_duration'))
+    if poster:
+        meta['media_poster'] = poster
+        with Image.open(os.path.join(folder, poster)) as image:
+            meta['media_placeholder'] = placeholder_data_uri(image)
+            if 'media_width' not in meta:
+                # Без ffprobe пропорции берём у постера (превью Telegram того же соотношения сторон)
+                meta['media_width'], meta['media_height'] = image.size
+    return meta
+
+
+def describe_media(media_path, folder, media_type, poster=None):
+    """Метаданные для колонок posts.media_* (только известные поля)."""
+    if media_type == 'photo':
+        return image_meta(media_path, folder)
+    return video_meta(media_path, folder, poster)
@@ -0,0 +1,60 @@
+"""
+Уменьшенные копии фото для srcset: WebP и JPEG нескольких ширин рядом с оригиналом.
+
+Колонка ленты на телефоне ~200–300 CSS px, на ПК — 15% ширины окна, поэтому полноразмерный
+оригинал почти всегда избыточен. make_variants() вызывается в отдельном процессе
+(ProcessPoolExecutor): кодирование картинок нагружает CPU и не должно стопорить бота
+или веб-воркер.
+"""
+import os
+
+from PIL import Image, ImageOps
+
+# Ширины копий, px: колонка телефона при DPR 1.5–3, колонка ПК при DPR 1–2
+VARIANT_WIDTHS = (320, 640, 960)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def variant_name(media_path, width, ext):
+    stem = os.path.splitext(media_path)[0]
+    return f'{stem}_w{width}.{ext}'
+
+
+def _save(image, path, fmt, quality, force):
+    if os.path.exists(path) and not force:
+        return
+    tmp_path = path + '.part'
+    if fmt == 'JPEG':
+        image.save(tmp_path, fmt, quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(tmp_path, fmt, quality=quality, method=4)
+    os.replace(tmp_path, path)
+
+
+def make_variants(media_path, folder, widths=VARIANT_WIDTHS, force=False):
+    """
+    Записать копии для folder/media_path, вернуть список для posts.media_variants:
+    [{"w": 320, "webp": "<имя>_w320.webp", "jpeg": "<имя>_w320.jpg"}, ...] по возрастанию ширины.
+    Ширины не больше оригинала; последняя запись — WebP в ширину оригинала, JPEG — сам оригинал.
+    Существующие файлы не перекодируются (кроме force=True), поэтому повторный вызов дешёвый.
+    """
+    full_path = os.path.join(folder, media_path)
+    with Image.open(full_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        orig_w, orig_h = image.size
+        variants = []
+        for width in sorted(w for w in widths if w < orig_w):
+            height = max(1, round(orig_h * width / orig_w))
+            resized = image.resize((width, height), Image.LANCZOS)
+            webp = variant_name(media_path, width, 'webp')
+            jpeg = variant_name(media_path, width, 'jpg')
+            _save(resized, os.path.join(folder, webp), 'WEBP', WEBP_QUALITY, force)
+            _save(resized, os.path.join(folder, jpeg), 'JPEG', JPEG_QUALITY, force)
+            variants.append({'w': width, 'webp': webp, 'jpeg': jpeg})
+        webp = variant_name(media_path, orig_w, 'webp')
+        _save(image, os.path.join(folder, webp), 'WEBP', WEBP_QUALITY, force)
+        variants.append({'w': orig_w, 'webp': webp, 'jpeg': media_path})
+    return variants
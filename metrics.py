@@ -0,0 +1,188 @@
+"""
+Метрики процесса в текстовом формате Prometheus (без зависимости от prometheus_client).
+
+Счётчики, значения и гистограммы хранятся в памяти процесса: обновление — словарь и bisect под
+своей блокировкой метрики, поэтому их можно держать включёнными в production. Числа, которые и так
+считают компоненты (stats() пула, кеша ленты, очередей), не дублируются: callback-метрика читает их
+в момент запроса /metrics.
+
+    registry = Registry()
+    REQUESTS = registry.counter('app_requests_total', 'Запросы', ('route',))
+    REQUESTS.inc('/api/posts')
+    registry.render()  # -> текст для GET /metrics
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Границы корзин гистограмм: секунды (от 1 мс до 10 с) и байты (от 256 Б до 16 МБ)
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Для долгих операций: доставка поста с повторами, скачивание и загрузка видео (от 0,1 с до 30 мин)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Только растёт. inc(*значения меток, amount=1)."""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in items]
+
+
+class Gauge(Counter):
+    """Текущее значение: set(value, *метки), inc / dec."""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам: observe(value, *метки)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Callback(_Metric):
+    """
+    Значение, которое читается при каждом render(): fn() возвращает число или {(значения меток): число}.
+    Ошибка в fn не ломает /metrics — метрика просто пропускается.
+    """
+
+    def __init__(self, name, help, fn, kind='gauge', labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Warning: метрика {self.name} не собрана: {e}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self._header() + [
+            f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in sorted(values.items())
+        ]
+
+
+class Registry:
+    """Набор метрик процесса; render() — ответ для GET /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, kind='gauge', labels=()):
+        return self._add(Callback(name, help, fn, kind, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+async def serve(registry, host, port):
+    """
+    Отдельный HTTP-сервер с одним GET /metrics (для бота в режиме polling, у которого своего сервера нет).
+    Возвращает aiohttp AppRunner — остановить: await runner.cleanup().
+    """
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
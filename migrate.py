@@ -0,0 +1,178 @@
+"""
+Версионные миграции схемы PostgreSQL.
+
+Миграции — файлы migrations/NNNN_описание.sql, применяются по возрастанию номера.
+Номер применённой миграции записывается в schema_version в той же транзакции, что и сама
+миграция, поэтому упавшая миграция не оставляет схему «наполовину обновлённой».
+Проверка «схема актуальна» — один SELECT, без DDL; при старте приложения это всё, что
+выполняется, если новых миграций нет.
+
+Запуск вручную:
+    python migrate.py upgrade   — применить новые миграции
+    python migrate.py status    — показать применённые и ожидающие
+(то же самое: flask upgrade / flask schema-status)
+"""
+import os
+import re
+import sys
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Ключ pg_advisory_lock: несколько воркеров, стартующих одновременно, не применяют миграции параллельно
+MIGRATION_LOCK_KEY = 0x706f7374  # 'post'
+
+_FILENAME_RE = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+
+
+class Migration:
+    __slots__ = ('version', 'name', 'path')
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Все миграции из каталога, по возрастанию номера. Повтор номера — ошибка."""
+    migrations = []
+    for filename in os.listdir(directory):
+        m = _FILENAME_RE.match(filename)
+        if m:
+            migrations.append(Migration(int(m.group(1)), m.group(2), os.path.join(directory, filename)))
+    migrations.sort(key=lambda mig: mig.version)
+    for prev, cur in zip(migrations, migrations[1:]):
+        if prev.version == cur.version:
+            raise ValueError(f'Две миграции с номером {cur.version}: {prev.path}, {cur.path}')
+    return migrations
+
+
+def latest_version(migrations=None):
+    migrations = load_migrations() if migrations is None else migrations
+    return migrations[-1].version if migrations else 0
+
+
+def current_version(conn):
+    """Номер последней применённой миграции (0 — схема ещё не создавалась). Без DDL."""
+    c = conn.cursor()
+    c.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not c.fetchone()[0]:
+        conn.rollback()
+        return 0
+    c.execute('SELECT COALESCE(max(version), 0) FROM schema_version')
+    version = c.fetchone()[0]
+    conn.rollback()
+    return version
+
+
+def applied_migrations(conn):
+    """[(version, name, applied_at), ...] из schema_version."""
+    if not current_version(conn):
+        return []
+    c = conn.cursor()
+    c.execute('SELECT version, name, applied_at FROM schema_version ORDER BY version')
+    rows = c.fetchall()
+    conn.rollback()
+    return rows
+
+
+def pending_migrations(conn, migrations=None):
+    migrations = load_migrations() if migrations is None else migrations
+    version = current_version(conn)
+    return [mig for mig in migrations if mig.version > version]
+
+
+def upgrade(conn, migrations=None, verbose=True):
+    """
+    Применить все новые миграции. Возвращает список применённых номеров.
+    Если схема актуальна — только один SELECT, блокировка не берётся.
+    """
+    migrations = load_migrations() if migrations is None else migrations
+    if current_version(conn) >= latest_version(migrations):
+        return []
+
+    c = conn.cursor()
+    c.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    applied = []
+    try:
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+        # Пока ждали блокировку, миграции мог применить другой процесс — перечитываем
+        version = current_version(conn)
+        for mig in migrations:
+            if mig.version <= version:
+                continue
+            if verbose:
+                print(f"Миграция {mig.version:04d}_{mig.name}...")
+            try:
+                c.execute(mig.read())
+                c.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)', (mig.version, mig.name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"Миграция {mig.version:04d}_{mig.name} не применена, схема осталась на версии {version}")
+                raise
+            version = mig.version
+            applied.append(mig.version)
+    finally:
+        c.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+        conn.commit()
+    return applied
+
+
+def print_status(conn, migrations=None):
+    migrations = load_migrations() if migrations is None else migrations
+    applied = {version: (name, applied_at) for version, name, applied_at in applied_migrations(conn)}
+    for mig in migrations:
+        if mig.version in applied:
+            print(f"  [x] {mig.version:04d}_{mig.name}  ({applied[mig.version][1]:%Y-%m-%d %H:%M:%S})")
+        else:
+            print(f"  [ ] {mig.version:04d}_{mig.name}")
+    known = {mig.version for mig in migrations}
+    for version, (name, _) in sorted(applied.items()):
+        if version not in known:
+            print(f"  [?] {version:04d}_{name}  (применена, но файла нет)")
+    print(f"Версия схемы: {current_version(conn)}, последняя миграция: {latest_version(migrations)}")
+
+
+def main(argv=None):
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else 'status'
+    if command not in ('upgrade', 'status'):
+        print('Использование: python migrate.py [upgrade|status]')
+        return 2
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('DATABASE_URL не задан в окружении')
+        return 1
+    conn = psycopg2.connect(dsn)
+    try:
+        if command == 'upgrade':
+            applied = upgrade(conn)
+            print(f"Применено миграций: {len(applied)}" if applied else 'Схема актуальна')
+        else:
+            print_status(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+-- Исходная схема (раньше создавалась в init_db() при каждом запуске).
+-- IF NOT EXISTS — чтобы миграция спокойно прошла и на уже существующей базе.
+
+-- Таблица постов
+CREATE TABLE IF NOT EXISTS posts (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT UNIQUE,
+    media_type TEXT,
+    media_path TEXT,
+    caption TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица реакций (старый агрегат счётчиков по типу на пост)
+CREATE TABLE IF NOT EXISTS reactions (
+    id SERIAL PRIMARY KEY,
+    post_id INTEGER,
+    reaction_type TEXT,
+    count INTEGER DEFAULT 1,
+    FOREIGN KEY (post_id) REFERENCES posts(id)
+);
+
+-- Реакции пользователей: одна запись на (пост, пользователь)
+CREATE TABLE IF NOT EXISTS user_reactions (
+    post_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    reaction_type TEXT NOT NULL,
+    PRIMARY KEY (post_id, user_id),
+    FOREIGN KEY (post_id) REFERENCES posts(id)
+);
+
+-- Таблица информации о канале
+CREATE TABLE IF NOT EXISTS channel_info (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    avatar_url TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица пользователей (привязка Telegram)
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    photo_url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Одноразовые токены для входа через бота (мобильный flow)
+CREATE TABLE IF NOT EXISTS login_tokens (
+    token TEXT PRIMARY KEY,
+    telegram_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
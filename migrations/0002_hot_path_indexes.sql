@@ -0,0 +1,27 @@
+-- Индексы под горячие запросы.
+
+-- Лента: ORDER BY created_at DESC, id DESC + keyset-пагинация (created_at, id) < (...)
+CREATE INDEX IF NOT EXISTS posts_created_at_id_idx ON posts (created_at DESC, id DESC);
+
+-- Личная часть ленты: WHERE user_id = %s AND post_id = ANY(...)
+CREATE INDEX IF NOT EXISTS user_reactions_user_post_idx ON user_reactions (user_id, post_id);
+
+-- Старая таблица reactions: не больше одной строки на (post_id, reaction_type).
+-- Дубликаты (гонка двух первых реакций) сливаем в строку с меньшим id.
+UPDATE reactions r
+SET count = d.total
+FROM (
+    SELECT min(id) AS keep_id, sum(count) AS total
+    FROM reactions
+    GROUP BY post_id, reaction_type
+    HAVING count(*) > 1
+) d
+WHERE r.id = d.keep_id;
+
+DELETE FROM reactions r
+USING reactions keep
+WHERE keep.post_id = r.post_id
+  AND keep.reaction_type = r.reaction_type
+  AND keep.id < r.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS reactions_post_type_uidx ON reactions (post_id, reaction_type);
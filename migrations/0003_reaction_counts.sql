@@ -0,0 +1,43 @@
+-- Счётчики реакций прямо в строке поста: {"like": 3, "heart": 1}. Лента читает их без JOIN и GROUP BY.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS reaction_counts JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+-- Прибавить delta к счётчику rtype; нулевые и отрицательные ключи удаляются из объекта
+CREATE OR REPLACE FUNCTION reaction_counts_add(counts JSONB, rtype TEXT, delta INTEGER)
+RETURNS JSONB LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN rtype IS NULL OR delta = 0 THEN counts
+        WHEN COALESCE((counts ->> rtype)::int, 0) + delta <= 0 THEN counts - rtype
+        ELSE jsonb_set(counts, ARRAY[rtype], to_jsonb(COALESCE((counts ->> rtype)::int, 0) + delta))
+    END
+$$;
+
+-- Сложить счётчики с дельтами {"like": 2, "heart": -1}; нулевые ключи удаляются
+CREATE OR REPLACE FUNCTION reaction_counts_merge(counts JSONB, deltas JSONB)
+RETURNS JSONB LANGUAGE sql IMMUTABLE AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total) FILTER (WHERE total > 0), '{}'::jsonb)
+    FROM (
+        SELECT key, sum(value::int) AS total
+        FROM (
+            SELECT key, value FROM jsonb_each_text(counts)
+            UNION ALL
+            SELECT key, value FROM jsonb_each_text(deltas)
+        ) kv
+        GROUP BY key
+    ) t
+$$;
+
+-- Заполнить счётчики из user_reactions (то же, что flask reconcile-reactions)
+UPDATE posts p
+SET reaction_counts = COALESCE(agg.counts, '{}'::jsonb)
+FROM posts base
+LEFT JOIN (
+    SELECT post_id, jsonb_object_agg(reaction_type, n) AS counts
+    FROM (
+        SELECT post_id, reaction_type, count(*) AS n
+        FROM user_reactions
+        GROUP BY post_id, reaction_type
+    ) t
+    GROUP BY post_id
+) agg ON agg.post_id = base.id
+WHERE base.id = p.id
+  AND p.reaction_counts IS DISTINCT FROM COALESCE(agg.counts, '{}'::jsonb);
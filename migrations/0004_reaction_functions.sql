@@ -0,0 +1,77 @@
+-- Переключение реакции за один вызов: поставить / снять / сменить + новые счётчики поста.
+-- Строка поста блокируется FOR UPDATE, поэтому параллельные клики по одному посту идут по очереди
+-- и счётчики всегда сходятся с user_reactions.
+CREATE OR REPLACE FUNCTION toggle_reaction(p_post_id INTEGER, p_user_id TEXT, p_type TEXT)
+RETURNS TABLE (counts JSONB, my_reaction TEXT, is_new BOOLEAN)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_current TEXT;
+    v_removed TEXT;
+    v_added TEXT;
+BEGIN
+    PERFORM 1 FROM posts WHERE id = p_post_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    SELECT ur.reaction_type INTO v_current
+    FROM user_reactions ur
+    WHERE ur.post_id = p_post_id AND ur.user_id = p_user_id;
+    IF v_current = p_type THEN
+        DELETE FROM user_reactions WHERE post_id = p_post_id AND user_id = p_user_id;
+        v_removed := p_type;
+    ELSIF v_current IS NOT NULL THEN
+        UPDATE user_reactions SET reaction_type = p_type WHERE post_id = p_post_id AND user_id = p_user_id;
+        v_removed := v_current;
+        v_added := p_type;
+    ELSE
+        INSERT INTO user_reactions (post_id, user_id, reaction_type) VALUES (p_post_id, p_user_id, p_type);
+        v_added := p_type;
+    END IF;
+    RETURN QUERY
+    UPDATE posts
+    SET reaction_counts = reaction_counts_add(reaction_counts_add(posts.reaction_counts, v_removed, -1), v_added, 1)
+    WHERE id = p_post_id
+    RETURNING posts.reaction_counts, v_added, v_added IS NOT NULL;
+END
+$$;
+
+-- Режим write-behind: только user_reactions (блокируется строка пользователя, а не поста).
+-- Возвращает, какую реакцию сняли/поставили, и текущие счётчики поста из БД.
+-- Если тот же пользователь параллельно вставил реакцию (ON CONFLICT), цикл перечитывает её под блокировкой.
+CREATE OR REPLACE FUNCTION record_reaction(p_post_id INTEGER, p_user_id TEXT, p_type TEXT)
+RETURNS TABLE (removed TEXT, added TEXT, counts JSONB)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_current TEXT;
+BEGIN
+    SELECT p.reaction_counts INTO counts FROM posts p WHERE p.id = p_post_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    LOOP
+        SELECT ur.reaction_type INTO v_current
+        FROM user_reactions ur
+        WHERE ur.post_id = p_post_id AND ur.user_id = p_user_id
+        FOR UPDATE;
+        IF FOUND THEN
+            IF v_current = p_type THEN
+                DELETE FROM user_reactions WHERE post_id = p_post_id AND user_id = p_user_id;
+                removed := p_type;
+            ELSE
+                UPDATE user_reactions SET reaction_type = p_type WHERE post_id = p_post_id AND user_id = p_user_id;
+                removed := v_current;
+                added := p_type;
+            END IF;
+            EXIT;
+        END IF;
+        INSERT INTO user_reactions (post_id, user_id, reaction_type)
+        VALUES (p_post_id, p_user_id, p_type)
+        ON CONFLICT DO NOTHING;
+        IF FOUND THEN
+            added := p_type;
+            EXIT;
+        END IF;
+    END LOOP;
+    RETURN NEXT;
+END
+$$;
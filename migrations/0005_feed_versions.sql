@@ -0,0 +1,4 @@
+-- Версии ленты и информации о канале для ETag: растут при каждом изменении.
+-- Последовательности не блокируют строк и не откатываются, поэтому их сдвиг почти бесплатен.
+CREATE SEQUENCE IF NOT EXISTS feed_version_seq;
+CREATE SEQUENCE IF NOT EXISTS channel_version_seq;
@@ -0,0 +1,3 @@
+-- Уменьшенные копии фото для srcset: [{"w": 320, "webp": "..._w320.webp", "jpeg": "..._w320.jpg"}, ...].
+-- NULL — копий ещё нет (видео, Cloudinary или старый пост до flask media-variants).
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS media_variants JSONB;
@@ -0,0 +1,9 @@
+-- Метаданные медиа для ленты: размеры (резерв места в Masonry), длительность видео,
+-- крошечная заглушка data:image/webp и постер видео (имя файла в uploads/).
+-- NULL — неизвестно (старый пост до flask media-meta или Cloudinary).
+ALTER TABLE posts
+    ADD COLUMN IF NOT EXISTS media_width INTEGER,
+    ADD COLUMN IF NOT EXISTS media_height INTEGER,
+    ADD COLUMN IF NOT EXISTS media_duration REAL,
+    ADD COLUMN IF NOT EXISTS media_placeholder TEXT,
+    ADD COLUMN IF NOT EXISTS media_poster TEXT;
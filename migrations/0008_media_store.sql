@@ -0,0 +1,48 @@
+-- Хранилище медиа по содержимому: один файл в uploads/ на одинаковые байты, сколько бы постов на него ни ссылалось.
+-- refcount — число постов с этим media_path; ведётся триггером на posts, файл удаляется, когда счётчик дошёл до нуля.
+CREATE TABLE IF NOT EXISTS media_objects (
+    media_path TEXT PRIMARY KEY,
+    sha256 TEXT,
+    size BIGINT,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс Telegram file_unique_id -> файл: уже известное медиа бот не скачивает повторно
+CREATE TABLE IF NOT EXISTS telegram_media (
+    file_unique_id TEXT PRIMARY KEY,
+    media_path TEXT NOT NULL REFERENCES media_objects (media_path) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS telegram_media_media_path_idx ON telegram_media (media_path);
+
+-- Ссылки из posts на локальные файлы (Cloudinary-URL в хранилище не участвуют)
+CREATE OR REPLACE FUNCTION posts_media_refcount()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.media_path IS NOT DISTINCT FROM NEW.media_path THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.media_path IS NOT NULL AND OLD.media_path NOT LIKE 'http%' THEN
+        UPDATE media_objects SET refcount = refcount - 1 WHERE media_path = OLD.media_path;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.media_path IS NOT NULL AND NEW.media_path NOT LIKE 'http%' THEN
+        INSERT INTO media_objects (media_path, refcount) VALUES (NEW.media_path, 1)
+        ON CONFLICT (media_path) DO UPDATE SET refcount = media_objects.refcount + 1;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS posts_media_refcount ON posts;
+CREATE TRIGGER posts_media_refcount
+    AFTER INSERT OR DELETE OR UPDATE OF media_path ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_media_refcount();
+
+-- Уже существующие файлы: счётчики по текущим постам (хеш для старых имён неизвестен)
+INSERT INTO media_objects (media_path, refcount)
+SELECT media_path, count(*)
+FROM posts
+WHERE media_path IS NOT NULL AND media_path NOT LIKE 'http%'
+GROUP BY media_path
+ON CONFLICT (media_path) DO UPDATE SET refcount = EXCLUDED.refcount;
@@ -0,0 +1,3 @@
+-- Когда аватарка пользователя последний раз проверялась в Telegram (успешно или «фото нет»).
+-- Повторный вход в пределах AVATAR_TTL не запускает загрузку; NULL — ещё не проверялась.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS photo_fetched_at TIMESTAMP;
@@ -0,0 +1,12 @@
+-- Чистка токенов входа: по created_at (LOGIN_TOKEN_MODE=table) и кеш использованных nonce
+-- подписанных токенов (LOGIN_TOKEN_MODE=signed). UNLOGGED: записи живут минуты, WAL для них не нужен.
+CREATE INDEX IF NOT EXISTS login_tokens_created_at_idx ON login_tokens (created_at);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS login_token_nonces (
+    nonce TEXT PRIMARY KEY,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS login_token_nonces_expires_idx ON login_token_nonces (expires_at);
+
+-- Неиспользованные токены раньше не удалялись никогда; старше суток — точно просрочены
+DELETE FROM login_tokens WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '1 day';
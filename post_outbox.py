@@ -0,0 +1,244 @@
+"""
+Надёжная очередь отправки постов бота во Flask API (outbox).
+
+Раньше пост, пришедший, пока API недоступен, терялся: send_to_api печатал ошибку, а файл оставался
+в uploads/ без строки в posts. Теперь каждый пост сначала записывается в локальный SQLite-файл (WAL,
+synchronous=FULL — запись переживает падение процесса), а фоновая задача доставляет записи пачками
+через POST /api/posts/batch, по порядку поступления. Неудачная пачка повторяется с экспоненциальной
+паузой; после восстановления API накопившиеся посты уходят подряд, без пауз. Повторная доставка
+безопасна: API пропускает уже существующие telegram_id. После перезапуска бот дочищает очередь.
+
+Состояние очереди:
+    python post_outbox.py status [--path outbox.db]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+# Доставленные записи хранятся сутки (для status и разбора проблем), потом удаляются
+DELIVERED_RETENTION = 24 * 3600
+
+
+# Ответы API, после которых пост не примут и при повторе (тело запроса некорректно или слишком велико).
+# Остальные 4xx — временные: 401/403 от прокси или авторизации перед API, 404 от прокси во время деплоя, 408, 429
+REJECTED_STATUSES = frozenset({400, 413, 422})
+
+
+class OutboxRejected(Exception):
+    """API отверг пачку как некорректную (REJECTED_STATUSES): повторять её бессмысленно."""
+
+
+class PostOutbox:
+    """
+    path — файл SQLite; deliver(payloads) — корутина, отправляет список постов, возвращает True при успехе,
+    False или любое другое исключение — временная ошибка (повторить позже), OutboxRejected — посты некорректны;
+    batch_max — постов в одной отправке; batch_window — сколько секунд ждать попутчиков после нового поста;
+    base_delay / max_delay — пауза перед повтором, сек.
+    """
+
+    def __init__(self, path, deliver, batch_max=50, batch_window=0.2, base_delay=1.0, max_delay=60.0):
+        self.path = path
+        self.deliver = deliver
+        self.batch_max = max(1, batch_max)
+        self.batch_window = batch_window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._wake = None
+        self._task = None
+        self._isolate_until = 0  # записи до этого id отправляются по одной (ищем отвергнутый пост)
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            cur = self._db.execute(sql, params)
+            rows = cur.fetchall() if fetch else cur.rowcount
+            self._db.commit()
+            return rows
+
+    async def add(self, post):
+        """Записать пост в очередь (на диск) и разбудить доставку. post — поля POST /api/posts."""
+        await asyncio.to_thread(
+            self._execute,
+            """
+            INSERT INTO outbox (telegram_id, payload, created_at, next_attempt) VALUES (?, ?, ?, 0)
+            ON CONFLICT (telegram_id) DO UPDATE SET payload = excluded.payload
+            WHERE delivered_at IS NULL AND dead = 0
+            """,
+            (post['telegram_id'], json.dumps(post, ensure_ascii=False), time.time()),
+        )
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить доставку; недоставленное остаётся в файле и уйдёт после перезапуска."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        """Сколько записей ждут доставки и сколько отвергнуто API: {"pending", "dead"}."""
+        rows = self._execute(
+            'SELECT (SELECT count(*) FROM outbox WHERE delivered_at IS NULL AND dead = 0), '
+            '(SELECT count(*) FROM outbox WHERE dead = 1)',
+            fetch=True,
+        )
+        return {'pending': rows[0][0], 'dead': rows[0][1]}
+
+    def backoff(self, attempts):
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _run(self):
+        await asyncio.to_thread(
+            self._execute, 'DELETE FROM outbox WHERE delivered_at < ?', (time.time() - DELIVERED_RETENTION,)
+        )
+        while True:
+            # Самые старые недоставленные записи — строго по порядку поступления
+            rows = await asyncio.to_thread(
+                self._execute,
+                'SELECT id, payload, attempts, next_attempt FROM outbox '
+                'WHERE delivered_at IS NULL AND dead = 0 ORDER BY id LIMIT ?',
+                (self.batch_max,),
+                True,
+            )
+            if rows and rows[0][0] <= self._isolate_until:
+                rows = rows[:1]
+            if not rows:
+                self._wake.clear()
+                await self._wake.wait()
+                # Посты альбома приходят почти одновременно — отправим их одной пачкой
+                await asyncio.sleep(self.batch_window)
+                continue
+            wait = rows[0][3] - time.time()
+            if wait > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._deliver(rows)
+
+    async def _deliver(self, rows):
+        ids = [row[0] for row in rows]
+        marks = ','.join('?' * len(ids))
+        try:
+            ok = await self.deliver([json.loads(row[1]) for row in rows])
+            error = None if ok else 'API недоступен'
+        except OutboxRejected as e:
+            if len(rows) > 1:
+                # Какой из постов плохой, неизвестно: эту пачку дальше отправляем по одному
+                self._isolate_until = ids[-1]
+                return
+            await asyncio.to_thread(
+                self._execute, f'UPDATE outbox SET dead = 1, last_error = ? WHERE id IN ({marks})', (str(e), *ids)
+            )
+            print(f"❌ Пост {json.loads(rows[0][1]).get('telegram_id')} отвергнут API ({e}), убран из очереди")
+            return
+        except Exception as e:
+            ok, error = False, str(e)
+        if ok:
+            await asyncio.to_thread(
+                self._execute, f'UPDATE outbox SET delivered_at = ? WHERE id IN ({marks})', (time.time(), *ids)
+            )
+            return
+        attempts = max(row[2] for row in rows) + 1
+        delay = self.backoff(attempts)
+        await asyncio.to_thread(
+            self._execute,
+            f'UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id IN ({marks})',
+            (attempts, time.time() + delay, error, *ids),
+        )
+        print(f"Доставка постов не удалась ({error}), попытка {attempts}, повтор через {delay:.1f} с")
+
+
+def connect(path):
+    """Открыть (и при необходимости создать) файл очереди."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=FULL')
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL UNIQUE,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            delivered_at REAL,
+            dead INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    db.execute('CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (id) WHERE delivered_at IS NULL AND dead = 0')
+    db.commit()
+    return db
+
+
+def status(path):
+    """Сводка по очереди: {"pending", "oldest_age", "max_attempts", "last_error", "dead", "delivered_last_hour"}."""
+    db = connect(path)
+    try:
+        now = time.time()
+        pending, oldest, max_attempts = db.execute(
+            'SELECT count(*), min(created_at), max(attempts) FROM outbox WHERE delivered_at IS NULL AND dead = 0'
+        ).fetchone()
+        last_error = db.execute(
+            'SELECT last_error FROM outbox WHERE delivered_at IS NULL AND dead = 0 AND last_error IS NOT NULL '
+            'ORDER BY id DESC LIMIT 1'
+        ).fetchone()
+        dead = db.execute('SELECT count(*) FROM outbox WHERE dead = 1').fetchone()[0]
+        delivered = db.execute('SELECT count(*) FROM outbox WHERE delivered_at >= ?', (now - 3600,)).fetchone()[0]
+    finally:
+        db.close()
+    return {
+        'pending': pending,
+        'oldest_age': round(now - oldest, 1) if oldest else 0.0,
+        'max_attempts': max_attempts or 0,
+        'last_error': last_error[0] if last_error else None,
+        'dead': dead,
+        'delivered_last_hour': delivered,
+    }
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Очередь отправки постов бота в API.')
+    parser.add_argument('command', choices=['status'])
+    parser.add_argument('--path', default=os.environ.get('OUTBOX_PATH', 'outbox.db'))
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        print(f"Файла очереди {args.path} нет — бот ещё ничего не отправлял")
+        return 0
+    info = status(args.path)
+    print(f"Ожидают отправки: {info['pending']}, самому старому {info['oldest_age']:.0f} с, "
+          f"попыток: {info['max_attempts']}")
+    if info['last_error']:
+        print(f"Последняя ошибка: {info['last_error']}")
+    print(f"Доставлено за час: {info['delivered_last_hour']}, отвергнуто API: {info['dead']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
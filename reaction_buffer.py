@@ -0,0 +1,141 @@
+"""
+Отложенная запись счётчиков реакций (write-behind).
+
+Сам факт реакции сразу и надёжно пишется в user_reactions, а изменения счётчиков
+постов копятся в памяти процесса и сбрасываются в posts.reaction_counts пачками:
+раз в interval_ms или как только накопилось max_events событий.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class ReactionBuffer:
+    """
+    Буфер дельт {post_id: {reaction_type: delta}} с фоновым сбросом.
+
+    flush_fn(batch) получает {post_id: {reaction_type: delta}} и должна записать всё
+    одной транзакцией; если она бросила исключение, дельты возвращаются в буфер
+    и уйдут со следующим сбросом. Поэтому исключение допустимо только до commit:
+    всё, что flush_fn делает после него, не должно бросать.
+    """
+
+    def __init__(self, flush_fn, interval_ms=200, max_events=500):
+        self.flush_fn = flush_fn
+        self.interval = interval_ms / 1000.0
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._events = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {'events': 0, 'flushes': 0, 'flushed_posts': 0, 'flush_errors': 0, 'last_flush_ms': 0.0}
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # Поток создаётся лениво и заново в каждом процессе (после fork потоки не наследуются)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._pending.clear()  # чужие (родительские) дельты сбросит родитель
+                self._events = 0
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='reaction-buffer', daemon=True)
+            self._thread.start()
+
+    def add(self, post_id, removed=None, added=None):
+        """Учесть клик: у removed -1, у added +1."""
+        self._ensure_started()
+        with self._lock:
+            counts = self._pending[post_id]
+            if removed:
+                counts[removed] -= 1
+            if added:
+                counts[added] += 1
+            self._events += 1
+            self._stats['events'] += 1
+            full = self._events >= self.max_events
+        if full:
+            self._wake.set()
+
+    def merged(self, post_id, stored):
+        """Счётчики поста из БД плюс ещё не сброшенные дельты этого процесса."""
+        with self._lock:
+            pending = dict(self._pending.get(post_id) or {})
+        if not pending:
+            return dict(stored or {})
+        result = dict(stored or {})
+        for reaction_type, delta in pending.items():
+            value = result.get(reaction_type, 0) + delta
+            if value > 0:
+                result[reaction_type] = value
+            else:
+                result.pop(reaction_type, None)
+        return result
+
+    def flush(self):
+        """Сбросить накопленные дельты. Возвращает число затронутых постов."""
+        with self._flush_lock:
+            with self._lock:
+                batch = {
+                    post_id: {t: d for t, d in counts.items() if d}
+                    for post_id, counts in self._pending.items()
+                }
+                batch = {post_id: counts for post_id, counts in batch.items() if counts}
+                self._pending.clear()
+                self._events = 0
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                self.flush_fn(batch)
+            except Exception:
+                with self._lock:
+                    self._stats['flush_errors'] += 1
+                    for post_id, counts in batch.items():
+                        for reaction_type, delta in counts.items():
+                            self._pending[post_id][reaction_type] += delta
+                raise
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['flushed_posts'] += len(batch)
+                self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка сброса счётчиков реакций (повторим): {e}")
+
+    def stop(self):
+        """Остановить фоновый поток и сбросить остаток (вызывается и при завершении процесса)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._pid == os.getpid() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        if self._pid == os.getpid():
+            try:
+                self.flush()
+            except Exception as e:
+                # Факты реакций уже в user_reactions — счётчики восстановит reconcile-reactions
+                print(f"Не удалось сбросить счётчики реакций при остановке: {e}")
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['pending_posts'] = len(self._pending)
+            data['pending_events'] = self._events
+        return data
@@ -0,0 +1,160 @@
+"""
+Профилирование отдельных запросов по требованию (включается администратором, см. app.py).
+
+Два режима:
+- sample — поток-семплер раз в interval секунд снимает стек потока запроса (sys._current_frames)
+  и копит свёрнутые стеки «внешний;...;внутренний N» — формат flamegraph.pl / speedscope;
+- cprofile — детерминированный cProfile, результат — файл pstats (.prof: snakeviz, python -m pstats).
+
+ProfileStore хранит профили в папке как кольцевой буфер: после каждой записи удаляются самые старые
+сверх keep. Рядом с каждым профилем — <имя>.json с описанием запроса (маршрут, статус, время).
+"""
+import cProfile
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+MODES = ('sample', 'cprofile')
+EXTENSIONS = {'sample': '.txt', 'cprofile': '.prof'}
+_NAME = re.compile(r'^\d{8}T\d{6}_\d{6}_[0-9a-f]{6}$')
+
+
+class StackSampler(threading.Thread):
+    """Семплирующий профайлер одного потока: start() ... stop(), затем collapsed()."""
+
+    def __init__(self, thread_id, interval=0.001, max_seconds=60):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # Ограничение по времени — для потоковых ответов (SSE), где запрос может длиться часами
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, 'co_qualname', code.co_name)  # Flask.wsgi_app, а не просто wsgi_app (3.11+)
+                stack.append(f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """Профиль одного запроса: start() и finish() вызываются в потоке запроса."""
+
+    def __init__(self, mode, interval=0.001, max_seconds=60):
+        self.mode = mode
+        self._interval = interval
+        self._max_seconds = max_seconds
+        self._profiler = None
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+                return
+            except ValueError:
+                # Python 3.12+: cProfile один на процесс — если уже профилируется другой запрос, семплируем
+                self.mode = 'sample'
+        self._profiler = StackSampler(threading.get_ident(), self._interval, self._max_seconds)
+        self._profiler.start()
+
+    def finish(self):
+        """Остановить профайлер: (функция записи в файл, число семплов или None, секунды)."""
+        seconds = time.perf_counter() - self.started
+        profiler = self._profiler
+        if self.mode == 'cprofile':
+            profiler.disable()
+            return profiler.dump_stats, None, seconds
+        profiler.stop()
+        text = profiler.collapsed()
+
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return write, profiler.samples, seconds
+
+
+class ProfileStore:
+    """Папка с последними keep профилями. Процессы gunicorn пишут в неё независимо — имена не пересекаются."""
+
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = keep
+
+    def new_name(self):
+        now = datetime.now(timezone.utc)
+        return now.strftime('%Y%m%dT%H%M%S_%f_') + secrets.token_hex(3)
+
+    def save(self, name, mode, write, meta):
+        """Записать профиль (write(path)) и описание meta; удалить старые сверх keep."""
+        os.makedirs(self.directory, exist_ok=True)
+        filename = name + EXTENSIONS[mode]
+        path = os.path.join(self.directory, filename)
+        write(path + '.part')
+        os.replace(path + '.part', path)
+        meta = {'name': name, 'mode': mode, 'file': filename, 'size': os.path.getsize(path), **meta}
+        with open(os.path.join(self.directory, name + '.json.part'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(os.path.join(self.directory, name + '.json.part'), os.path.join(self.directory, name + '.json'))
+        self._prune()
+        return meta
+
+    def _names(self):
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(f[:-5] for f in files if f.endswith('.json') and _NAME.match(f[:-5]))
+
+    def _prune(self):
+        for name in self._names()[:-self.keep]:
+            for ext in ('.json', *EXTENSIONS.values()):
+                try:
+                    os.remove(os.path.join(self.directory, name + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Описания профилей, новые первыми."""
+        result = []
+        for name in reversed(self._names()):
+            try:
+                with open(os.path.join(self.directory, name + '.json'), encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # удалён другим процессом между listdir и open
+        return result
+
+    def path(self, filename):
+        """Путь к файлу профиля по имени из list() или None (имя проверяется — никаких ../)."""
+        name, ext = os.path.splitext(filename)
+        if not _NAME.match(name) or ext not in EXTENSIONS.values():
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
@@ -0,0 +1,334 @@
+"""
+Бенчмарк горячих путей API на данных scripts/bench_seed.py.
+
+Сценарии (каждый --duration секунд в --threads потоках, запросы идут через test_client без сети):
+    feed_anon      — анонимный опрос ленты: открытые вкладки перепроверяют страницу по If-None-Match,
+                     новые посетители получают её целиком, часть опросов листает дальше по курсору;
+    feed_user      — то же под пользователем бенчмарка (личная часть my_reactions);
+    reaction_storm — все потоки кликают реакции на самом популярном посте;
+    media          — скачивание медиафайлов целиком и с середины (Range).
+
+По каждому эндпоинту: число запросов, статусы, p50/p95/p99 и среднее время, запросов в секунду,
+запросов к БД на один HTTP-запрос и средний размер ответа (как передан: сжатый, если клиент прислал
+--accept-encoding; по умолчанию — как браузер). Время сериализации JSON и сжатия отдельно —
+scripts/bench_json.py. Результат пишется в JSON (--output),
+который можно сравнить с прошлым прогоном (--compare), например до и после коммита:
+
+    python scripts/bench_seed.py --posts 10000 --users 2000 --reactions 100000
+    python scripts/bench_api.py --output bench_before.json
+    git checkout <коммит> && python scripts/bench_api.py --output bench_after.json --compare bench_before.json
+    python scripts/bench_api.py --compare bench_before.json bench_after.json   # только сравнить файлы
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_seed import BENCH_ID_BASE, REACTION_TYPES, bench_user_id, zipf_cum_weights  # noqa: E402
+from db_trace import add_observer  # noqa: E402
+
+SCENARIOS = ('feed_anon', 'feed_user', 'reaction_storm', 'media')
+# Метрики для сравнения прогонов: (ключ, подпись, больше — лучше)
+COMPARED = (('p50_ms', 'p50', False), ('p95_ms', 'p95', False), ('p99_ms', 'p99', False),
+            ('rps', 'req/s', True), ('queries', 'SQL/req', False), ('bytes', 'bytes', False))
+NOISE_PERCENT = 10  # изменения меньше этого — шум между прогонами, не отмечаются
+
+_local = threading.local()
+
+
+def count_query(cursor, sql, params, seconds):
+    """Наблюдатель db_trace: запросы к БД в счётчик текущего потока."""
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0..100) по отсортированному списку (ближайший ранг)."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Замеры одного сценария по эндпоинтам (потокобезопасно)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # эндпоинт -> [(сек, статус, SQL-запросов, байт)]
+
+    def request(self, client, endpoint, method, url, **kwargs):
+        _local.queries = 0
+        started = time.perf_counter()
+        resp = client.open(url, method=method, **kwargs)
+        size = len(resp.get_data())  # тело читается внутри замера: потоковые ответы так и отдаются
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples[endpoint].append((elapsed, resp.status_code, _local.queries, size))
+        return resp
+
+    def summary(self, duration):
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            times = sorted(s[0] for s in samples)
+            result[endpoint] = {
+                'requests': len(samples),
+                'statuses': {str(k): v for k, v in sorted(Counter(s[1] for s in samples).items())},
+                'p50_ms': round(percentile(times, 50) * 1000, 3),
+                'p95_ms': round(percentile(times, 95) * 1000, 3),
+                'p99_ms': round(percentile(times, 99) * 1000, 3),
+                'mean_ms': round(sum(times) / len(times) * 1000, 3),
+                'rps': round(len(samples) / duration, 1),
+                'queries': round(sum(s[2] for s in samples) / len(samples), 2),
+                'queries_max': max(s[2] for s in samples),
+                'bytes': round(sum(s[3] for s in samples) / len(samples)),
+            }
+        return result
+
+
+def load_dataset(app_module):
+    """Что создал bench_seed.py: число пользователей, самый популярный пост, медиафайлы."""
+    with app_module.get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT count(*) FROM users WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        users = c.fetchone()[0]
+        c.execute(
+            """
+            SELECT p.id, count(r.user_id) AS n
+            FROM posts p LEFT JOIN user_reactions r ON r.post_id = p.id
+            WHERE p.telegram_id <= %s
+            GROUP BY p.id ORDER BY n DESC, p.id LIMIT 1
+            """,
+            (BENCH_ID_BASE,),
+        )
+        hot = c.fetchone()
+        c.execute('SELECT count(*) FROM posts WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        posts = c.fetchone()[0]
+        c.execute('SELECT count(*) FROM user_reactions r JOIN posts p ON p.id = r.post_id WHERE p.telegram_id <= %s',
+                  (BENCH_ID_BASE,))
+        reactions = c.fetchone()[0]
+        c.execute('SELECT DISTINCT media_path FROM posts WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        media = sorted(row[0] for row in c.fetchall())
+    if not posts or not users or hot is None:
+        sys.exit('Нет данных бенчмарка — сначала запустите scripts/bench_seed.py')
+    return {'posts': posts, 'users': users, 'reactions': reactions, 'hot_post': hot[0], 'media': media}
+
+
+def logged_in_client(app_module, user):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = {'telegram_id': int(bench_user_id(user)[3:])}
+    return client
+
+
+def response_json(resp):
+    """Тело ответа как JSON; test_client не распаковывает Content-Encoding сам."""
+    data = resp.get_data()
+    encoding = resp.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        data = gzip.decompress(data)
+    elif encoding == 'br':
+        import brotli
+        data = brotli.decompress(data)
+    return json.loads(data)
+
+
+def feed_worker(recorder, client, rng, stop, page_size, deep_share, revalidate_share, accept_encoding):
+    """
+    Опрос ленты: с вероятностью revalidate_share — как открытая вкладка (ETag прошлого ответа в If-None-Match),
+    иначе — как новый посетитель; с вероятностью deep_share — листание на следующую страницу.
+    """
+    etags = {}
+    cursors = {}  # курсор следующей страницы из последнего ответа 200 (на 304 тела нет)
+    while not stop.is_set():
+        url = f'/api/posts?limit={page_size}'
+        endpoint = 'GET /api/posts'
+        for _ in range(4):
+            revalidate = url in etags and rng.random() < revalidate_share
+            headers = {'If-None-Match': etags[url]} if revalidate else {}
+            if accept_encoding:
+                headers['Accept-Encoding'] = accept_encoding
+            resp = recorder.request(client, endpoint, 'GET', url, headers=headers)
+            if resp.status_code == 200:
+                etags[url] = resp.headers.get('ETag')
+                cursors[url] = response_json(resp)['next_cursor']
+            if not cursors.get(url) or rng.random() >= deep_share:
+                break
+            url = f'/api/posts?limit={page_size}&before={cursors[url]}'
+            endpoint = 'GET /api/posts?before'
+
+
+def storm_worker(recorder, clients, post_id, rng, stop):
+    while not stop.is_set():
+        client = rng.choice(clients)
+        recorder.request(client, 'POST /api/posts/<id>/reactions', 'POST', f'/api/posts/{post_id}/reactions',
+                         json={'reaction_type': rng.choice(REACTION_TYPES)})
+
+
+def media_worker(recorder, client, media, size, rng, stop):
+    while not stop.is_set():
+        url = f'/uploads/{rng.choice(media)}'
+        if rng.random() < 0.3:
+            start = rng.randrange(size // 2)
+            recorder.request(client, 'GET /uploads (Range)', 'GET', url, headers={'Range': f'bytes={start}-'})
+        else:
+            recorder.request(client, 'GET /uploads', 'GET', url)
+
+
+def run_scenario(app_module, name, dataset, args):
+    recorder = Recorder()
+    stop = threading.Event()
+    rng = random.Random(f'{args.seed}-{name}')
+    user_weights = zipf_cum_weights(dataset['users'], args.zipf_s)
+    threads = []
+    for i in range(args.threads):
+        worker_rng = random.Random(rng.random())
+        if name == 'feed_anon':
+            target = feed_worker
+            worker_args = (recorder, app_module.app.test_client(), worker_rng, stop, args.page_size, args.deep_share,
+                           args.revalidate_share, args.accept_encoding)
+        elif name == 'feed_user':
+            user = worker_rng.choices(range(dataset['users']), cum_weights=user_weights)[0]
+            target = feed_worker
+            worker_args = (recorder, logged_in_client(app_module, user), worker_rng, stop, args.page_size,
+                           args.deep_share, args.revalidate_share, args.accept_encoding)
+        elif name == 'reaction_storm':
+            users = worker_rng.sample(range(dataset['users']), min(dataset['users'], 20))
+            target = storm_worker
+            worker_args = (recorder, [logged_in_client(app_module, u) for u in users], dataset['hot_post'],
+                           worker_rng, stop)
+        else:
+            size = os.path.getsize(os.path.join(app_module.UPLOAD_FOLDER, dataset['media'][0]))
+            target = media_worker
+            worker_args = (recorder, app_module.app.test_client(), dataset['media'], size, worker_rng, stop)
+        threads.append(threading.Thread(target=target, args=worker_args, daemon=True))
+
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    with recorder.lock:
+        recorder.samples.clear()  # прогрев: пул соединений, кеш ленты, страницы ОС
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - started
+    if name == 'reaction_storm':
+        app_module.reaction_buffer.flush()
+    return recorder.summary(duration)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    for scenario, endpoints in results['scenarios'].items():
+        print(f"\n{scenario}")
+        for endpoint, s in endpoints.items():
+            print(f"  {endpoint:34} {s['requests']:>7} запр. {s['rps']:>8.1f}/с  p50 {s['p50_ms']:>7.2f}  "
+                  f"p95 {s['p95_ms']:>7.2f}  p99 {s['p99_ms']:>7.2f} мс  SQL {s['queries']:.2f}  "
+                  f"{s['bytes']} Б  {s['statuses']}")
+
+
+def compare(old, new):
+    """Напечатать изменение метрик new относительно old по общим сценариям и эндпоинтам."""
+    print(f"\nСравнение: {old['meta'].get('git') or '?'} ({old['meta']['started_at']}) -> "
+          f"{new['meta'].get('git') or '?'} ({new['meta']['started_at']})")
+    for scenario, endpoints in new['scenarios'].items():
+        for endpoint, s in endpoints.items():
+            before = old['scenarios'].get(scenario, {}).get(endpoint)
+            if before is None:
+                continue
+            parts = []
+            for key, label, higher_is_better in COMPARED:
+                a, b = before[key], s[key]
+                change = (b - a) / a * 100 if a else 0.0
+                better = change > 0 if higher_is_better else change < 0
+                mark = '' if abs(change) < NOISE_PERCENT else (' ✅' if better else ' ❌')
+                parts.append(f"{label} {a:g}->{b:g} ({change:+.0f}%){mark}")
+            print(f"  {scenario}/{endpoint}: " + ', '.join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк API: лента, реакции, медиа. Данные — scripts/bench_seed.py.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='через запятую, из: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help='секунд на сценарий (без прогрева)')
+    parser.add_argument('--warmup', type=float, default=2, help='секунд прогрева перед замером')
+    parser.add_argument('--page-size', type=int, default=30)
+    parser.add_argument('--deep-share', type=float, default=0.3, help='доля опросов, листающих следующую страницу')
+    parser.add_argument('--revalidate-share', type=float, default=0.7,
+                        help='доля опросов ленты с If-None-Match (остальные — новые посетители)')
+    parser.add_argument('--accept-encoding', default='gzip, deflate, br',
+                        help='заголовок Accept-Encoding запросов ленты; пустая строка — без сжатия')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='активность пользователей в feed_user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='записать результат в JSON')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='сравнить с прошлым прогоном; с двумя файлами — только сравнить их')
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0], encoding='utf-8') as f_old, open(args.compare[1], encoding='utf-8') as f_new:
+            compare(json.load(f_old), json.load(f_new))
+        return
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    # Пул должен вмещать все потоки, иначе бенчмарк будет мерить очередь к пулу
+    os.environ.setdefault('DB_POOL_MAX', str(args.threads + 2))
+    import app as app_module
+
+    # Соединения пула — db_trace.TracedConnection: запросы считает его наблюдатель
+    add_observer(count_query)
+    dataset = load_dataset(app_module)
+    results = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'threads': args.threads,
+            'duration': args.duration,
+            'page_size': args.page_size,
+            'revalidate_share': args.revalidate_share,
+            'deep_share': args.deep_share,
+            'accept_encoding': args.accept_encoding,
+            'reactions_write_behind': app_module.REACTIONS_WRITE_BEHIND,
+            'dataset': {k: v for k, v in dataset.items() if k != 'media'},
+        },
+        'scenarios': {},
+    }
+    for name in scenarios:
+        print(f"Сценарий {name}: {args.threads} потоков, {args.duration:g} с...")
+        results['scenarios'][name] = run_scenario(app_module, name, dataset, args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nРезультат записан в {args.output}")
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
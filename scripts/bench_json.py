@@ -0,0 +1,127 @@
+"""
+Бенчмарк сериализации и сжатия ленты на данных scripts/bench_seed.py (без HTTP и без БД в замере).
+
+Страницы ленты берутся так же, как их строит GET /api/posts (через кеш ленты приложения), затем
+для каждой страницы замеряется медианное время:
+    dumps flask    — прежний путь: app.json.dumps Flask (stdlib json, даты через http_date) + encode;
+    dumps stdlib   — json_codec на стандартном json;
+    dumps orjson   — json_codec на orjson (если установлен);
+    gzip full      — gzip всего тела на каждый запрос (так сжимал бы ответ общий обработчик);
+    gzip tail      — досжатие личного хвоста my_reactions к сжатому один раз префиксу (GzipPrefix);
+    br full        — brotli всего тела (если установлен пакет brotli).
+
+    python scripts/bench_json.py --pages 20 --page-size 30 --output bench_json.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_api import git_revision  # noqa: E402
+
+
+def timed(fn, repeat):
+    """Медиана времени одного вызова fn(), мкс."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1e6
+
+
+def load_pages(app_module, count, page_size):
+    """Первые count страниц ленты: [(posts, next_cursor)] — ровно то, что сериализует get_posts."""
+    client = app_module.app.test_client()
+    keys = []
+    before = None
+    for _ in range(count):
+        url = f'/api/posts?limit={page_size}' + (f'&before={before}' if before else '')
+        resp = client.get(url)
+        if resp.status_code != 200:
+            sys.exit(f'{url}: {resp.status_code}')
+        keys.append((page_size, before))
+        before = resp.get_json()['next_cursor']
+        if not before:
+            break
+    with app_module.get_db() as conn:
+        version = app_module.current_version(conn.cursor())
+    pages = [app_module.feed_cache.get(key, version) for key in keys]
+    if any(page is None for page in pages):
+        sys.exit('Лента изменилась во время загрузки страниц — запустите ещё раз')
+    return [(page.posts, page.next_cursor) for page in pages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк сериализации JSON и сжатия страниц ленты.')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=200, help='замеров каждой операции на страницу')
+    parser.add_argument('--reactions', type=int, default=10, help='личных реакций в хвосте для gzip tail')
+    parser.add_argument('--output', help='записать результат в JSON')
+    args = parser.parse_args()
+
+    os.environ['FEED_CACHE_PAGES'] = str(max(args.pages, 64))
+    import app as app_module
+    from compression import GzipPrefix, brotli, brotli_compress, gzip_compress
+    from json_codec import JSONCodec, orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    pages = load_pages(app_module, args.pages, args.page_size)
+    level, quality = app_module.COMPRESS_LEVEL or 6, app_module.COMPRESS_BROTLI_QUALITY
+    flask_json = DefaultJSONProvider(app_module.app)
+    encoders = {'flask': lambda obj: flask_json.dumps(obj).encode(), 'stdlib': JSONCodec('stdlib').dumps}
+    if orjson is not None:
+        encoders['orjson'] = JSONCodec('orjson').dumps
+    dumps = encoders.get('orjson', encoders['stdlib'])
+
+    totals = {}
+    sizes = {'raw': 0, 'gzip': 0, 'br': 0}
+    for posts, next_cursor in pages:
+        obj = {'posts': posts, 'next_cursor': next_cursor}
+        for name, encode in encoders.items():
+            totals.setdefault(f'dumps {name}', []).append(timed(lambda: encode(obj), args.repeat))
+        body = dumps(obj)
+        head = body[:-1] + b',"my_reactions":'
+        tail = dumps({post['id']: 'like' for post in posts[:args.reactions]}) + b'}'
+        prefix = GzipPrefix(head, level)
+        totals.setdefault('gzip full', []).append(timed(lambda: gzip_compress(head + tail, level), args.repeat))
+        totals.setdefault('gzip tail', []).append(timed(lambda: prefix.finish(tail), args.repeat))
+        sizes['raw'] += len(head + tail)
+        sizes['gzip'] += len(prefix.finish(tail))
+        if brotli is not None:
+            totals.setdefault('br full', []).append(
+                timed(lambda: brotli_compress(head + tail, quality), args.repeat))
+            sizes['br'] += len(brotli_compress(head + tail, quality))
+
+    results = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'pages': len(pages),
+            'page_size': args.page_size,
+            'gzip_level': level,
+            'brotli_quality': quality if brotli is not None else None,
+        },
+        'us_per_page': {name: round(statistics.mean(values), 1) for name, values in totals.items()},
+        'bytes_per_page': {name: round(total / len(pages)) for name, total in sizes.items() if total},
+    }
+    print(f"{len(pages)} страниц по {args.page_size} постов, медиана из {args.repeat} замеров:")
+    for name, us in results['us_per_page'].items():
+        print(f"  {name:14} {us:>9.1f} мкс")
+    print('  размер: ' + ', '.join(f'{k} {v} Б' for k, v in results['bytes_per_page'].items()))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"Результат записан в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
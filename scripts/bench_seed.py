@@ -0,0 +1,174 @@
+"""
+Тестовые данные для бенчмарка API (scripts/bench_api.py): N постов, M пользователей и K реакций.
+
+Популярность постов и активность пользователей распределены по Ципфу (--zipf-s): несколько постов
+собирают большую часть реакций, как в настоящем канале, поэтому в ленте есть и «горячие», и пустые посты.
+Посты получают отрицательные telegram_id ниже BENCH_ID_BASE и подпись «bench …» — с настоящими данными
+они не пересекаются, --reset удаляет только их. Медиа — несколько сгенерированных файлов в uploads/
+под именами по содержимому.
+
+Запускать только на тестовой базе:
+    DATABASE_URL=postgresql://localhost/postshet_test python scripts/bench_seed.py --posts 10000 --users 2000 --reactions 100000
+    DATABASE_URL=postgresql://localhost/postshet_test python scripts/bench_seed.py --reset
+"""
+import argparse
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_ID_BASE = -(10 ** 15)  # telegram_id постов и пользователей бенчмарка: BENCH_ID_BASE - i
+REACTION_TYPES = ['like', 'heart', 'laughing', 'fire', 'surprised']
+REACTION_WEIGHTS = [40, 25, 20, 10, 5]
+
+
+def bench_user_id(i):
+    """user_id в user_reactions для i-го пользователя бенчмарка (как у get_current_user_id)."""
+    return f'tg_{BENCH_ID_BASE - i}'
+
+
+def zipf_cum_weights(n, s):
+    """Накопленные веса распределения Ципфа для рангов 1..n (для random.choices)."""
+    return list(itertools.accumulate(1.0 / rank ** s for rank in range(1, n + 1)))
+
+
+def make_media_files(folder, count, size_kb, rng):
+    """Сгенерировать count файлов по size_kb КБ в folder. Возвращает их имена (по содержимому)."""
+    from media_files import HashingWriter, hashed_name
+
+    names = []
+    for i in range(count):
+        tmp_path = os.path.join(folder, f'.bench_{os.getpid()}_{i}.part')
+        with HashingWriter(tmp_path) as writer:
+            writer.write(rng.randbytes(size_kb * 1024))
+        name = hashed_name(writer.hexdigest(), '.jpg')
+        os.replace(tmp_path, os.path.join(folder, name))
+        names.append(name)
+    return names
+
+
+def make_reactions(post_ids, users, count, s, rng):
+    """
+    count различных пар (post_id, user_id, reaction_type): пост и пользователь выбираются по Ципфу.
+    Ранги постов перемешаны, чтобы горячие посты были разбросаны по ленте. Возвращает список строк.
+    """
+    posts_by_rank = post_ids[:]
+    rng.shuffle(posts_by_rank)
+    post_weights = zipf_cum_weights(len(posts_by_rank), s)
+    user_weights = zipf_cum_weights(users, s)
+    count = min(count, len(post_ids) * users)
+    seen = set()
+    rows = []
+    # Горячие пары быстро заканчиваются — ограничиваем число попыток, чтобы не крутиться вечно
+    for _ in range(20):
+        need = count - len(rows)
+        if need <= 0:
+            break
+        picked_posts = rng.choices(posts_by_rank, cum_weights=post_weights, k=need * 2)
+        picked_users = rng.choices(range(users), cum_weights=user_weights, k=need * 2)
+        for post_id, user in zip(picked_posts, picked_users):
+            if (post_id, user) in seen:
+                continue
+            seen.add((post_id, user))
+            rows.append((post_id, bench_user_id(user), rng.choices(REACTION_TYPES, REACTION_WEIGHTS)[0]))
+            if len(rows) >= count:
+                break
+    return rows
+
+
+def copy_rows(c, table, columns, rows):
+    """COPY строк в таблицу (значения без табуляций и переводов строк)."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join('\\N' if v is None else str(v) for v in row) + '\n')
+    buf.seek(0)
+    c.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def seed(app_module, posts, users, reactions, s, media_files, media_size_kb, rng):
+    folder = app_module.UPLOAD_FOLDER
+    names = make_media_files(folder, media_files, media_size_kb, rng)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with app_module.get_db() as conn:
+        c = conn.cursor()
+        # Самые свежие посты — бенчмарка: первые страницы ленты состоят из них
+        copy_rows(c, 'posts', ('telegram_id', 'media_type', 'media_path', 'caption', 'created_at'), (
+            (BENCH_ID_BASE - i, 'photo', names[i % len(names)], f'bench {i}', (now - timedelta(minutes=i)).isoformat())
+            for i in range(posts)
+        ))
+        copy_rows(c, 'users', ('telegram_id', 'first_name', 'photo_url'), (
+            (BENCH_ID_BASE - i, f'bench{i}', '') for i in range(users)
+        ))
+        c.execute('SELECT id FROM posts WHERE telegram_id <= %s ORDER BY id', (BENCH_ID_BASE,))
+        post_ids = [row[0] for row in c.fetchall()]
+        rows = make_reactions(post_ids, users, reactions, s, rng)
+        copy_rows(c, 'user_reactions', ('post_id', 'user_id', 'reaction_type'), rows)
+        app_module.reconcile_reaction_counts(c)
+        conn.commit()
+        app_module.bump_version(conn)
+    return len(post_ids), len(rows), names
+
+
+def reset(app_module):
+    """Удалить посты, реакции, пользователей и файлы бенчмарка. Возвращает (постов, файлов)."""
+    with app_module.get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT DISTINCT media_path FROM posts WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        paths = [row[0] for row in c.fetchall()]
+        c.execute(
+            'DELETE FROM user_reactions WHERE post_id IN (SELECT id FROM posts WHERE telegram_id <= %s)',
+            (BENCH_ID_BASE,),
+        )
+        c.execute('DELETE FROM posts WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        deleted = c.rowcount
+        c.execute('DELETE FROM users WHERE telegram_id <= %s', (BENCH_ID_BASE,))
+        c.execute(
+            'DELETE FROM media_objects WHERE media_path = ANY(%s) AND refcount <= 0 RETURNING media_path',
+            (paths,),
+        )
+        orphaned = [row[0] for row in c.fetchall()]
+        conn.commit()
+        app_module.bump_version(conn)
+    for name in orphaned:
+        try:
+            os.remove(os.path.join(app_module.UPLOAD_FOLDER, name))
+        except FileNotFoundError:
+            pass
+    return deleted, len(orphaned)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Тестовые посты, пользователи и реакции для бенчмарка API.')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--reactions', type=int, default=100000, help='сколько строк user_reactions')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='показатель распределения Ципфа')
+    parser.add_argument('--media-files', type=int, default=8, help='сколько разных медиафайлов')
+    parser.add_argument('--media-size-kb', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='только удалить данные бенчмарка')
+    args = parser.parse_args()
+
+    import app as app_module
+
+    started = time.perf_counter()
+    deleted, files = reset(app_module)
+    if deleted:
+        print(f"Удалено прежних постов бенчмарка: {deleted}, файлов: {files}")
+    if args.reset:
+        return
+    posts, reactions, _ = seed(
+        app_module, args.posts, args.users, args.reactions, args.zipf_s,
+        max(1, args.media_files), args.media_size_kb, random.Random(args.seed),
+    )
+    print(f"Создано: {posts} постов, {args.users} пользователей, {reactions} реакций "
+          f"за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
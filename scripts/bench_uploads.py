@@ -0,0 +1,136 @@
+"""
+Сколько времени воркер Python занят отдачей медиафайла: режим Flask (send_from_directory + Range)
+против MEDIA_SENDFILE=x-accel (передачу делает nginx, воркер только ставит заголовок).
+
+Поднимает приложение на локальном порту, параллельные «медленные» клиенты качают один большой файл
+целиком и с середины (перемотка видео). Занятость воркера — время от начала запроса
+до close() тела ответа, то есть пока WSGI-поток не может взять следующий запрос.
+Под gunicorn без прокси тело идёт через wsgi.file_wrapper (sendfile), но воркер всё равно занят,
+пока медленный клиент не дочитает файл.
+
+    DATABASE_URL=postgresql://localhost/postshet_test python scripts/bench_uploads.py --size-mb 20 --clients 8
+
+В режиме x-accel прокси в тесте нет, поэтому клиенты получают пустое тело — меряется только сторона воркера.
+"""
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class OccupancyMiddleware:
+    """Замер занятости воркера: от вызова приложения до close() итератора ответа."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lock = threading.Lock()
+        self.busy = []
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        result = self.wsgi_app(environ, start_response)
+        middleware = self
+
+        class Body:
+            def __iter__(self):
+                return iter(result)
+
+            def close(self):
+                if hasattr(result, 'close'):
+                    result.close()
+                with middleware.lock:
+                    middleware.busy.append(time.perf_counter() - started)
+
+        return Body()
+
+    def reset(self):
+        with self.lock:
+            busy, self.busy = self.busy, []
+        return busy
+
+
+def download(port, path, rate_kbps, range_header=None):
+    """Скачать path, читая не быстрее rate_kbps КБ/с (медленный мобильный клиент). Возвращает (статус, байт)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    headers = {'Range': range_header} if range_header else {}
+    conn.request('GET', path, headers=headers)
+    resp = conn.getresponse()
+    chunk_size = 64 * 1024
+    total = 0
+    while True:
+        chunk = resp.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if rate_kbps:
+            time.sleep(len(chunk) / (rate_kbps * 1024))
+    conn.close()
+    return resp.status, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Занятость воркера при отдаче /uploads: Flask vs X-Accel-Redirect.')
+    parser.add_argument('--size-mb', type=float, default=20, help='размер тестового файла')
+    parser.add_argument('--clients', type=int, default=8, help='сколько клиентов качают одновременно')
+    parser.add_argument('--requests', type=int, default=16, help='сколько скачиваний в каждом сценарии')
+    parser.add_argument('--rate-kbps', type=int, default=4096, help='скорость одного клиента, КБ/с (0 — без ограничения)')
+    args = parser.parse_args()
+
+    import app as app_module
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    size = int(args.size_mb * 1024 * 1024)
+    filename = f'.bench_{os.getpid()}.mp4'
+    full_path = os.path.join(app_module.UPLOAD_FOLDER, filename)
+    with open(full_path, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for offset in range(0, size, len(block)):
+            f.write(block[:size - offset])
+
+    middleware = OccupancyMiddleware(app_module.app.wsgi_app)
+    app_module.app.wsgi_app = middleware
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    scenarios = [
+        ('flask, целиком', '', None),
+        ('flask, перемотка на середину', '', f'bytes={size // 2}-'),
+        ('x-accel, целиком', 'x-accel', None),
+        ('x-accel, перемотка на середину', 'x-accel', f'bytes={size // 2}-'),
+    ]
+    print(f"Файл {args.size_mb:g} МБ, {args.requests} скачиваний, {args.clients} клиентов по {args.rate_kbps} КБ/с\n")
+    print(f"{'сценарий':34} {'статус':>7} {'МБ/запрос':>10} {'занят, мс (ср)':>15} {'макс, мс':>10} {'воркер·с':>9}")
+    try:
+        for title, mode, range_header in scenarios:
+            app_module.MEDIA_SENDFILE = mode
+            middleware.reset()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                results = list(pool.map(
+                    lambda _: download(port, f'/uploads/{filename}', args.rate_kbps, range_header),
+                    range(args.requests),
+                ))
+            busy = middleware.reset()
+            statuses = sorted({status for status, _ in results})
+            mb = sum(n for _, n in results) / len(results) / 1024 / 1024
+            # воркер·с — сколько секунд потоков WSGI ушло на весь сценарий (их не хватает при наплыве)
+            print(
+                f"{title:34} {','.join(map(str, statuses)):>7} {mb:>10.2f} "
+                f"{sum(busy) / len(busy) * 1000:>15.1f} {max(busy) * 1000:>10.1f} {sum(busy):>9.2f}"
+            )
+    finally:
+        server.shutdown()
+        os.remove(full_path)
+
+
+if __name__ == '__main__':
+    main()
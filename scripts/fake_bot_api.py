@@ -0,0 +1,152 @@
+"""
+Локальная замена Telegram Bot API для проверки загрузки аватарок без сети.
+
+Отвечает на getUserProfilePhotos, getFile и скачивание файла (/file/bot<token>/...), каждый ответ —
+через --delay сек. У пользователей с чётным id фото есть (JPEG генерируется), у нечётных — нет.
+Сайт направляется на неё через TELEGRAM_API_BASE:
+
+    python scripts/fake_bot_api.py --port 8091 --delay 1
+    TELEGRAM_API_BASE=http://127.0.0.1:8091 TELEGRAM_BOT_TOKEN=test flask --app app run
+
+С --check N скрипт сам выполняет N входов по ссылке из бота (/auth/telegram/verify) через test_client
+и показывает, сколько ждал вход и через сколько у пользователей появились аватарки.
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_app(delay):
+    stats = {'requests': 0}
+
+    def user_photo(user_id):
+        from PIL import Image
+
+        buf = io.BytesIO()
+        Image.new('RGB', (160, 160), ((user_id * 37) % 256, 120, 200)).save(buf, 'JPEG')
+        return buf.getvalue()
+
+    async def get_user_profile_photos(request):
+        stats['requests'] += 1
+        await asyncio.sleep(delay)
+        user_id = int(request.query['user_id'])
+        photos = [[{'file_id': f'avatar{user_id}', 'width': 160, 'height': 160}]] if user_id % 2 == 0 else []
+        return web.json_response({'ok': True, 'result': {'total_count': len(photos), 'photos': photos}})
+
+    async def get_file(request):
+        stats['requests'] += 1
+        await asyncio.sleep(delay)
+        file_id = request.query['file_id']
+        return web.json_response({'ok': True, 'result': {'file_id': file_id, 'file_path': f'profile_photos/{file_id}.jpg'}})
+
+    async def download(request):
+        stats['requests'] += 1
+        await asyncio.sleep(delay)
+        user_id = int(request.match_info['name'].removeprefix('avatar').removesuffix('.jpg'))
+        return web.Response(body=user_photo(user_id), content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get('/bot{token}/getUserProfilePhotos', get_user_profile_photos)
+    app.router.add_get('/bot{token}/getFile', get_file)
+    app.router.add_get('/file/bot{token}/profile_photos/{name}', download)
+    app['stats'] = stats
+    return app
+
+
+def serve_in_thread(delay):
+    """Запустить сервер на свободном порту в отдельном потоке (со своим event loop). Возвращает порт."""
+    started = threading.Event()
+    result = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(make_app(delay), access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        result['port'] = site._server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return result['port']
+
+
+def run_check(logins, delay):
+    port = serve_in_thread(delay)
+    os.environ['TELEGRAM_API_BASE'] = f'http://127.0.0.1:{port}'
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test')
+    import app as app_module
+
+    app_module.LOGIN_TOKEN_SECRET = app_module.LOGIN_TOKEN_SECRET or 'check'
+    client = app_module.app.test_client()
+    base_id = -int(time.time())  # отрицательные id не пересекутся с настоящими пользователями
+    base_id -= base_id % 2
+    user_ids = [base_id - i for i in range(logins)]
+
+    waits = []
+    for telegram_id in user_ids:
+        resp = client.post('/api/create-login-token', json={'secret': app_module.LOGIN_TOKEN_SECRET, 'telegram_id': telegram_id})
+        token = resp.get_json()['login_url'].rsplit('token=', 1)[1]
+        started = time.perf_counter()
+        client.get(f'/auth/telegram/verify?token={token}')
+        waits.append(time.perf_counter() - started)
+    print(f"Вход: {logins} раз, в среднем {sum(waits) / len(waits) * 1000:.1f} мс, максимум {max(waits) * 1000:.1f} мс "
+          f"(три запроса к Bot API по {delay} с шли бы последовательно: {3 * delay:.1f} с)")
+
+    started = time.perf_counter()
+    expected = sum(1 for telegram_id in user_ids if telegram_id % 2 == 0)
+    with app_module.get_db() as conn:
+        c = conn.cursor()
+        while True:
+            c.execute(
+                "SELECT count(*) FILTER (WHERE photo_url <> ''), count(photo_fetched_at) FROM users WHERE telegram_id = ANY(%s)",
+                (user_ids,),
+            )
+            with_photo, checked = c.fetchone()
+            conn.commit()
+            if checked >= logins or time.perf_counter() - started > 60:
+                break
+            time.sleep(0.05)
+        print(f"Аватарки: {with_photo} из {expected} за {time.perf_counter() - started:.2f} с, проверено {checked} из {logins}")
+
+        # Повторный вход в пределах AVATAR_TTL ничего не качает
+        before = app_module.avatar_fetcher.stats()['queued']
+        resp = client.post('/api/create-login-token', json={'secret': app_module.LOGIN_TOKEN_SECRET, 'telegram_id': user_ids[0]})
+        client.get(f"/auth/telegram/verify?token={resp.get_json()['login_url'].rsplit('token=', 1)[1]}")
+        print(f"Повторный вход: загрузок поставлено {app_module.avatar_fetcher.stats()['queued'] - before}")
+        print(app_module.avatar_fetcher.stats())
+
+        c.execute('SELECT photo_url FROM users WHERE telegram_id = ANY(%s)', (user_ids,))
+        for (photo_url,) in c.fetchall():
+            if photo_url:
+                os.remove(os.path.join(app_module.UPLOAD_FOLDER, os.path.basename(photo_url)))
+        c.execute('DELETE FROM users WHERE telegram_id = ANY(%s)', (user_ids,))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена Telegram Bot API (аватарки пользователей).')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--delay', type=float, default=0.5, help='задержка каждого ответа, сек')
+    parser.add_argument('--check', type=int, default=0, metavar='N', help='выполнить N входов и дождаться аватарок')
+    args = parser.parse_args()
+
+    if args.check:
+        run_check(args.check, args.delay)
+        return
+    print(f"Fake Bot API на http://127.0.0.1:{args.port} (delay={args.delay}s)")
+    web.run_app(make_app(args.delay), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Нагрузочная проверка корректности реакций: тысячи параллельных переключений
+POST /api/posts/<id>/reactions на одном посте, затем сверка posts.reaction_counts с user_reactions.
+
+Запускать только на тестовой базе:
+    DATABASE_URL=postgresql://localhost/postshet_test python scripts/stress_reactions.py --toggles 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REACTION_TYPES = ['like', 'heart', 'laughing', 'fire', 'surprised']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параллельные переключения реакций + сверка счётчиков.')
+    parser.add_argument('--toggles', type=int, default=5000, help='сколько кликов отправить')
+    parser.add_argument('--users', type=int, default=200, help='сколько разных пользователей кликают')
+    parser.add_argument('--threads', type=int, default=32, help='сколько потоков кликают одновременно')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    # Пул должен вмещать все потоки, иначе тест будет мерить очередь к пулу
+    os.environ.setdefault('DB_POOL_MAX', str(args.threads + 2))
+    import app as app_module
+
+    rng = random.Random(args.seed)
+    client = app_module.app.test_client()
+    telegram_id = -int(time.time() * 1000)  # отрицательный id не пересечётся с настоящими постами
+    resp = client.post('/api/posts', json={
+        'telegram_id': telegram_id,
+        'media_type': 'photo',
+        'media_path': 'stress.jpg',
+        'caption': 'stress_reactions',
+    })
+    post_id = resp.get_json()['id']
+
+    clicks = [(rng.randrange(args.users), rng.choice(REACTION_TYPES)) for _ in range(args.toggles)]
+    statuses = Counter()
+
+    def click(item):
+        user, reaction_type = item
+        c = app_module.app.test_client()
+        with c.session_transaction() as sess:
+            sess['user'] = {'telegram_id': 10 ** 9 + user}
+        r = c.post(f'/api/posts/{post_id}/reactions', json={'reaction_type': reaction_type})
+        return r.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for status in pool.map(click, clicks):
+            statuses[status] += 1
+    elapsed = time.perf_counter() - started
+
+    # В режиме REACTIONS_WRITE_BEHIND счётчики ещё в памяти — сбрасываем перед сверкой
+    app_module.reaction_buffer.flush()
+
+    with app_module.get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT reaction_counts FROM posts WHERE id = %s', (post_id,))
+        stored = c.fetchone()[0]
+        c.execute(
+            'SELECT reaction_type, count(*) FROM user_reactions WHERE post_id = %s GROUP BY reaction_type',
+            (post_id,),
+        )
+        expected = {row[0]: row[1] for row in c.fetchall()}
+        # Убираем за собой тестовый пост
+        c.execute('DELETE FROM user_reactions WHERE post_id = %s', (post_id,))
+        c.execute('DELETE FROM posts WHERE id = %s', (post_id,))
+        conn.commit()
+
+    print(f"Кликов: {args.toggles} за {elapsed:.2f} с ({args.toggles / elapsed:.0f}/с), статусы: {dict(statuses)}")
+    print(f"posts.reaction_counts: {stored}")
+    print(f"user_reactions:        {expected}")
+    if stored != expected or set(statuses) != {200}:
+        print("❌ Счётчики разошлись с user_reactions или были ошибки")
+        sys.exit(1)
+    print("✅ Счётчики совпадают")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Журнал медленных SQL-запросов и повторяющихся запросов (N+1) в формате JSON lines.
+
+Подключается наблюдателем к db_trace (add_observer(log.observe)). Запрос дольше порога записывается
+строкой {"type": "slow_query", ...}: вместо текста — отпечаток (литералы и параметры заменены на ?,
+списки свёрнуты, плюс короткий хеш), вместо значений параметров — только их типы, так что в журнал
+не попадают данные пользователей. Для доли медленных запросов (explain_rate) сразу снимается
+EXPLAIN (ANALYZE, BUFFERS): запрос выполняется ещё раз на том же соединении внутри SAVEPOINT,
+который потом откатывается, поэтому изменения и pg_notify не сохраняются. Откат не возвращает
+последовательности, поэтому запросы с nextval/setval, INSERT и всё, что не начинается с SELECT/WITH,
+не выполняются повторно — для них берётся только план (EXPLAIN без ANALYZE). Строки из нескольких
+команд не объясняются вовсе: EXPLAIN относится только к первой, а остальные выполнились бы.
+
+Между request_started() и request_finished() считаются одинаковые по отпечатку запросы текущего
+потока: если какой-то выполнен больше repeat_threshold раз, пишется {"type": "repeated_query", ...}.
+
+Сводка по журналу:
+    python slow_queries.py summary slow_queries.jsonl [--top 20]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extensions
+
+FINGERPRINT_CACHE_SIZE = 1024  # тексты запросов приложения — шаблоны с %s, их немного
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s')
+_NUMBERS = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_REPEATED_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SPACES = re.compile(r'\s+')
+# Что откат до SAVEPOINT не отменяет: nextval/setval и INSERT (SERIAL-ключи берутся из последовательностей)
+_SEQUENCE_EFFECTS = re.compile(r'\b(?:nextval|setval|insert)\b', re.I)
+_READ_ONLY_START = re.compile(r'^(?:select|with)\b', re.I)
+
+
+def normalize(sql):
+    """Текст запроса без литералов и параметров: одинаков у запросов, отличающихся только значениями."""
+    sql = _COMMENTS.sub(' ', sql)
+    sql = _STRINGS.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _LISTS.sub('(...)', sql)  # IN (?, ?, ?) и строки VALUES
+    sql = _REPEATED_LISTS.sub('(...)', sql)  # VALUES (...), (...), ...
+    return _SPACES.sub(' ', sql).strip()
+
+
+def param_shape(params):
+    """Типы параметров вместо значений: ["int", "str", "list[30]"] или {"name": "str"}."""
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return f'{type(value).__name__}[{len(value)}]'
+        return type(value).__name__
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+
+class SlowQueryLog:
+    """
+    threshold_ms — с какой длительности запрос считается медленным (0 — не записывать медленные);
+    explain_rate — доля медленных запросов, для которых снимается EXPLAIN (ANALYZE, BUFFERS);
+    repeat_threshold — сколько одинаковых запросов за HTTP-запрос считать N+1 (0 — не проверять);
+    path — файл журнала (дописывается); пусто — строки печатаются в stdout.
+    """
+
+    def __init__(self, threshold_ms=200.0, explain_rate=0.1, repeat_threshold=10, path=''):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.repeat_threshold = repeat_threshold
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._fingerprints = {}
+
+    def fingerprint(self, sql):
+        """(нормализованный текст, хеш из 12 символов) — с кешем по исходному тексту."""
+        cached = self._fingerprints.get(sql)
+        if cached is None:
+            text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+            normalized = normalize(text)
+            cached = (normalized, hashlib.sha1(normalized.encode()).hexdigest()[:12])
+            if len(self._fingerprints) >= FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()  # execute_values подставляет значения в текст — такие не копим
+            self._fingerprints[sql] = cached
+        return cached
+
+    def request_started(self, route):
+        self._local.route = route
+        self._local.counts = {} if self.repeat_threshold else None
+
+    def request_finished(self):
+        counts = getattr(self._local, 'counts', None)
+        route = getattr(self._local, 'route', None)
+        self._local.route = self._local.counts = None
+        if not counts:
+            return
+        for fingerprint, (normalized, count, seconds) in counts.items():
+            if count > self.repeat_threshold:
+                self.write({
+                    'type': 'repeated_query',
+                    'route': route,
+                    'fingerprint': fingerprint,
+                    'statement': normalized,
+                    'count': count,
+                    'ms': round(seconds * 1000, 3),
+                })
+
+    def observe(self, cursor, sql, params, seconds):
+        """Наблюдатель db_trace: вызывается после каждого execute."""
+        counts = getattr(self._local, 'counts', None)
+        slow = self.threshold and seconds >= self.threshold
+        if counts is None and not slow:
+            return
+        normalized, fingerprint = self.fingerprint(sql)
+        if counts is not None:
+            entry = counts.get(fingerprint)
+            counts[fingerprint] = (normalized, entry[1] + 1, entry[2] + seconds) if entry else (normalized, 1, seconds)
+        if not slow:
+            return
+        record = {
+            'type': 'slow_query',
+            'route': getattr(self._local, 'route', None) or 'background',
+            'fingerprint': fingerprint,
+            'statement': normalized,
+            'params': param_shape(params),
+            'ms': round(seconds * 1000, 3),
+        }
+        if params is not None and random.random() < self.explain_rate:
+            record['explain'] = self.explain(cursor, sql, params, normalized)
+        self.write(record)
+
+    def explain(self, cursor, sql, params, normalized):
+        """
+        EXPLAIN (ANALYZE, BUFFERS) того же запроса на том же соединении внутри SAVEPOINT с откатом
+        (для запросов, сдвигающих последовательности, — EXPLAIN без выполнения).
+        Возвращает строки плана или {"error": ...}. Только внутри открытой исправной транзакции.
+        """
+        if ';' in normalized.rstrip('; '):
+            return {'error': 'multiple statements'}
+        analyze = _READ_ONLY_START.match(normalized) and not _SEQUENCE_EFFECTS.search(normalized)
+        conn = cursor.connection
+        if conn.autocommit or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            return {'error': 'no open transaction'}
+        if isinstance(sql, bytes):
+            sql = sql.decode()
+        elif not isinstance(sql, str):
+            sql = sql.as_string(conn)
+        # Обычный курсор, а не курсор соединения: иначе EXPLAIN сам попал бы в наблюдатели
+        c = psycopg2.extensions.cursor(conn)
+        c.execute('SAVEPOINT slow_query_explain')
+        try:
+            c.execute(('EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN ') + sql, params)
+            return [row[0] for row in c.fetchall()]
+        except psycopg2.Error as e:
+            return {'error': str(e).strip()}
+        finally:
+            c.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            c.execute('RELEASE SAVEPOINT slow_query_explain')
+            c.close()
+
+    def write(self, record):
+        record = {'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), **record}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._write_lock:
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            else:
+                print(line, flush=True)
+
+
+def summarize(lines, top=20):
+    """Сводка журнала: самые затратные медленные запросы и самые частые N+1 по маршрутам."""
+    slow = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': set(), 'explained': 0})
+    repeated = defaultdict(lambda: {'requests': 0, 'max_count': 0, 'total_ms': 0.0})
+    statements = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        statements[record.get('fingerprint')] = record.get('statement', '')
+        if record.get('type') == 'slow_query':
+            item = slow[record['fingerprint']]
+            item['count'] += 1
+            item['total_ms'] += record['ms']
+            item['max_ms'] = max(item['max_ms'], record['ms'])
+            item['routes'].add(record.get('route'))
+            item['explained'] += isinstance(record.get('explain'), list)
+        elif record.get('type') == 'repeated_query':
+            item = repeated[(record.get('route'), record['fingerprint'])]
+            item['requests'] += 1
+            item['max_count'] = max(item['max_count'], record['count'])
+            item['total_ms'] += record['ms']
+
+    print(f"Медленные запросы ({len(slow)} разных):")
+    for fingerprint, item in sorted(slow.items(), key=lambda kv: -kv[1]['total_ms'])[:top]:
+        print(f"  {fingerprint}  {item['count']:>6} раз  всего {item['total_ms']:>10.1f} мс  "
+              f"макс {item['max_ms']:>8.1f} мс  планов {item['explained']}  {', '.join(sorted(item['routes']))}")
+        print(f"      {statements[fingerprint][:160]}")
+    print(f"Повторяющиеся запросы (N+1): {len(repeated)}")
+    for (route, fingerprint), item in sorted(repeated.items(), key=lambda kv: -kv[1]['total_ms'])[:top]:
+        print(f"  {route}  {fingerprint}  в {item['requests']} запросах, до {item['max_count']} раз подряд, "
+              f"всего {item['total_ms']:.1f} мс")
+        print(f"      {statements[fingerprint][:160]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сводка журнала медленных SQL-запросов.')
+    parser.add_argument('command', choices=['summary'])
+    parser.add_argument('path', help='файл журнала (JSON lines); - — stdin')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+    if args.path == '-':
+        summarize(sys.stdin, args.top)
+    else:
+        with open(args.path, encoding='utf-8') as f:
+            summarize(f, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
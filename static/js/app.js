@@ -258,18 +258,52 @@ function initMasonry(container) {
     }
     const options = getMasonryOptions(container);
     masonryInstance = new Masonry(container, options);
-    if (typeof imagesLoaded !== 'undefined') {
-        imagesLoaded(container, function() {
-            if (masonryInstance) masonryInstance.layout();
-        });
-    }
+    relayoutWhenLoaded(Array.from(container.querySelectorAll('.post')));
+}
+
+// Перекладка после загрузки картинок нужна только постам без известных размеров (старые посты):
+// у остальных место под медиа зарезервировано заранее
+function relayoutWhenLoaded(elements) {
+    if (typeof imagesLoaded === 'undefined') return;
+    const unsized = elements.filter(el => el.querySelector('.post-media:not([data-sized])'));
+    if (!unsized.length) return;
+    imagesLoaded(unsized, function() {
+        if (masonryInstance) masonryInstance.layout();
+    });
 }
 
-// Загрузка постов
+const POSTS_PAGE_SIZE = 30;
+// Ширина картинки поста для sizes: как у колонки Masonry (телефон — 2 колонки, ПК — 15%)
+const POST_MEDIA_SIZES = '(max-width: 768px) 50vw, 15vw';
+let nextPostsCursor = null; // Курсор следующей (более старой) страницы ленты; null — дошли до конца
+let loadingMorePosts = false;
+let postsObserver = null;
+let firstPageEtag = null; // ETag первой страницы: при опросе сервер ответит 304, если ничего не менялось
+
+// Запрос одной страницы ленты: { posts, next_cursor }; null — если сервер ответил 304 на etag
+async function fetchPostsPage(cursor, etag) {
+    const params = new URLSearchParams({ limit: String(POSTS_PAGE_SIZE) });
+    if (cursor) params.set('before', cursor);
+    // no-store: валидатор отправляем сами, иначе браузер спрячет 304 за своим кешем
+    const options = { cache: 'no-store', headers: {} };
+    if (etag) options.headers['If-None-Match'] = etag;
+    const response = await fetch(`${API_BASE}/posts?${params}`, options);
+    if (response.status === 304) return null;
+    const page = await response.json();
+    if (!cursor) firstPageEtag = response.headers.get('ETag');
+    // Реакции текущего пользователя приходят отдельно от общей (кешируемой) части ленты
+    const mine = page.my_reactions || {};
+    (page.posts || []).forEach(post => {
+        post.my_reaction = mine[post.id] || null;
+    });
+    return page;
+}
+
+// Загрузка постов: только первая страница, остальное — по мере прокрутки
 async function loadPosts() {
     try {
-        const response = await fetch(`${API_BASE}/posts`);
-        const posts = await response.json();
+        const page = await fetchPostsPage(null);
+        const posts = page.posts || [];
         
         const container = document.getElementById('posts-container');
         if (masonryInstance) {
@@ -277,6 +311,7 @@ async function loadPosts() {
             masonryInstance = null;
         }
         container.innerHTML = '';
+        nextPostsCursor = page.next_cursor || null;
         
         if (posts.length === 0) {
             container.innerHTML = '<div class="loading">Пока нет постов</div>';
@@ -288,11 +323,173 @@ async function loadPosts() {
             container.appendChild(postElement);
         });
         initMasonry(container);
+        observePostsSentinel();
     } catch (error) {
         console.error('Ошибка при загрузке постов:', error);
     }
 }
 
+// Подгрузка следующей страницы (бесконечная прокрутка)
+async function loadMorePosts() {
+    if (loadingMorePosts || !nextPostsCursor) return;
+    loadingMorePosts = true;
+    try {
+        const page = await fetchPostsPage(nextPostsCursor);
+        const container = document.getElementById('posts-container');
+        const elements = [];
+        (page.posts || []).forEach(post => {
+            if (container.querySelector(`.post[data-post-id="${post.id}"]`)) return;
+            const postElement = createPostElement(post);
+            container.appendChild(postElement);
+            elements.push(postElement);
+        });
+        nextPostsCursor = page.next_cursor || null;
+        if (elements.length && masonryInstance) {
+            masonryInstance.appended(elements);
+            relayoutWhenLoaded(elements);
+        }
+    } catch (error) {
+        console.error('Ошибка при подгрузке постов:', error);
+    } finally {
+        loadingMorePosts = false;
+    }
+}
+
+// Следим за «маяком» под лентой: как только он близко к экрану — грузим следующую страницу
+function observePostsSentinel() {
+    const sentinel = document.getElementById('posts-sentinel');
+    if (!sentinel || !('IntersectionObserver' in window)) return;
+    if (!postsObserver) {
+        postsObserver = new IntersectionObserver(function(entries) {
+            if (entries.some(entry => entry.isIntersecting)) loadMorePosts();
+        }, { rootMargin: '800px 0px' });
+        postsObserver.observe(sentinel);
+    }
+}
+
+// Периодическое обновление: новые посты добавляются сверху, у уже показанных обновляются счётчики
+async function refreshPosts() {
+    const container = document.getElementById('posts-container');
+    if (!container.querySelector('.post')) {
+        loadPosts();
+        return;
+    }
+    try {
+        const page = await fetchPostsPage(null, firstPageEtag);
+        if (!page) return; // 304: лента не менялась — DOM не трогаем
+        const fresh = [];
+        (page.posts || []).forEach(post => {
+            const existing = container.querySelector(`.post[data-post-id="${post.id}"]`);
+            if (existing) {
+                updatePostReactions(existing, post.reactions, post.my_reaction);
+            } else {
+                fresh.push(createPostElement(post));
+            }
+        });
+        if (!fresh.length) return;
+        fresh.slice().reverse().forEach(el => container.insertBefore(el, container.firstChild));
+        if (masonryInstance) {
+            masonryInstance.prepended(fresh);
+            relayoutWhenLoaded(fresh);
+        }
+    } catch (error) {
+        console.error('Ошибка при обновлении постов:', error);
+    }
+}
+
+// ——— Живые обновления (Server-Sent Events) ———
+const POLL_INTERVAL_MS = 30000;
+let liveSource = null;
+let liveConnectedOnce = false;
+let pollTimer = null;
+
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(refreshPosts, POLL_INTERVAL_MS);
+}
+
+function stopPolling() {
+    if (pollTimer) {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+}
+
+// Тип реакции текущего пользователя на карточке (события несут только общие счётчики)
+function currentMyReaction(postElement) {
+    const mine = postElement.querySelector('.counter-item.my-reaction');
+    return mine ? mine.dataset.type : null;
+}
+
+function prependPostElement(post) {
+    const container = document.getElementById('posts-container');
+    if (container.querySelector(`.post[data-post-id="${post.id}"]`)) return;
+    if (!container.querySelector('.post')) {
+        // Лента была пустой («Пока нет постов») — проще перерисовать первую страницу
+        loadPosts();
+        return;
+    }
+    const postElement = createPostElement(post);
+    container.insertBefore(postElement, container.firstChild);
+    if (masonryInstance) {
+        masonryInstance.prepended([postElement]);
+        relayoutWhenLoaded([postElement]);
+    }
+}
+
+function removePostElement(postId) {
+    const card = document.querySelector(`.post[data-post-id="${postId}"]`);
+    if (!card) return;
+    if (masonryInstance) masonryInstance.remove(card);
+    card.remove();
+    if (masonryInstance) masonryInstance.layout();
+}
+
+// Подписка на /api/stream; без EventSource или при отказе сервера — опрос раз в 30 секунд
+function connectLiveUpdates() {
+    if (!('EventSource' in window)) {
+        startPolling();
+        return;
+    }
+    liveSource = new EventSource(`${API_BASE}/stream`);
+    liveSource.addEventListener('open', function() {
+        stopPolling();
+        // После переподключения догоняем то, что могли пропустить
+        if (liveConnectedOnce) refreshPosts();
+        liveConnectedOnce = true;
+    });
+    liveSource.addEventListener('post_created', function(e) {
+        const data = JSON.parse(e.data);
+        if (!data.post) return;
+        // Большой пост приходит без полей (лимит pg_notify) — берём его из ленты
+        if (data.post.media_path) prependPostElement(data.post);
+        else refreshPosts();
+    });
+    liveSource.addEventListener('post_deleted', function(e) {
+        removePostElement(JSON.parse(e.data).post_id);
+    });
+    liveSource.addEventListener('reactions_changed', function(e) {
+        const data = JSON.parse(e.data);
+        const postEl = document.querySelector(`.post[data-post-id="${data.post_id}"]`);
+        if (postEl) updatePostReactions(postEl, data.reactions, currentMyReaction(postEl));
+    });
+    liveSource.addEventListener('resync', function() {
+        refreshPosts();
+    });
+    liveSource.addEventListener('error', function() {
+        // Пока EventSource переподключается, события могут теряться — подстрахуемся опросом
+        startPolling();
+        if (liveSource.readyState === EventSource.CLOSED) liveSource = null;
+    });
+}
+
+// Атрибуты зарезервированного места под медиа: width/height + aspect-ratio и плейсхолдер фоном
+function mediaBoxAttrs(post) {
+    if (!post.width || !post.height) return '';
+    const style = [`aspect-ratio: ${post.width} / ${post.height}`];
+    if (post.placeholder) style.push(`background-image: url('${post.placeholder}')`);
+    return `width="${post.width}" height="${post.height}" data-sized style="${style.join('; ')}"`;
+}
+
 // Создание элемента поста
 function createPostElement(post) {
     const postDiv = document.createElement('div');
@@ -306,12 +503,24 @@ function createPostElement(post) {
     const isCloudinary = post.media_path && post.media_path.startsWith('http');
     const fullMediaPath = isCloudinary ? post.media_path : ('/uploads/' + post.media_path);
 
-    if (post.media_type === 'photo') {
-        mediaHTML = `<img src="${fullMediaPath}" alt="Post" class="post-media" loading="lazy">`;
+    // Размеры известны заранее — место под медиа резервируется сразу (Masonry раскладывает один раз),
+    // а пока файл грузится, виден размытый плейсхолдер
+    const boxAttrs = mediaBoxAttrs(post);
+
+    if (post.media_type === 'photo' && post.srcset) {
+        // Уменьшенные копии: браузер берёт ширину под колонку и DPR, WebP — если поддерживает
+        mediaHTML = `<picture>
+            <source type="image/webp" srcset="${post.srcset.webp}" sizes="${POST_MEDIA_SIZES}">
+            <img src="${fullMediaPath}" srcset="${post.srcset.jpeg}" sizes="${POST_MEDIA_SIZES}" alt="Post" class="post-media" loading="lazy" ${boxAttrs}>
+        </picture>`;
+    } else if (post.media_type === 'photo') {
+        mediaHTML = `<img src="${fullMediaPath}" alt="Post" class="post-media" loading="lazy" ${boxAttrs}>`;
     } else if (post.media_type === 'video' || post.media_type === 'animation') {
         // Добавим autoplay и loop для анимаций (гифок из TG), так как они приходят как видео
         const isAnimation = post.media_type === 'animation';
-        mediaHTML = `<video src="${fullMediaPath}" ${isAnimation ? 'autoplay loop muted playsinline' : 'controls'} class="post-media"></video>`;
+        // preload="none": mp4 не качается ради первого кадра — его показывает постер
+        const posterAttr = post.poster ? `poster="${post.poster}"` : '';
+        mediaHTML = `<video src="${fullMediaPath}" ${isAnimation ? 'autoplay loop muted playsinline' : 'controls'} preload="none" ${posterAttr} class="post-media" ${boxAttrs}></video>`;
     }
     
     const captionHTML = post.caption ? `<div class="post-caption">${escapeHtml(post.caption)}</div>` : '';
@@ -643,12 +852,21 @@ function updateAuthUI(user) {
     }
 }
 
+const AVATAR_POLL_MS = 2000;
+const AVATAR_POLL_LIMIT = 5;
+let avatarPolls = 0;
+
 async function loadMe() {
     try {
         const response = await fetch(API_BASE + '/me');
         const user = await response.json();
         currentUser = user && (user.telegram_id || user.username || user.first_name) ? user : null;
         updateAuthUI(user);
+        // Аватарка качается на сервере в фоне после входа — переспросим, пока не появится
+        if (currentUser && user.photo_pending && avatarPolls < AVATAR_POLL_LIMIT) {
+            avatarPolls++;
+            setTimeout(loadMe, AVATAR_POLL_MS);
+        }
     } catch (e) {
         currentUser = null;
         updateAuthUI(null);
@@ -738,8 +956,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (e.target === this) hideAuthRequiredModal();
     });
 
-    // Обновление постов каждые 30 секунд
-    setInterval(loadPosts, 30000);
+    // Живые обновления ленты; если SSE недоступен — опрос каждые 30 секунд
+    connectLiveUpdates();
 
     // Перерасчёт Masonry при изменении размера окна (5 кол. ↔ 2 кол.)
     let resizeTimeout;
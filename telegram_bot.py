@@ -1,12 +1,20 @@
 import asyncio
-import aiohttp
+from concurrent.futures import ProcessPoolExecutor
 import aiofiles
 import os
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message
 
+from api_client import ApiClient
+from post_outbox import REJECTED_STATUSES, OutboxRejected, PostOutbox
+from media_files import HashingWriter, store_content_hashed
+from media_meta import describe_media, has_ffmpeg
+from media_variants import make_variants
+from metrics import Registry, SLOW_BUCKETS, serve as serve_metrics
+
 load_dotenv()
 
 # Конфигурация
@@ -18,34 +26,183 @@ LOGIN_TOKEN_SECRET = os.environ.get("LOGIN_TOKEN_SECRET", "")
 # Важно: папка uploads должна быть доступна Flask-серверу
 UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "uploads") 
 
+# Сколько процессов кодируют уменьшенные копии фото (event loop бота при этом не блокируется)
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", 2))
+
+# HTTP-клиент к Flask API: одна keep-alive сессия на процесс; посты, пришедшие в пределах
+# API_BATCH_WINDOW_MS, уходят одним POST /api/posts/batch (не больше API_BATCH_MAX)
+API_CONNECTIONS = int(os.environ.get("API_CONNECTIONS", 10))
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", 30))
+API_BATCH_WINDOW_MS = int(os.environ.get("API_BATCH_WINDOW_MS", 200))
+API_BATCH_MAX = int(os.environ.get("API_BATCH_MAX", 50))
+
+# Посты сначала записываются в локальный файл очереди (SQLite) и уходят в API из него —
+# не теряются, пока API недоступен. Паузы между повторами, сек
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "outbox.db")
+OUTBOX_RETRY_BASE_DELAY = float(os.environ.get("OUTBOX_RETRY_BASE_DELAY", 1))
+OUTBOX_RETRY_MAX_DELAY = float(os.environ.get("OUTBOX_RETRY_MAX_DELAY", 60))
+
+# GET /metrics (формат Prometheus) на отдельном порту; 0 — не поднимать
+BOT_METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", 0))
+BOT_METRICS_HOST = os.environ.get("BOT_METRICS_HOST", "127.0.0.1")
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
+api = ApiClient(
+    API_BASE_URL,
+    connections=API_CONNECTIONS,
+    timeout=API_TIMEOUT,
+    batch_window=API_BATCH_WINDOW_MS / 1000,
+    batch_max=API_BATCH_MAX,
+)
+_media_pool = None
+
+metrics = Registry()
+INGEST_SECONDS = metrics.histogram(
+    "postshet_bot_ingest_seconds", "От channel_post до подтверждения поста API", buckets=SLOW_BUCKETS,
+)
+DOWNLOAD_SECONDS = metrics.histogram(
+    "postshet_bot_download_seconds", "Скачивание файла из Telegram", ("result",), SLOW_BUCKETS,
+)
+MEDIA_SECONDS = metrics.histogram("postshet_bot_media_processing_seconds", "Обработка медиа в пуле процессов", ("step",))
+POSTS_QUEUED = metrics.counter("postshet_bot_posts_queued_total", "Посты, поставленные в очередь отправки", ("source",))
+
+
+def _api_batches():
+    stats = api.stats()
+    return {("ok",): stats["batches"] - stats["failed_batches"], ("failed",): stats["failed_batches"]}
+
+
+metrics.callback("postshet_bot_api_batches_total", "Пачки постов, отправленные в API", _api_batches,
+                 kind="counter", labels=("result",))
+metrics.callback("postshet_bot_outbox_posts", "Посты в очереди отправки (pending) и отвергнутые API (dead)",
+                 lambda: {(state,): value for state, value in outbox.stats().items()}, labels=("state",))
+# Когда пришёл channel_post (telegram_id -> time.monotonic()), до подтверждения API
+_ingest_started = {}
+
+
+def get_media_pool():
+    """Пул процессов для обработки медиа (создаётся при первом фото)."""
+    global _media_pool
+    if _media_pool is None:
+        _media_pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _media_pool
+
+
+async def build_variants(media_path):
+    """WebP/JPEG-копии фото нескольких ширин в отдельном процессе; при ошибке пост уходит без них."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_media_pool(), make_variants, media_path, UPLOAD_FOLDER)
+    except Exception as e:
+        print(f"Ошибка создания копий {media_path}: {e}")
+        return None
+    finally:
+        MEDIA_SECONDS.observe(time.perf_counter() - started, "variants")
+
+
+async def build_meta(media_path, media_type, poster=None):
+    """Размеры, заглушка и постер (колонки posts.media_*) в отдельном процессе; при ошибке — {}."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_media_pool(), describe_media, media_path, UPLOAD_FOLDER, media_type, poster)
+    except Exception as e:
+        print(f"Ошибка чтения метаданных {media_path}: {e}")
+        return {}
+    finally:
+        MEDIA_SECONDS.observe(time.perf_counter() - started, "meta")
+
+
+async def download_thumbnail(thumbnail, message_id):
+    """Превью видео от Telegram как постер (когда нет ffmpeg). Возвращает имя файла или None."""
+    stored = await download_media(thumbnail.file_id, f".{message_id}_thumb.jpg.part", "jpg")
+    return stored[0] if stored else None
 
-async def download_media(file_id, destination):
-    """Скачивает файл напрямую через bot.download"""
+
+async def download_media(file_id, tmp_name, ext):
+    """
+    Скачивает файл через bot.download кусками прямо в uploads/, считая SHA-256 по ходу записи,
+    и сохраняет под именем по содержимому. Возвращает (имя, sha256, размер) или None.
+    """
+    tmp_path = os.path.join(UPLOAD_FOLDER, tmp_name)
+    started = time.perf_counter()
     try:
-        await bot.download(file=file_id, destination=destination)
-        return True
+        with HashingWriter(tmp_path) as writer:
+            await bot.download(file=file_id, destination=writer, seek=False)
     except Exception as e:
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - started, "error")
         print(f"Ошибка скачивания: {e}")
-        return False
-
-async def send_to_api(telegram_id, media_type, media_path, caption=""):
-    """Отправляет данные на Flask API"""
-    async with aiohttp.ClientSession() as session:
-        data = {
-            'telegram_id': telegram_id,
-            'media_type': media_type,
-            'media_path': media_path,
-            'caption': caption or ''
-        }
-        try:
-            async with session.post(f"{API_BASE_URL}/posts", json=data) as resp:
-                return resp.status == 200
-        except Exception as e:
-            print(f"Ошибка связи с API: {e}")
-            return False
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    DOWNLOAD_SECONDS.observe(time.perf_counter() - started, "ok")
+    digest = writer.hexdigest()
+    name = await asyncio.to_thread(store_content_hashed, tmp_path, UPLOAD_FOLDER, ext, digest)
+    return name, digest, writer.size
+
+
+async def lookup_media(file_unique_id):
+    """
+    Уже сохранённый файл с этим Telegram file_unique_id (тот же мем репостнули ещё раз):
+    {"media_path": ..., "media": {...}} или None — тогда файл скачивается и обрабатывается заново.
+    """
+    session = api.session()
+    try:
+        async with session.get(f"{API_BASE_URL}/media/telegram/{file_unique_id}") as resp:
+            if resp.status != 200:
+                return None
+            return await resp.json()
+    except Exception as e:
+        print(f"Ошибка связи с API: {e}")
+        return None
+
+async def deliver_posts(posts):
+    """Доставка пачки постов из очереди: True — принято, False — повторить позже."""
+    status = await api.post_batch(posts)
+    if status in REJECTED_STATUSES:
+        for post in posts:
+            _ingest_started.pop(post["telegram_id"], None)
+        raise OutboxRejected(f"HTTP {status}")
+    if status in (401, 403):
+        # Сам API пачки не проверяет доступ — 401/403 отдаёт прокси или авторизация перед ним.
+        # Посты остаются в очереди и уйдут, как только доступ бота к API_BASE_URL откроют
+        print(f"❌ API отказал боту в доступе (HTTP {status}): проверьте API_BASE_URL ({API_BASE_URL}) "
+              f"и прокси/авторизацию перед API")
+    if status is not None and status != 200:
+        raise RuntimeError(f"HTTP {status}")  # повтор с паузой, код ответа — в last_error очереди
+    if status == 200:
+        now = time.monotonic()
+        for post in posts:
+            started = _ingest_started.pop(post["telegram_id"], None)
+            if started is not None:  # посты, оставшиеся в очереди с прошлого запуска, не замеряются
+                INGEST_SECONDS.observe(now - started)
+    return status == 200
+
+
+outbox = PostOutbox(
+    OUTBOX_PATH,
+    deliver_posts,
+    batch_max=API_BATCH_MAX,
+    batch_window=API_BATCH_WINDOW_MS / 1000,
+    base_delay=OUTBOX_RETRY_BASE_DELAY,
+    max_delay=OUTBOX_RETRY_MAX_DELAY,
+)
+
+
+async def send_to_api(telegram_id, media_type, media_path, caption="", media=None):
+    """Ставит пост в очередь отправки во Flask API (запись на диск; доставка — в фоне, с повторами)"""
+    data = {
+        'telegram_id': telegram_id,
+        'media_type': media_type,
+        'media_path': media_path,
+        'caption': caption or ''
+    }
+    if media:
+        data.update(media)  # media_variants, media_width, ... (см. POST_MEDIA_COLUMNS в app.py)
+    await outbox.add(data)
 
 
 async def create_login_token(telegram_id: int, first_name: str = "", last_name: str = "", username: str = "") -> str | None:
@@ -59,19 +216,19 @@ async def create_login_token(telegram_id: int, first_name: str = "", last_name:
         payload["last_name"] = last_name
     if username is not None:
         payload["username"] = username.lstrip("@")
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{API_BASE_URL}/create-login-token",
-                json=payload,
-            ) as resp:
-                if resp.status != 200:
-                    return None
-                data = await resp.json()
-                if data.get("ok") and data.get("login_url"):
-                    return data["login_url"]
-        except Exception as e:
-            print(f"Ошибка create-login-token: {e}")
+    session = api.session()
+    try:
+        async with session.post(
+            f"{API_BASE_URL}/create-login-token",
+            json=payload,
+        ) as resp:
+            if resp.status != 200:
+                return None
+            data = await resp.json()
+            if data.get("ok") and data.get("login_url"):
+                return data["login_url"]
+    except Exception as e:
+        print(f"Ошибка create-login-token: {e}")
     return None
 
 
@@ -113,33 +270,77 @@ async def handle_channel_post(message: Message):
     media_type = None
     file_id = None
     ext = "jpg"
+    source = None  # объект Telegram с width/height (и duration/thumbnail у видео)
 
     if message.photo:
-        file_id = message.photo[-1].file_id
+        source = message.photo[-1]
+        file_id = source.file_id
         media_type = "photo"
         ext = "jpg"
     elif message.video:
+        source = message.video
         file_id = message.video.file_id
         media_type = "video"
         ext = "mp4"
     elif message.animation:
+        source = message.animation
         file_id = message.animation.file_id
         media_type = "video"
         ext = "mp4" # Сейвим гифки как видео
 
     if file_id:
-        filename = f"{message.message_id}_{datetime.now().strftime('%H%M%S')}.{ext}"
-        full_path = os.path.join(UPLOAD_FOLDER, filename)
-        
-        if await download_media(file_id, full_path):
+        _ingest_started[message.message_id] = time.monotonic()
+        # Этот файл уже есть на сайте: не качаем и не пересчитываем копии/метаданные
+        known = await lookup_media(source.file_unique_id)
+        if known:
+            media = dict(known.get("media") or {}, file_unique_id=source.file_unique_id)
+            await send_to_api(message.message_id, media_type, known["media_path"], message.caption, media)
+            POSTS_QUEUED.inc("known")
+            print(f"✅ Пост {message.message_id} поставлен в очередь на сайт (файл уже был сохранён).")
+            return
+
+        # Скачиваем во временный файл и переименовываем по хешу содержимого:
+        # такое имя не меняется, и сайт отдаёт его с Cache-Control: immutable
+        tmp_name = f".{message.message_id}_{datetime.now().strftime('%H%M%S')}.{ext}.part"
+
+        stored = await download_media(file_id, tmp_name, ext)
+        if stored:
             # Передаем относительный путь для сайта
-            relative_path = filename 
-            await send_to_api(message.message_id, media_type, relative_path, message.caption)
-            print(f"✅ Пост {message.message_id} отправлен на сайт.")
+            relative_path, digest, size = stored
+            poster = None
+            thumbnail = getattr(source, "thumbnail", None)
+            if media_type != "photo" and thumbnail and not has_ffmpeg():
+                poster = await download_thumbnail(thumbnail, message.message_id)
+            media = await build_meta(relative_path, media_type, poster)
+            # Размеры и длительность от Telegram точнее, чем у превью
+            for key, value in (("media_width", source.width), ("media_height", source.height),
+                               ("media_duration", getattr(source, "duration", None))):
+                if value:
+                    media[key] = value
+            if media_type == "photo":
+                media["media_variants"] = await build_variants(relative_path)
+            media.update(file_unique_id=source.file_unique_id, media_sha256=digest, media_size=size)
+            await send_to_api(message.message_id, media_type, relative_path, message.caption, media)
+            POSTS_QUEUED.inc("downloaded")
+            print(f"✅ Пост {message.message_id} поставлен в очередь на сайт.")
+        else:
+            _ingest_started.pop(message.message_id, None)
 
 async def main():
     print(f"Бот запущен. Слушаю канал {CHANNEL_USERNAME}...")
-    await dp.start_polling(bot)
+    metrics_runner = None
+    if BOT_METRICS_PORT:
+        metrics_runner = await serve_metrics(metrics, BOT_METRICS_HOST, BOT_METRICS_PORT)
+        print(f"Метрики: http://{BOT_METRICS_HOST}:{BOT_METRICS_PORT}/metrics")
+    # Сначала дочищаем то, что не успели отправить до перезапуска
+    await outbox.start()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await outbox.stop()
+        await api.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
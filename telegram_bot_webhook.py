@@ -1,7 +1,9 @@
 import asyncio
-import aiohttp
+import hmac
+import json
 import aiofiles
 import os
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
@@ -10,6 +12,10 @@ from aiohttp import web
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 import cloudinary
 import cloudinary.uploader
+
+from api_client import ApiClient
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, SLOW_BUCKETS
+from upload_queue import UploadQueue
 cloudinary.config( 
   secure = True
 )
@@ -21,12 +27,45 @@ CHANNEL_USERNAME = os.environ.get("CHANNEL_USERNAME", "@postshitpostshit")
 _PORT = int(os.environ.get("PORT", 80))
 API_BASE_URL = (os.environ.get("API_BASE_URL") or f"http://localhost:{_PORT}/api").rstrip("/")
 LOGIN_TOKEN_SECRET = os.environ.get("LOGIN_TOKEN_SECRET", "")
+# GET /metrics и /upload-queue открыты на том же публичном порту, что и /webhook:
+# если задан METRICS_TOKEN — только с заголовком Authorization: Bearer <токен> (как /metrics сайта)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
 # Важно: папка uploads должна быть доступна Flask-серверу
 UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "uploads") 
 
+# Очередь загрузок в Cloudinary: сколько загрузок одновременно, размер очереди, повторы и паузы между ними (сек)
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 2))
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", 100))
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", 3))
+UPLOAD_RETRY_BASE_DELAY = float(os.environ.get("UPLOAD_RETRY_BASE_DELAY", 1))
+UPLOAD_RETRY_MAX_DELAY = float(os.environ.get("UPLOAD_RETRY_MAX_DELAY", 30))
+
+# HTTP-клиент к Flask API: одна keep-alive сессия на процесс; посты, пришедшие в пределах
+# API_BATCH_WINDOW_MS, уходят одним POST /api/posts/batch (не больше API_BATCH_MAX)
+API_CONNECTIONS = int(os.environ.get("API_CONNECTIONS", 10))
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", 30))
+API_BATCH_WINDOW_MS = int(os.environ.get("API_BATCH_WINDOW_MS", 200))
+API_BATCH_MAX = int(os.environ.get("API_BATCH_MAX", 50))
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
+api = ApiClient(
+    API_BASE_URL,
+    connections=API_CONNECTIONS,
+    timeout=API_TIMEOUT,
+    batch_window=API_BATCH_WINDOW_MS / 1000,
+    batch_max=API_BATCH_MAX,
+)
+
+metrics = Registry()
+INGEST_SECONDS = metrics.histogram(
+    "postshet_bot_ingest_seconds", "От channel_post до подтверждения поста API", buckets=SLOW_BUCKETS,
+)
+GET_FILE_SECONDS = metrics.histogram("postshet_bot_get_file_seconds", "Запрос getFile к Telegram", ("result",))
+UPLOAD_SECONDS = metrics.histogram(
+    "postshet_bot_upload_seconds", "Попытка загрузки в Cloudinary", ("result",), SLOW_BUCKETS,
+)
 
 async def download_media(file_id, destination):
     """Скачивает файл напрямую через bot.download"""
@@ -38,20 +77,14 @@ async def download_media(file_id, destination):
         return False
 
 async def send_to_api(telegram_id, media_type, media_path, caption=""):
-    """Отправляет данные на Flask API"""
-    async with aiohttp.ClientSession() as session:
-        data = {
-            'telegram_id': telegram_id,
-            'media_type': media_type,
-            'media_path': media_path,
-            'caption': caption or ''
-        }
-        try:
-            async with session.post(f"{API_BASE_URL}/posts", json=data) as resp:
-                return resp.status == 200
-        except Exception as e:
-            print(f"Ошибка связи с API: {e}")
-            return False
+    """Отправляет пост во Flask API (вместе с постами, пришедшими почти одновременно, — одним запросом)"""
+    data = {
+        'telegram_id': telegram_id,
+        'media_type': media_type,
+        'media_path': media_path,
+        'caption': caption or ''
+    }
+    return await api.send_post(data)
 
 
 async def create_login_token(telegram_id: int, first_name: str = "", last_name: str = "", username: str = "") -> str | None:
@@ -65,19 +98,19 @@ async def create_login_token(telegram_id: int, first_name: str = "", last_name:
         payload["last_name"] = last_name
     if username is not None:
         payload["username"] = username.lstrip("@")
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{API_BASE_URL}/create-login-token",
-                json=payload,
-            ) as resp:
-                if resp.status != 200:
-                    return None
-                data = await resp.json()
-                if data.get("ok") and data.get("login_url"):
-                    return data["login_url"]
-        except Exception as e:
-            print(f"Ошибка create-login-token: {e}")
+    session = api.session()
+    try:
+        async with session.post(
+            f"{API_BASE_URL}/create-login-token",
+            json=payload,
+        ) as resp:
+            if resp.status != 200:
+                return None
+            data = await resp.json()
+            if data.get("ok") and data.get("login_url"):
+                return data["login_url"]
+    except Exception as e:
+        print(f"Ошибка create-login-token: {e}")
     return None
 
 
@@ -97,19 +130,19 @@ async def download_channel_avatar(chat_id: int, destination: str) -> bool:
 
 async def update_channel_info(name: str, avatar_url: str = ""):
     """Обновить информацию о канале через Flask API"""
-    async with aiohttp.ClientSession() as session:
-        data = {
-            'name': name,
-            'avatar_url': avatar_url or ''
-        }
-        try:
-            async with session.post(f"{API_BASE_URL}/channel-info", json=data) as resp:
-                if resp.status == 200:
-                    print(f"✅ Информация о канале обновлена: {name}")
-                    return True
-        except Exception as e:
-            print(f"Ошибка обновления channel-info: {e}")
-        return False
+    session = api.session()
+    data = {
+        'name': name,
+        'avatar_url': avatar_url or ''
+    }
+    try:
+        async with session.post(f"{API_BASE_URL}/channel-info", json=data) as resp:
+            if resp.status == 200:
+                print(f"✅ Информация о канале обновлена: {name}")
+                return True
+    except Exception as e:
+        print(f"Ошибка обновления channel-info: {e}")
+    return False
 
 
 @dp.message(F.text.startswith("/start"))
@@ -161,42 +194,106 @@ async def handle_channel_post(message: Message):
         media_type = "video"
 
     if file_id:
-            # 1. Получаем путь файла в Telegram
+        received_at = time.monotonic()
+        # Ссылку на файл получаем сразу (это быстрый запрос), а саму загрузку в Cloudinary
+        # делает очередь в пуле потоков — event loop не ждёт её
+        try:
             file = await bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-
-            try:
-                # 2. Загружаем в Cloudinary
-                # Добавим resource_type="auto", чтобы корректно грузились и фото, и видео (GIF)
-                upload_result = cloudinary.uploader.upload(
-                    file_url, 
-                    folder="telegram_posts",
-                    resource_type="auto" 
-                )
-                
-                # 3. Достаем прямую безопасную ссылку
-                cloudinary_url = upload_result.get("secure_url")
-                
-                if not cloudinary_url:
-                    print("❌ Не удалось получить URL от Cloudinary")
-                    return
-
-                print(f"🔗 Ссылка Cloudinary: {cloudinary_url}")
-
-                # 4. Отправляем ССЫЛКУ в твой Flask API
-                success = await send_to_api(
-                    telegram_id=message.message_id,
-                    media_type=media_type,
-                    media_path=cloudinary_url, # ВАЖНО: Flask должен записать это в БД «как есть»
-                    caption=message.caption
-                )
-                
-                if success:
-                    print(f"✅ Пост {message.message_id} успешно сохранен в БД через API")
-
-            except Exception as e:
-                print(f"❌ Ошибка Cloudinary или API: {e}")
-            
+        except Exception:
+            GET_FILE_SECONDS.observe(time.monotonic() - received_at, "error")
+            raise
+        GET_FILE_SECONDS.observe(time.monotonic() - received_at, "ok")
+        file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
+        await upload_queue.submit({
+            "telegram_id": message.message_id,
+            "media_type": media_type,
+            "file_url": file_url,
+            "caption": message.caption,
+            "received_at": received_at,
+        })
+
+
+def upload_to_cloudinary(job):
+    """Блокирующая загрузка в Cloudinary (выполняется в потоке очереди). Возвращает secure_url."""
+    # resource_type="auto", чтобы корректно грузились и фото, и видео (GIF)
+    started = time.perf_counter()
+    try:
+        upload_result = cloudinary.uploader.upload(job["file_url"], folder="telegram_posts", resource_type="auto")
+    except Exception:
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, "error")
+        raise
+    UPLOAD_SECONDS.observe(time.perf_counter() - started, "ok")
+    cloudinary_url = upload_result.get("secure_url")
+    if not cloudinary_url:
+        raise RuntimeError("Cloudinary не вернул secure_url")
+    return cloudinary_url
+
+
+async def on_uploaded(job, cloudinary_url):
+    """Файл в Cloudinary — отправляем ССЫЛКУ во Flask API (Flask записывает её в БД «как есть»)."""
+    print(f"🔗 Ссылка Cloudinary: {cloudinary_url}")
+    success = await send_to_api(
+        telegram_id=job["telegram_id"],
+        media_type=job["media_type"],
+        media_path=cloudinary_url,
+        caption=job["caption"],
+    )
+    if success:
+        INGEST_SECONDS.observe(time.monotonic() - job["received_at"])
+        print(f"✅ Пост {job['telegram_id']} успешно сохранен в БД через API")
+
+
+upload_queue = UploadQueue(
+    upload_to_cloudinary,
+    on_uploaded,
+    concurrency=UPLOAD_CONCURRENCY,
+    maxsize=UPLOAD_QUEUE_SIZE,
+    retries=UPLOAD_RETRIES,
+    base_delay=UPLOAD_RETRY_BASE_DELAY,
+    max_delay=UPLOAD_RETRY_MAX_DELAY,
+)
+
+
+def _upload_queue_stats(*keys):
+    stats = upload_queue.stats()
+    return {(key,): stats[key] for key in keys}
+
+
+def _api_batches():
+    stats = api.stats()
+    return {("ok",): stats["batches"] - stats["failed_batches"], ("failed",): stats["failed_batches"]}
+
+
+metrics.callback("postshet_bot_upload_queue_jobs", "Задания очереди загрузок: ждут (depth) и загружаются (in_flight)",
+                 lambda: _upload_queue_stats("depth", "in_flight"), labels=("state",))
+metrics.callback("postshet_bot_upload_queue_capacity", "Размер очереди загрузок", lambda: upload_queue.stats()["capacity"])
+metrics.callback("postshet_bot_upload_events_total", "Загрузки в Cloudinary: успешные, повторы, неудачные",
+                 kind="counter", labels=("event",), fn=lambda: _upload_queue_stats("uploaded", "retries", "failed"))
+metrics.callback("postshet_bot_api_batches_total", "Пачки постов, отправленные в API", _api_batches,
+                 kind="counter", labels=("result",))
+
+
+def _monitoring_allowed(request):
+    """Проверка Authorization: Bearer <METRICS_TOKEN> для служебных маршрутов (без токена — открыты)."""
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
+
+
+async def upload_queue_stats(request):
+    """GET /upload-queue — глубина очереди загрузок и счётчики (для мониторинга)."""
+    if not _monitoring_allowed(request):
+        return web.json_response({"error": "forbidden"}, status=403)
+    return web.Response(text=json.dumps(upload_queue.stats()), content_type="application/json")
+
+
+async def metrics_endpoint(request):
+    """GET /metrics — метрики бота в формате Prometheus."""
+    if not _monitoring_allowed(request):
+        return web.json_response({"error": "forbidden"}, status=403)
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
 async def on_startup(bot: Bot):
     # Устанавливаем Webhook при запуске
     webhook_url = f"{os.environ.get('RENDER_EXTERNAL_URL')}/webhook"
@@ -212,15 +309,22 @@ def main():
     app = web.Application()
 
     # Привязываем aiogram к пути /webhook
+    # handle_in_background: Telegram получает 200 сразу, обработка апдейта идёт отдельной задачей
     webhook_requests_handler = SimpleRequestHandler(
         dispatcher=dp,
         bot=bot,
+        handle_in_background=True,
     )
     webhook_requests_handler.register(app, path="/webhook")
+    app.router.add_get("/upload-queue", upload_queue_stats)
+    app.router.add_get("/metrics", metrics_endpoint)
 
     # Регистрируем функцию запуска
     setup_application(app, dp, bot=bot)
     app.on_startup.append(lambda _: on_startup(bot))
+    app.on_startup.append(lambda _: upload_queue.start())
+    app.on_shutdown.append(lambda _: upload_queue.stop())
+    app.on_shutdown.append(lambda _: api.close())
 
     # Запускаем сервер
     web.run_app(app, host=WEB_SERVER_HOST, port=WEB_SERVER_PORT)
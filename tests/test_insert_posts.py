@@ -0,0 +1,60 @@
+"""
+Пакетная вставка постов (insert_posts): число SQL-запросов не растёт с размером пачки.
+
+Нужна PostgreSQL из DATABASE_URL; всё выполняется в транзакции, которая откатывается.
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_TELEGRAM_ID = -900000000  # ниже bench_seed.BENCH_ID_BASE: с реальными постами не пересекается
+
+
+@unittest.skipUnless(os.getenv('DATABASE_URL'), 'нужна PostgreSQL из DATABASE_URL')
+class InsertPostsStatementsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as app_module
+        import db_trace
+        cls.app = app_module
+        cls.db_trace = db_trace
+
+    def count_statements(self, size):
+        """Запросов к БД на insert_posts пачки из size новых постов с медиа и file_unique_id."""
+        posts = [{
+            'telegram_id': TEST_TELEGRAM_ID - i,
+            'media_type': 'photo',
+            'media_path': f'test_insert_posts_{i}.jpg',
+            'caption': f'пост {i}',
+            'file_unique_id': f'test-insert-posts-{i}',
+            'media_sha256': f'{i:064x}',
+            'media_size': 1000 + i,
+        } for i in range(size)]
+        statements = []
+
+        def observe(cursor, sql, params, seconds):
+            statements.append(self.db_trace.statement_kind(sql))
+
+        with self.app.get_db() as conn:
+            c = conn.cursor()
+            self.db_trace.add_observer(observe)
+            try:
+                result = self.app.insert_posts(c, posts)
+            finally:
+                self.db_trace.remove_observer(observe)
+                conn.rollback()
+        self.assertEqual([created for _, created in result], [True] * size)
+        return statements
+
+    def test_batch_is_not_n_plus_one(self):
+        small, large = self.count_statements(2), self.count_statements(8)
+        self.assertEqual(len(small), len(large), large)
+        # INSERT постов, UPDATE media_objects, INSERT telegram_media, SELECT pg_notify
+        self.assertLessEqual(len(large), 4, large)
+
+
+if __name__ == '__main__':
+    unittest.main()
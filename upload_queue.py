@@ -0,0 +1,114 @@
+"""
+Ограниченная очередь загрузок для webhook-бота.
+
+Cloudinary SDK синхронный: вызов cloudinary.uploader.upload() прямо в обработчике останавливает
+весь event loop (и ответы на webhook, и /start login) на время загрузки видео. Здесь загрузки
+выполняют воркеры очереди: блокирующая функция идёт в пуле потоков, одновременно не больше
+concurrency штук, неудачная попытка повторяется с экспоненциальной паузой и разбросом.
+Очередь ограничена maxsize: при наплыве submit() ждёт места, а не копит задания в памяти без предела.
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadQueue:
+    """
+    upload_fn(job) — блокирующая загрузка (выполняется в потоке), возвращает результат;
+    on_uploaded(job, result) — корутина, вызывается после успешной загрузки;
+    retries — сколько раз повторять неудачную загрузку; base_delay / max_delay — пауза перед повтором, сек.
+    """
+
+    def __init__(self, upload_fn, on_uploaded, concurrency=2, maxsize=100, retries=3, base_delay=1.0, max_delay=30.0):
+        self.upload_fn = upload_fn
+        self.on_uploaded = on_uploaded
+        self.concurrency = max(1, concurrency)
+        self.retries = max(0, retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._executor = None
+        self._workers = []
+        self._in_flight = 0
+        self._max_depth = 0
+        self._stats = {'enqueued': 0, 'uploaded': 0, 'retries': 0, 'failed': 0}
+        self._upload_seconds = 0.0
+
+    async def start(self):
+        if self._workers:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='upload')
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout=30.0):
+        """Дождаться, пока очередь опустеет (не дольше timeout), и остановить воркеры."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Warning: очередь загрузок остановлена, не загружено: {self._queue.qsize() + self._in_flight}")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(self, job):
+        """Поставить задание в очередь; если она заполнена — подождать места."""
+        await self._queue.put(job)
+        self._stats['enqueued'] += 1
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def backoff(self, attempt):
+        """Пауза перед повтором номер attempt (с 1): удваивается, с разбросом ±20%, не больше max_delay."""
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            self._in_flight += 1
+            try:
+                result = await self._upload(loop, job)
+                if result is not None:
+                    await self.on_uploaded(job, result)
+            except Exception as e:
+                print(f"Ошибка обработки загрузки: {e}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    async def _upload(self, loop, job):
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, self.upload_fn, job)
+            except Exception as e:
+                self._upload_seconds += time.perf_counter() - started
+                if attempt == self.retries:
+                    self._stats['failed'] += 1
+                    print(f"❌ Загрузка не удалась после {attempt + 1} попыток: {e}")
+                    return None
+                self._stats['retries'] += 1
+                delay = self.backoff(attempt + 1)
+                print(f"Загрузка не удалась ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            self._upload_seconds += time.perf_counter() - started
+            self._stats['uploaded'] += 1
+            return result
+
+    def stats(self):
+        data = dict(self._stats)
+        data.update({
+            'depth': self._queue.qsize(),
+            'max_depth': self._max_depth,
+            'capacity': self._queue.maxsize,
+            'in_flight': self._in_flight,
+            'concurrency': self.concurrency,
+            'upload_seconds': round(self._upload_seconds, 3),
+        })
+        return data